@@ -0,0 +1,7 @@
+"""
+Benchmarks for the tracker, the database layer and the web server.
+
+synthetic generates cached test databases, suite times the hot paths against
+them and writes JSON, and compare diffs two result files. rule_matching and
+dashboard_load are standalone scripts for a closer look at one area.
+"""
@@ -0,0 +1,57 @@
+"""
+Compares two benchmark result files from benchmarks/suite.py.
+
+    python -m benchmarks.compare baseline.json results.json --threshold 0.1
+
+Prints every measurement present in both files with its relative change.
+Exits with status 1 if any measurement got worse by more than --threshold
+(a fraction: 0.1 = 10%), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+def load(path):
+    with open(path) as f:
+        document = json.load(f)
+    return document["meta"], document["results"]
+
+def compare(baseline, current, threshold=0.1):
+    """Returns [(name, old, new, change, regressed)] for the measurements in both result sets."""
+    rows = []
+    for name in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[name], current[name]
+        if old["unit"] != new["unit"] or not old["value"]:
+            continue
+        change = (new["value"] - old["value"]) / old["value"]
+        worse = -change if old["higher_is_better"] else change
+        rows.append((name, old, new, change, worse > threshold))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    (old_meta, baseline), (new_meta, current) = load(args.baseline), load(args.current)
+    if old_meta.get("database") != new_meta.get("database"):
+        print("warning: the result files were measured on different synthetic databases", file=sys.stderr)
+    print(f"{(old_meta.get('commit') or '?')[:10]} -> {(new_meta.get('commit') or '?')[:10]}")
+
+    rows = compare(baseline, current, args.threshold)
+    width = max((len(name) for name, *_ in rows), default=10)
+    for name, old, new, change, regressed in rows:
+        marker = "  REGRESSION" if regressed else ""
+        print(f"  {name:<{width}} {old['value']:>12.3f} -> {new['value']:>12.3f} {old['unit']:<9} {change:+7.1%}{marker}")
+    for name in sorted(baseline.keys() ^ current.keys()):
+        print(f"  {name:<{width}} only in {'baseline' if name in baseline else 'current'}")
+
+    regressions = sum(1 for *_, regressed in rows if regressed)
+    if regressions:
+        print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Load test: concurrent dashboard clients against the web server.
+
+Starts uvicorn in a subprocess (so the clients don't share its GIL) on a
+synthetic database from benchmarks/synthetic.py, then runs --clients
+concurrent clients that each repeat a full dashboard load for a random day:
+/api/data plus /api/dashboard, or with --fan-out the five requests the page
+made before /api/dashboard existed (/api/data, /api/activities_by_date and
+the three summaries). A separate probe requests /api/live every 50 ms.
+Because that endpoint never touches the database, its latency shows how long
+the event loop itself was blocked. Reports p50/p95/p99/max per endpoint.
+
+    python benchmarks/dashboard_load.py --days 90 --clients 20 --duration 15
+
+Needs httpx (installed alongside FastAPI's test client).
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+from benchmarks import synthetic
+
+# Points the server at the benchmark database before the app module is imported
+SERVER = """
+import sys
+sys.path.insert(0, {root!r})
+from src import database as db
+db.DB_FILE = {db_file!r}
+import uvicorn
+uvicorn.run("src.main:app", host="127.0.0.1", port={port}, log_level="warning")
+"""
+
+ENDPOINTS = ("/api/data", "/api/dashboard")
+FAN_OUT_ENDPOINTS = ("/api/data", "/api/activities_by_date", "/api/summary/daily", "/api/summary/weekly", "/api/summary/monthly")
+
+def wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/live").raise_for_status()
+            return
+        except httpx.HTTPError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def dashboard_client(client, endpoints, days, deadline, latencies, rng):
+    while time.perf_counter() < deadline:
+        day = (date.today() - timedelta(days=rng.randrange(days))).isoformat()
+        for path in endpoints:
+            if path == "/api/data":
+                params = {}
+            elif path == "/api/dashboard":
+                params = {"date": day}
+            else:
+                params = {"selected_date": day}
+            started = time.perf_counter()
+            response = await client.get(path, params=params)
+            response.raise_for_status()
+            latencies[path].append(time.perf_counter() - started)
+
+async def loop_probe(client, deadline, latencies):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await client.get("/api/live")
+        latencies["/api/live"].append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+async def drive(port, endpoints, clients, duration, days, seed):
+    latencies = {path: [] for path in endpoints + ("/api/live",)}
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=clients + 1)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        await asyncio.gather(
+            loop_probe(client, deadline, latencies),
+            *(dashboard_client(client, endpoints, days, deadline, latencies, random.Random(seed + i)) for i in range(clients)),
+        )
+    return latencies
+
+def run(days, per_day, clients, duration, port=8765, seed=0, endpoints=ENDPOINTS):
+    """Serves a cached synthetic database of `days` workdays (see benchmarks/synthetic.py) and drives it."""
+    path = synthetic.generate(days * per_day, seed=seed, per_day=per_day)
+    server = subprocess.Popen([sys.executable, "-c", SERVER.format(root=ROOT, db_file=path, port=port)])
+    try:
+        wait_until_up(port)
+        # Workdays only, so the history spans about 7/5 as many calendar days
+        return asyncio.run(drive(port, endpoints, clients, duration, days * 7 // 5, seed))
+    finally:
+        server.terminate()
+        server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--per-day", type=int, default=400, help="Activities per day")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=15, help="Seconds")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fan-out", action="store_true", help="Load the dashboard with the old five requests")
+    args = parser.parse_args()
+
+    endpoints = FAN_OUT_ENDPOINTS if args.fan_out else ENDPOINTS
+    latencies = run(args.days, args.per_day, args.clients, args.duration, args.port, endpoints=endpoints)
+    loads = len(latencies["/api/data"])
+    print(f"{args.clients} clients, {args.days} days x {args.per_day} activities, {args.duration:.0f}s: "
+          f"{loads / args.duration:.1f} dashboard loads/s")
+    print(f"  {'endpoint':<26} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for path, values in latencies.items():
+        if values:
+            stats = [percentile(values, p) * 1000 for p in (50, 95, 99)] + [max(values) * 1000]
+            print(f"  {path:<26} {len(values):>6} " + " ".join(f"{v:8.1f}" for v in stats))
+
+if __name__ == "__main__":
+    main()
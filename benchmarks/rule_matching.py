@@ -0,0 +1,108 @@
+"""
+Micro-benchmark: per-tick rule matching in start_tracking().
+
+Compares the original loop (get_rules() join + lowercased `in` check per rule)
+with the compiled RuleEngine on a throwaway database.
+
+    python benchmarks/rule_matching.py --rules 500 --titles 2000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+# Import the tracker modules the same way src/tracker.py does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src")))
+
+import database as db
+from rules import RuleEngine
+
+
+def random_word(rng, low=4, high=10):
+    return "".join(rng.choice(string.ascii_letters) for _ in range(rng.randint(low, high)))
+
+def populate(rule_count, rng):
+    """Creates projects, tasks and rule_count rules; returns the patterns."""
+    projects = [db.get_or_create_project(f"Project {i}") for i in range(max(1, rule_count // 20))]
+    patterns = []
+    with db.connection():
+        for i in range(rule_count):
+            project_id = rng.choice(projects)
+            task_id = db.create_task(project_id, f"Task {i}") if i % 2 else None
+            pattern = f"{random_word(rng)} {random_word(rng)}"
+            db.add_rule(pattern, project_id, task_id)
+            patterns.append(pattern)
+    return patterns
+
+def make_titles(count, patterns, hit_ratio, rng):
+    titles = []
+    for _ in range(count):
+        words = [random_word(rng) for _ in range(rng.randint(3, 8))]
+        if patterns and rng.random() < hit_ratio:
+            words.insert(rng.randint(0, len(words)), rng.choice(patterns).upper())
+        titles.append(" - ".join(words))
+    return titles
+
+def legacy_match(window_title, rules=None):
+    """The loop from start_tracking() before RuleEngine."""
+    if rules is None:
+        rules = db.get_rules()
+    for rule in rules:
+        if rule['pattern'].lower() in window_title.lower():
+            return rule
+    return None
+
+def timed(fn, titles, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for title in titles:
+            fn(title)
+        best = min(best, time.perf_counter() - start)
+    return best / len(titles)
+
+def run(rule_count, title_count, hit_ratio, repeat, seed=0):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.create_tables()
+        patterns = populate(rule_count, rng)
+        titles = make_titles(title_count, patterns, hit_ratio, rng)
+
+        rules = db.get_rules()
+        engine = RuleEngine()
+        engine.refresh()
+
+        # Both implementations must agree before their timings mean anything
+        for title in titles:
+            expected = legacy_match(title, rules)
+            actual = engine.match(title)
+            assert (expected and expected['id']) == (actual and actual['id']), title
+
+        results = {
+            "legacy (get_rules + scan)": timed(legacy_match, titles, repeat),
+            "legacy (scan only)": timed(lambda t: legacy_match(t, rules), titles, repeat),
+            "RuleEngine.match": timed(engine.match, titles, repeat),
+        }
+        db.close_connections()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=500)
+    parser.add_argument("--titles", type=int, default=2000)
+    parser.add_argument("--hit-ratio", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run(args.rules, args.titles, args.hit_ratio, args.repeat)
+    print(f"{args.rules} rules, {args.titles} titles, best of {args.repeat}")
+    baseline = results["legacy (get_rules + scan)"]
+    for name, per_call in results.items():
+        print(f"  {name:<28} {per_call * 1e6:10.1f} us/tick  {baseline / per_call:7.1f}x")
+
+if __name__ == "__main__":
+    main()
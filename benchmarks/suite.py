@@ -0,0 +1,377 @@
+"""
+Benchmark suite: times the hot paths against a synthetic database and writes the results as JSON.
+
+Groups:
+  writes     db.add_activity() one call at a time, add_activities() in
+             journal-sized batches and gzip NDJSON uploads through
+             ingest.ingest_upload(), on a copy of the database
+  rules      RuleEngine.compile() and the per-tick RuleEngine.match() the
+             tracker runs on every window title
+  tracker    window switches replayed through TrackerEngine on a copy of the
+             database, then a reclassify.py dry run over them; fails if any
+             switch isn't recorded or the dry run would move any of them
+  endpoints  every endpoint in src/main.py through the ASGI test client
+             (routes that can't be timed this way are listed in meta.skipped_endpoints)
+  export     export.export_activities() in each text format over the last
+             --export-days days of data
+
+    python -m benchmarks.suite --size 1m -o results.json
+    python -m benchmarks.compare baseline.json results.json
+
+Results are flat: each named measurement has a value, a unit and whether
+higher is better, so any two result files can be compared.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks import synthetic
+from src import database as db
+
+GROUPS = ("writes", "rules", "tracker", "endpoints", "export")
+RESULTS_VERSION = 1
+
+# name -> (path, params for a day, whether to clear the summary cache before each request)
+ENDPOINTS = {
+    "GET /": ("/", lambda day: {}, False),
+    "GET /api/data": ("/api/data", lambda day: {}, False),
+    "GET /api/activities_by_date": ("/api/activities_by_date", lambda day: {"selected_date": day}, False),
+    "GET /api/timeline (day)": ("/api/timeline", lambda day: {"start_date": day, "pixels": 600}, False),
+    "GET /api/timeline (4 weeks)": ("/api/timeline", lambda day: {"start_date": day - timedelta(days=27), "end_date": day}, False),
+    "GET /api/activities (page)": ("/api/activities", lambda day: {"start_date": day, "limit": 500}, False),
+    "GET /api/activities (ndjson, week)": ("/api/activities", lambda day: {"start_date": day - timedelta(days=6), "end_date": day, "limit": 10000, "format": "ndjson"}, False),
+    "GET /api/export/activities (csv, week)": ("/api/export/activities", lambda day: {"start_date": day - timedelta(days=6), "end_date": day}, False),
+    "GET /api/export/activities (ndjson gzip, week)": ("/api/export/activities", lambda day: {"start_date": day - timedelta(days=6), "end_date": day, "format": "ndjson", "gzip": True}, False),
+    "GET /api/live": ("/api/live", lambda day: {}, False),
+    "GET /api/summary/daily": ("/api/summary/daily", lambda day: {"selected_date": day}, True),
+    "GET /api/summary/weekly": ("/api/summary/weekly", lambda day: {"selected_date": day}, True),
+    "GET /api/summary/monthly": ("/api/summary/monthly", lambda day: {"selected_date": day}, True),
+    # Always last month: closed, so every request after the warm-up is a cache hit
+    "GET /api/summary/monthly (cached)": ("/api/summary/monthly", lambda day: {"selected_date": date.today().replace(day=1) - timedelta(days=1)}, False),
+    "GET /api/reports/summary (csv)": ("/api/reports/summary", lambda day: {"summary_type": "weekly", "selected_date": day, "format": "csv"}, True),
+    "GET /api/dashboard": ("/api/dashboard", lambda day: {"date": day, "pixels": 600}, True),
+    "GET /api/devices": ("/api/devices", lambda day: {}, False),
+    "GET /api/search": ("/api/search", lambda day: {"q": "code"}, False),
+    "GET /api/search (day, project)": ("/api/search", lambda day: {"q": "code", "start_date": day, "end_date": day, "project_id": 1}, False),
+    "GET /metrics": ("/metrics", lambda day: {}, False),
+}
+# Polled and fetched by report_job(), timed as "POST /api/reports/jobs (year)"
+REPORT_JOB_ROUTES = ("/api/reports/jobs/{job_id}", "/api/reports/jobs/{job_id}/result")
+SKIPPED = {
+    "/api/live/stream": "endless Server-Sent Events stream; see benchmarks/dashboard_load.py",
+    "/api/live/task": "needs the embedded tracker",
+}
+
+def result(value, unit, higher_is_better, **extra):
+    return dict(value=value, unit=unit, higher_is_better=higher_is_better, **extra)
+
+def latency(samples, **extra):
+    """Median latency in ms, with the spread alongside."""
+    samples = sorted(s * 1000 for s in samples)
+    return result(
+        round(statistics.median(samples), 3), "ms", False,
+        min=round(samples[0], 3), p95=round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        n=len(samples), **extra
+    )
+
+def activity_days(count, rng):
+    """count random days that have activity, most recent day first."""
+    with db.connection() as conn:
+        days = [date.fromisoformat(row[0]) for row in conn.execute("SELECT day FROM daily_rollups GROUP BY day ORDER BY day DESC")]
+    return days[:1] + [rng.choice(days) for _ in range(count - 1)] if days else [date.today()] * count
+
+# --- Groups ---
+def bench_writes(path, calls=2000, batches=50, batch_size=100, uploads=10, upload_size=1000):
+    """Inserts into a copy of the database, so the cached file is never modified."""
+    from src import ingest
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_connections()
+        db.DB_FILE = shutil.copy(path, os.path.join(tmp, "writes.db"))
+        task_id = db.get_tasks()[0]['id']
+        t = datetime.now()
+
+        started = time.perf_counter()
+        for i in range(calls):
+            db.add_activity(task_id, "Benchmark", f"Window {i % 50}", t, t + timedelta(seconds=5))
+            t += timedelta(seconds=5)
+        single = time.perf_counter() - started
+
+        batch_times = []
+        for _ in range(batches):
+            rows = []
+            for i in range(batch_size):
+                rows.append((task_id, "Benchmark", f"Window {i % 50}", t, t + timedelta(seconds=5)))
+                t += timedelta(seconds=5)
+            started = time.perf_counter()
+            db.add_activities(rows)
+            batch_times.append(time.perf_counter() - started)
+
+        upload_times = []
+        for sequence in range(1, uploads + 1):
+            lines = []
+            for i in range(upload_size):
+                start_ms = db.to_epoch_ms(t)
+                lines.append(json.dumps({"id": f"{sequence}-{i}", "project": "Benchmark", "task": f"Task {i % 20}", "app_name": "Benchmark",
+                                         "window_title": f"Window {i % 50}", "start_ms": start_ms, "end_ms": start_ms + 5000}))
+                t += timedelta(seconds=5)
+            body = gzip.compress("\n".join(lines).encode("utf-8"))
+            started = time.perf_counter()
+            ingest.ingest_upload(body, "gzip", "benchmark", None, sequence)
+            upload_times.append(time.perf_counter() - started)
+        db.close_connections()
+    return {
+        "writes.add_activity": result(round(calls / single, 1), "rows/s", True, n=calls),
+        "writes.add_activities": result(round(batches * batch_size / sum(batch_times), 1), "rows/s", True, batch_size=batch_size, n=batches),
+        "writes.ingest": result(round(uploads * upload_size / sum(upload_times), 1), "rows/s", True, batch_size=upload_size, n=uploads),
+    }
+
+def bench_rules(path, titles=5000, repeat=3, seed=0):
+    from src.rules import RuleEngine
+
+    db.close_connections()
+    db.DB_FILE = path
+    with db.connection() as conn:
+        # Real titles, weighted by how often they occur, as the tracker would see them
+        sample = [row[0] for row in conn.execute(
+            "SELECT s.value FROM activities a JOIN strings s ON s.id = a.title_id ORDER BY a.id DESC LIMIT ?", (titles,)
+        )]
+    engine = RuleEngine()
+    compile_times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        engine.compile(db.get_rules()) # What refresh() does after a rule is added
+        compile_times.append(time.perf_counter() - started)
+
+    best, matched = float("inf"), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        matched = sum(1 for title in sample if engine.match(title))
+        best = min(best, time.perf_counter() - started)
+    return {
+        "rules.compile": latency(compile_times, rules=len(db.get_rules())),
+        "rules.match": result(round(best / max(len(sample), 1) * 1e6, 3), "us/title", False, titles=len(sample), matched=matched),
+    }
+
+def bench_tracker(path, switches=2000):
+    """
+    Replays window switches through TrackerEngine on a copy of the database.
+    A rule for a whole project matches every fifth window, so the run also
+    checks that its windows and the ones after them are recorded.
+    reclassify must agree with the tracker: on the same day, windows the
+    project rule matches but that were recorded under another project's task
+    (before the rule existed) move to the rule project's General task, and
+    nothing the tracker recorded moves.
+    """
+    from src import reclassify
+    from src.rules import DEFAULT_TASK_NAME
+    from src.engine import TrackerEngine
+    from src.journal import ActivityJournal
+    from src.window_source import ReplayWindowSource
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_connections()
+        db.DB_FILE = shutil.copy(path, os.path.join(tmp, "tracker.db"))
+        project_id = db.get_or_create_project("Benchmark")
+        editing = db.create_task(project_id, "Editing")
+        chat = db.get_or_create_project("Benchmark Chat")
+        db.add_rule("benchmark-editor", project_id, editing)
+        db.add_rule("benchmark-chat", chat, None)
+        titles = ("benchmark-editor - a.py", "benchmark-editor - b.py", "general - benchmark-chat",
+                  "benchmark-editor - c.py", "benchmark-editor - d.py")
+        events = [(i, "Benchmark", titles[i % len(titles)]) for i in range(switches)]
+
+        # On a day of its own, so the reclassify runs see only these activities
+        day = date.today() + timedelta(days=3650)
+        early = datetime.combine(day, datetime.min.time()).replace(hour=8)
+        misfiled = [(editing, "Benchmark", "general - benchmark-chat", early + timedelta(seconds=i), early + timedelta(seconds=i + 1))
+                    for i in range(20)]
+        db.add_activities(misfiled)
+        before = reclassify.reclassify(day, day, dry_run=True) # Chat's General task doesn't exist yet
+        with db.connection() as conn:
+            last_id = conn.execute("SELECT MAX(id) FROM activities").fetchone()[0]
+
+        source = ReplayWindowSource(events, speed=0, start=early.replace(hour=9))
+        engine = TrackerEngine(window_source=source, journal=ActivityJournal(spill_path=None), afk_timeout=3600)
+        started = time.perf_counter()
+        asyncio.run(engine.run())
+        elapsed = time.perf_counter() - started
+        with db.connection() as conn:
+            recorded = conn.execute("SELECT COUNT(*) FROM activities WHERE id > ?", (last_id,)).fetchone()[0]
+
+        general = db.get_or_create_task(chat, DEFAULT_TASK_NAME)
+        started = time.perf_counter()
+        report = reclassify.reclassify(day, day, dry_run=True)
+        reclassify_elapsed = time.perf_counter() - started
+        applied = reclassify.reclassify(day, day)
+        db.close_connections()
+    if recorded != switches:
+        raise RuntimeError(f"The tracker recorded {recorded} of {switches} replayed windows.")
+    expected = [(editing, chat, None, len(misfiled))]
+    if [(m['from_task_id'], m['to_project_id'], m['to_task_id'], m['activities']) for m in before['moves']] != expected:
+        raise RuntimeError(f"reclassify before the replay proposed {before['moves']}, expected {expected}.")
+    expected = [(editing, chat, general, len(misfiled))]
+    if [(m['from_task_id'], m['to_project_id'], m['to_task_id'], m['activities']) for m in report['moves']] != expected:
+        raise RuntimeError(f"reclassify after the replay proposed {report['moves']}, expected {expected}.")
+    if applied['moved'] != len(misfiled):
+        raise RuntimeError(f"reclassify moved {applied['moved']} of {len(misfiled)} misfiled activities.")
+    return {
+        "tracker.replay": result(round(switches / elapsed, 1), "switches/s", True, n=switches),
+        "tracker.reclassify": result(round(report['checked'] / reclassify_elapsed, 1), "rows/s", True, n=report['checked'], dry_run=True),
+    }
+
+def report_job(client, day):
+    """Submits a summary report for the year up to day, waits for it and fetches the result as CSV."""
+    response = client.post("/api/reports/jobs", json={"start_date": str(day - timedelta(days=364)), "end_date": str(day)})
+    response.raise_for_status()
+    job = response.json()
+    while job["status"] not in ("done", "failed"):
+        response = client.get(f"/api/reports/jobs/{job['id']}", params={"wait": 30})
+        response.raise_for_status()
+        job = response.json()
+    response = client.get(f"/api/reports/jobs/{job['id']}/result", params={"format": "csv"})
+    response.raise_for_status()
+    return response
+
+def bench_endpoints(path, repeat=20, seed=0):
+    from fastapi.testclient import TestClient
+    from src import main
+
+    db.close_connections()
+    db.DB_FILE = path
+    days = activity_days(repeat, random.Random(seed))
+    results = {}
+    with TestClient(main.app) as client:
+        covered = {url for url, _, _ in ENDPOINTS.values()} | set(REPORT_JOB_ROUTES)
+        for route in main.app.routes:
+            if getattr(route, "path", None) not in covered | set(SKIPPED) and "GET" in getattr(route, "methods", ()):
+                if not route.path.startswith(("/docs", "/redoc", "/openapi")):
+                    print(f"warning: no benchmark for {route.path}", file=sys.stderr)
+
+        for name, (url, params, cold) in ENDPOINTS.items():
+            samples, size = [], 0
+            client.get(url, params=params(days[0])) # Warm-up: imports, name cache, page cache
+            for day in days:
+                if cold:
+                    main.summary_cache.clear()
+                started = time.perf_counter()
+                response = client.get(url, params=params(day))
+                samples.append(time.perf_counter() - started)
+                response.raise_for_status()
+                size = max(size, len(response.content))
+            results[f"endpoints.{name}"] = latency(samples, max_bytes=size)
+
+        samples, size = [], 0
+        report_job(client, days[0]) # Warm-up: starts the worker processes
+        for day in days:
+            started = time.perf_counter()
+            size = max(size, len(report_job(client, day).content))
+            samples.append(time.perf_counter() - started)
+        results["endpoints.POST /api/reports/jobs (year)"] = latency(samples, max_bytes=size)
+    db.close_connections()
+    return results
+
+def bench_export(path, days=30, repeat=3):
+    from src import export
+
+    db.close_connections()
+    db.DB_FILE = path
+    end = activity_days(1, random.Random(0))[0]
+    start = end - timedelta(days=days - 1)
+    results = {}
+    for format, compress in (("csv", False), ("csv", True), ("ndjson", False)):
+        best, size = float("inf"), 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with db.dedicated_connection(readonly=True) as conn:
+                size = sum(len(chunk) for chunk in export.export_activities(conn, format, compress, start_date=start, end_date=end))
+            best = min(best, time.perf_counter() - started)
+        with db.connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM activities WHERE start_ms >= ? AND start_ms < ?", db.day_bounds(start, end)).fetchone()[0]
+        name = f"export.{format}" + (".gz" if compress else "")
+        results[name] = result(round(rows / best, 1), "rows/s", True, rows=rows, bytes=size, seconds=round(best, 3))
+    db.close_connections()
+    return results
+
+def environment():
+    def git(*args):
+        try:
+            return subprocess.run(("git",) + args, capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+def run(activities, groups=GROUPS, projects=20, tasks=200, rules=500, seed=0, repeat=20, export_days=30):
+    """Runs the chosen groups and returns the results document."""
+    meta = environment()
+    started = time.perf_counter()
+    path = synthetic.generate(activities, projects, tasks, rules, seed)
+    meta.update(database=dict(activities=activities, projects=projects, tasks=tasks, rules=rules, seed=seed,
+                              bytes=os.path.getsize(path), generate_seconds=round(time.perf_counter() - started, 1)))
+
+    previous = db.DB_FILE
+    results = {}
+    try:
+        if "writes" in groups:
+            results.update(bench_writes(path))
+        if "rules" in groups:
+            results.update(bench_rules(path, seed=seed))
+        if "tracker" in groups:
+            results.update(bench_tracker(path))
+        if "endpoints" in groups:
+            results.update(bench_endpoints(path, repeat, seed))
+            meta["skipped_endpoints"] = SKIPPED
+        if "export" in groups:
+            results.update(bench_export(path, export_days))
+    finally:
+        db.close_connections()
+        db.DB_FILE = previous
+    return {"version": RESULTS_VERSION, "meta": meta, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="10k", help="10k, 1m, 10m or a number of activities")
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--rules", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=GROUPS, help="Groups to run")
+    parser.add_argument("--repeat", type=int, default=20, help="Requests per endpoint")
+    parser.add_argument("--export-days", type=int, default=30)
+    parser.add_argument("-o", "--output", help="Write the JSON here (default: standard output)")
+    args = parser.parse_args()
+
+    document = run(synthetic.parse_size(args.size), args.only, args.projects, args.tasks, args.rules, args.seed,
+                   args.repeat, args.export_days)
+    text = json.dumps(document, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Synthetic time tracking databases for benchmarks.
+
+Builds a database with the schema from db.create_tables() and fills it with
+a plausible history: workdays of a few hundred window switches, each with a
+heavy-tailed duration. Apps and window titles repeat with a Zipf-like skew,
+and work stays on one task for a stretch before moving on. Rules are drawn
+from the title vocabulary, so some of them match.
+
+Activities are bulk-inserted straight into the compact tables, and
+daily_rollups is then rebuilt with db.rebuild_rollups(). Millions of rows
+take minutes rather than hours. Generated files are cached by their
+parameters, so each size is only built once.
+
+    python -m benchmarks.synthetic --size 1m -o /tmp/1m.db
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src import database as db
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+INSERT_BATCH = 50_000 # rows per executemany and transaction
+
+APPS = {
+    "Code": ["{file} - {project} - Visual Studio Code", "Search: {word} - {project} - Visual Studio Code"],
+    "Firefox": ["{word} {word2} - Stack Overflow - Mozilla Firefox", "Pull request #{n} - {project} - Mozilla Firefox",
+                "{word} - Google Search - Mozilla Firefox", "Issue #{n}: {word} {word2} - Mozilla Firefox"],
+    "Slack": ["{word} (Channel) - {project} - Slack", "{person} (DM) - Slack"],
+    "Terminal": ["{person}@dev: ~/{project}", "python {file} - Terminal"],
+    "Outlook": ["Inbox - {person} - Outlook", "RE: {word} {word2} - Message (HTML)"],
+    "Zoom": ["Zoom Meeting", "{person}'s Personal Meeting Room"],
+    "Excel": ["{word}_{n}.xlsx - Excel"],
+    "Figma": ["{word} {word2} - Figma"],
+}
+WORDS = ("budget deploy review design parser cache timeline report invoice sprint onboarding migration "
+         "release roadmap retro standup metrics export backup search index rollup schema dashboard").split()
+PEOPLE = ("alex sam jordan kim lee morgan riley taylor casey jamie").split()
+
+
+def database_path(activities, projects=20, tasks=200, rules=500, seed=0, per_day=None, cache_dir=CACHE_DIR):
+    """Where the database for these parameters is (or would be) cached."""
+    name = f"synthetic-{activities}-p{projects}-t{tasks}-r{rules}-s{seed}" + (f"-d{per_day}" if per_day else "")
+    name += f"-v{len(db.MIGRATIONS)}.db"
+    return os.path.join(cache_dir, name)
+
+def generate(activities, projects=20, tasks=200, rules=500, seed=0, per_day=None, cache_dir=CACHE_DIR, path=None):
+    """
+    Returns the path of a synthetic database with these parameters, building it if needed.
+
+    per_day defaults to 400 activities per workday, stretched for large sizes
+    so the history covers at most ten years. The history ends yesterday.
+    path overrides the cache location (the file is then always rebuilt).
+    """
+    target = path or database_path(activities, projects, tasks, rules, seed, per_day, cache_dir)
+    if path is None and os.path.exists(target):
+        return target
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+
+    # Build beside the target and rename, so an interrupted run never leaves a half-filled cache entry
+    fd, building = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(os.path.abspath(target)))
+    os.close(fd)
+    os.remove(building)
+    previous = db.DB_FILE
+    db.close_connections()
+    db.DB_FILE = building
+    try:
+        db.create_tables()
+        _populate(random.Random(seed), activities, projects, tasks, rules, per_day or max(400, math.ceil(activities / 2600)))
+        with db.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.close_connections()
+        shutil.move(building, target)
+    finally:
+        db.close_connections()
+        db.DB_FILE = previous
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(building + suffix):
+                os.remove(building + suffix)
+    return target
+
+def _populate(rng, activity_count, project_count, task_count, rule_count, per_day):
+    project_names = [f"{rng.choice(WORDS).title()} {i}" for i in range(project_count)]
+    project_ids = [db.get_or_create_project(name) for name in project_names]
+    with db.connection():
+        task_ids = [db.create_task(rng.choice(project_ids), f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}")
+                    for i in range(task_count)]
+
+    # Title vocabulary per app; titles are drawn with a Zipf-like skew
+    vocabulary = {app: _titles(rng, templates, project_names, 2000) for app, templates in APPS.items()}
+    apps = list(APPS)
+    app_weights = [1 / (rank + 1) for rank in range(len(apps))]
+    with db.connection() as conn:
+        conn.executemany("INSERT OR IGNORE INTO strings (value) VALUES (?)",
+                         [(value,) for value in apps] + [(title,) for titles in vocabulary.values() for title in titles])
+        string_ids = dict(conn.execute("SELECT value, id FROM strings").fetchall())
+    title_ids = {app: [string_ids[title] for title in titles] for app, titles in vocabulary.items()}
+    title_cumulative = {app: list(_accumulate(1 / (rank + 1) ** 1.1 for rank in range(len(ids)))) for app, ids in title_ids.items()}
+
+    with db.connection():
+        for _ in range(rule_count):
+            app = rng.choice(apps)
+            title = rng.choice(vocabulary[app])
+            # One or two consecutive words of a real title, as a user would pick them
+            words = title.split()
+            start = rng.randrange(len(words))
+            pattern = " ".join(words[start:start + rng.randint(1, 2)])
+            if len(pattern) < 6 or not pattern[0].isalnum():
+                pattern = title
+            project_id = rng.choice(project_ids)
+            db.add_rule(pattern, project_id, rng.choice(task_ids) if rng.random() < 0.5 else None)
+
+    # Walk back from yesterday far enough to fit every activity on workdays
+    day, workdays = date.today(), math.ceil(activity_count / per_day)
+    while workdays:
+        day -= timedelta(days=1)
+        workdays -= day.weekday() < 5
+    remaining = activity_count
+    batch = []
+    task_id, task_left = rng.choice(task_ids), 0
+    while remaining:
+        if day.weekday() >= 5:
+            day += timedelta(days=1)
+            continue
+        start_of_day = datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.uniform(7.5, 10))
+        tz_offset = db.utc_offset_minutes(start_of_day)
+        t = db.to_epoch_ms(start_of_day)
+        # Durations are scaled to fit the day's activity into roughly a 9-10 hour window
+        count = min(remaining, per_day)
+        scale = min(1.0, 34_000_000 / (count * 60_000))
+        for _ in range(count):
+            if task_left == 0:
+                task_id, task_left = rng.choice(task_ids), max(1, int(rng.expovariate(1 / 30)))
+            task_left -= 1
+            app = rng.choices(apps, app_weights)[0]
+            title_id = rng.choices(title_ids[app], cum_weights=title_cumulative[app])[0]
+            duration = max(1000, int(rng.lognormvariate(9.9, 1.3) * scale)) # median ~20 s
+            batch.append((task_id, string_ids[app], title_id, t, t + duration, tz_offset))
+            t += duration + (rng.randint(60_000, 1_800_000) if rng.random() < 0.01 else rng.randint(0, 2000))
+            if len(batch) >= INSERT_BATCH:
+                _insert(batch)
+                batch = []
+        remaining -= count
+        day += timedelta(days=1)
+    if batch:
+        _insert(batch)
+    db.rebuild_rollups()
+
+def _insert(rows):
+    with db.connection() as conn:
+        conn.executemany(
+            "INSERT INTO activities (task_id, app_id, title_id, start_ms, end_ms, tz_offset) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+def _titles(rng, templates, project_names, count):
+    """Up to count distinct titles from the templates (fewer if they can't produce that many)."""
+    titles = set()
+    for _ in range(count * 5):
+        if len(titles) == count:
+            break
+        titles.add(rng.choice(templates).format(
+            file=f"{rng.choice(WORDS)}_{rng.randint(1, 400)}.py", project=rng.choice(project_names),
+            word=rng.choice(WORDS), word2=rng.choice(WORDS), person=rng.choice(PEOPLE), n=rng.randint(1, 9999),
+        ))
+    return sorted(titles)
+
+def _accumulate(values):
+    total = 0
+    for value in values:
+        total += value
+        yield total
+
+def parse_size(size):
+    """'10k', '1m', '10m' or a plain number of activities."""
+    return SIZES.get(size.lower()) or int(size)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", default="10k", help="10k, 1m, 10m or a number of activities")
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--rules", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the database here instead of the cache")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    path = generate(parse_size(args.size), args.projects, args.tasks, args.rules, args.seed, path=args.output)
+    print(f"{path} ({os.path.getsize(path) / 1e6:.1f} MB, {time.perf_counter() - started:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/
+    import database as db
+
+# Selectable output fields and the SQL that produces each one
+FIELDS = {
+    "id": "a.id",
+    "task_id": "a.task_id",
+    "project_id": "t.project_id",
+    "project_name": "p.name",
+    "task_name": "t.name",
+    "app_name": "app.value",
+    "window_title": "title.value",
+    "start_time": db.iso_sql("a.start_ms", "a.tz_offset"),
+    "end_time": db.iso_sql("a.end_ms", "a.tz_offset"),
+    "duration_seconds": "(a.end_ms - a.start_ms) / 1000.0",
+    "start_ms": "a.start_ms",
+    "end_ms": "a.end_ms",
+    "tz_offset": "a.tz_offset",
+}
+DEFAULT_FIELDS = ("id", "task_id", "app_name", "window_title", "start_time", "end_time")
+
+FETCH_SIZE = 500 # rows pulled from the cursor at a time
+
+def parse_fields(fields):
+    """Turns a comma-separated field list (or None for the defaults) into a tuple, rejecting unknown names."""
+    if not fields:
+        return DEFAULT_FIELDS
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown or not names:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Choose from {', '.join(FIELDS)}.")
+    return names
+
+def encode_cursor(start_ms, activity_id):
+    return f"{start_ms}_{activity_id}"
+
+def decode_cursor(cursor):
+    """Parses a cursor from encode_cursor(); raises ValueError if it is malformed."""
+    start_ms, activity_id = cursor.split("_")
+    return int(start_ms), int(activity_id)
+
+def build_query(fields=DEFAULT_FIELDS, start_date=None, end_date=None, project_id=None, task_id=None,
+                app_name=None, after=None, descending=False, limit=None, source="activities", window=(None, None)):
+    """
+    Returns (sql, params) selecting activities in (start_ms, id) order.
+
+    after is a decoded cursor: only rows strictly past it in the chosen
+    direction are returned, which is what makes the pages keyset-based rather
+    than OFFSET-based. The date range covers start_date through end_date
+    inclusive, by start time. source and window come from db.activity_windows()
+    and restrict the query to one window of the range.
+    """
+    # The cursor columns are always selected so the caller can build the next cursor
+    columns = [f"{FIELDS[name]} AS {name}" for name in fields]
+    columns += ["a.start_ms AS _cursor_ms", "a.id AS _cursor_id"]
+    where, params = [], {}
+
+    if start_date or end_date:
+        params["range_start"], params["range_end"] = db.day_bounds(start_date or end_date, end_date or start_date)
+        if start_date:
+            where.append("a.start_ms >= :range_start")
+        if end_date:
+            where.append("a.start_ms < :range_end")
+    if project_id is not None:
+        where.append("t.project_id = :project_id")
+        params["project_id"] = project_id
+    if task_id is not None:
+        where.append("a.task_id = :task_id")
+        params["task_id"] = task_id
+    if app_name is not None:
+        where.append("a.app_id = (SELECT id FROM strings WHERE value = :app_name)")
+        params["app_name"] = app_name
+    if after is not None:
+        params["after_ms"], params["after_id"] = after
+        if descending:
+            where.append("a.start_ms <= :after_ms AND (a.start_ms < :after_ms OR a.id < :after_id)")
+        else:
+            where.append("a.start_ms >= :after_ms AND (a.start_ms > :after_ms OR a.id > :after_id)")
+
+    if window != (None, None):
+        where.append(db.window_condition("a.start_ms", *window))
+
+    direction = "DESC" if descending else "ASC"
+    sql = f"""
+        SELECT {', '.join(columns)}
+        FROM {source} a
+        JOIN tasks t ON t.id = a.task_id
+        JOIN projects p ON p.id = t.project_id
+        JOIN strings app ON app.id = a.app_id
+        LEFT JOIN strings title ON title.id = a.title_id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY a.start_ms {direction}, a.id {direction}
+    """
+    if limit is not None:
+        sql += " LIMIT :limit"
+        params["limit"] = limit
+    return sql, params
+
+class ActivityPage:
+    """
+    Iterates one page of activity dicts straight from a cursor.
+
+    Rows are pulled FETCH_SIZE at a time, so memory stays flat however large
+    the page. Once iteration finishes, next_cursor holds the cursor for the
+    following page, or None if this was the last one. limit=None streams
+    every matching row.
+    """
+
+    def __init__(self, conn, limit=None, fields=DEFAULT_FIELDS, **filters):
+        self.conn = conn
+        self.limit = limit
+        self.fields = fields
+        self.filters = filters
+        self.next_cursor = None
+
+    def __iter__(self):
+        sent, last = 0, None
+        # Windows (see db.activity_windows) are read one after another in the page's direction
+        windows = db.activity_windows(self.conn, *query_range(**self.filters), descending=self.filters.get("descending", False))
+        for source, *window in windows:
+            limit = None if self.limit is None else self.limit + 1 - sent
+            sql, params = build_query(self.fields, limit=limit, source=source, window=tuple(window), **self.filters)
+            cursor = self.conn.execute(sql, params)
+            try:
+                while True:
+                    rows = cursor.fetchmany(FETCH_SIZE)
+                    if not rows:
+                        break
+                    for row in rows:
+                        if sent == self.limit:
+                            # Fetching one row past the page tells us another page exists
+                            self.next_cursor = encode_cursor(*last)
+                            return
+                        last = (row["_cursor_ms"], row["_cursor_id"])
+                        sent += 1
+                        yield {name: row[name] for name in self.fields}
+            finally:
+                cursor.close()
+
+def query_range(start_date=None, end_date=None, after=None, descending=False, **_):
+    """The (start_ms, end_ms) span, None where open, that build_query's filters can match."""
+    start_ms = end_ms = None
+    if start_date or end_date:
+        bounds = db.day_bounds(start_date or end_date, end_date or start_date)
+        start_ms = bounds[0] if start_date else None
+        end_ms = bounds[1] if end_date else None
+    if after is not None:
+        if descending:
+            end_ms = after[0] + 1 if end_ms is None else min(end_ms, after[0] + 1)
+        else:
+            start_ms = after[0] if start_ms is None else max(start_ms, after[0])
+    return start_ms, end_ms
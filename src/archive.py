@@ -0,0 +1,253 @@
+"""
+Moves closed months of activities out of the live database into read-only archive files.
+
+Each archived month is a SQLite file in archive/ next to the database. It
+holds that month's rows of the activities table unchanged: ids are kept, and
+app names and window titles still refer to the main database's strings
+table. The file is written once, VACUUMed, made read-only and optionally
+gzip-compressed. Then it is registered in the archives table, and the rows
+are deleted from the live table in the same transaction.
+
+Reads reach archived rows through db.activity_windows(), which only attaches
+the months a query's range covers. Summaries never need them, because
+daily_rollups keeps covering archived months. Rows written later for an
+archived month (an upload from another machine, say) go to the live table
+and are read alongside the archive. Archiving the month again merges them in.
+
+    python src/archive.py list
+    python src/archive.py archive --before 2025-01 --compress --vacuum
+    python src/archive.py restore 2024-03
+"""
+import argparse
+import gzip
+import os
+import shutil
+import sqlite3
+import stat
+from datetime import date, datetime
+from pathlib import Path
+
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/
+    import database as db
+
+COPY_BATCH = 10000 # rows copied per executemany
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE activities (
+    id INTEGER PRIMARY KEY,
+    task_id INTEGER NOT NULL,
+    app_id INTEGER NOT NULL,
+    title_id INTEGER,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER,
+    tz_offset INTEGER NOT NULL,
+    device_id INTEGER NOT NULL,
+    client_id TEXT
+);
+CREATE INDEX idx_activities_start ON activities (start_ms);
+CREATE INDEX idx_activities_task_start ON activities (task_id, start_ms);
+CREATE INDEX idx_activities_title_start ON activities (title_id, start_ms);
+CREATE INDEX idx_activities_app_start ON activities (app_id, start_ms);
+"""
+
+def month_bounds(month):
+    """First and last day of a 'YYYY-MM' month; raises ValueError if malformed."""
+    first = datetime.strptime(month, "%Y-%m").date()
+    next_month = first.replace(year=first.year + 1, month=1) if first.month == 12 else first.replace(month=first.month + 1)
+    return first, date.fromordinal(next_month.toordinal() - 1)
+
+def closed_months(before=None):
+    """'YYYY-MM' months before `before` (default: the current month) that still have activities in the live table."""
+    before = before or date.today().strftime("%Y-%m")
+    limit_ms = db.day_bounds(*month_bounds(before))[0]
+    with db.connection() as conn:
+        oldest = conn.execute("SELECT MIN(start_ms) FROM activities").fetchone()[0]
+        if oldest is None or oldest >= limit_ms:
+            return []
+        months = []
+        month = db.from_epoch_ms(oldest, db.utc_offset_minutes(datetime.now())).strftime("%Y-%m")
+        while month < before:
+            first, last = month_bounds(month)
+            if conn.execute("SELECT 1 FROM activities WHERE start_ms >= ? AND start_ms < ? LIMIT 1", db.day_bounds(first, last)).fetchone():
+                months.append(month)
+            month = date.fromordinal(last.toordinal() + 1).strftime("%Y-%m")
+        return months
+
+def list_archives():
+    """The archives table as dicts, oldest month first."""
+    with db.connection() as conn:
+        return [dict(row) for row in db.archived_months(conn)]
+
+def archive_month(month, compress=False):
+    """
+    Moves one closed month into its archive file, merging with an earlier
+    archive of the month if there is one. Returns the new archives row as a
+    dict, or None if the month has no activities in the live table.
+    """
+    first, last = month_bounds(month)
+    if first >= date.today().replace(day=1):
+        raise ValueError(f"{month} is not over yet; only earlier months can be archived.")
+    start_ms, end_ms = db.day_bounds(first, last)
+    with db.connection() as conn:
+        if conn.execute("SELECT 1 FROM activities WHERE end_ms IS NULL AND start_ms >= ? AND start_ms < ?", (start_ms, end_ms)).fetchone():
+            raise ValueError(f"{month} still has an open activity.")
+        if not conn.execute("SELECT 1 FROM activities WHERE start_ms >= ? AND start_ms < ? LIMIT 1", (start_ms, end_ms)).fetchone():
+            return None
+        previous = conn.execute("SELECT * FROM archives WHERE month = ?", (month,)).fetchone()
+
+    os.makedirs(db.archive_dir(), exist_ok=True)
+    created_ms = db.to_epoch_ms(datetime.now())
+    # A new name per build, so the registered file stays valid until the switch below commits
+    name = f"activities-{month}-{created_ms}.db"
+    building = os.path.join(db.archive_dir(), name + ".tmp")
+    try:
+        total, copied, max_id = _write_archive(building, start_ms, end_ms, previous)
+        if compress:
+            name += ".gz"
+            with open(building, "rb") as source, gzip.open(building + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(building)
+            building += ".gz"
+        path = os.path.join(db.archive_dir(), name)
+        os.replace(building, path)
+    finally:
+        for leftover in (building, building + ".gz"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+    entry = {"month": month, "path": name, "start_ms": start_ms, "end_ms": end_ms, "activity_count": total,
+             "bytes": os.path.getsize(path), "compressed": int(compress), "created_ms": created_ms}
+    try:
+        with db.connection() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO archives (month, path, start_ms, end_ms, activity_count, bytes, compressed, created_ms)
+                VALUES (:month, :path, :start_ms, :end_ms, :activity_count, :bytes, :compressed, :created_ms)
+                """,
+                entry
+            )
+            # Rows that arrived after the copy have higher ids and stay live
+            deleted = conn.execute(
+                "DELETE FROM activities WHERE start_ms >= ? AND start_ms < ? AND id <= ?", (start_ms, end_ms, max_id)
+            ).rowcount
+            if deleted != copied:
+                raise ValueError(f"Activities in {month} changed while it was being archived; try again.")
+    except Exception:
+        _remove(path)
+        raise
+    if previous:
+        _remove_archive_files(previous)
+    return entry
+
+def restore_month(month):
+    """Moves an archived month's activities back into the live table and deletes its archive file."""
+    with db.connection() as conn:
+        entry = conn.execute("SELECT * FROM archives WHERE month = ?", (month,)).fetchone()
+    if entry is None:
+        raise ValueError(f"{month} is not archived.")
+    uri = Path(db.archive_file(entry)).resolve().as_uri() + "?mode=ro&immutable=1"
+    db.close_connections() # Pooled connections may still have the file attached
+    with db.connection() as conn:
+        conn.execute("ATTACH DATABASE ? AS restoring", (uri,))
+    try:
+        with db.connection() as conn:
+            conn.execute(
+                f"INSERT OR IGNORE INTO main.activities ({db.ACTIVITY_TABLE_COLUMNS}) "
+                f"SELECT {db.ACTIVITY_TABLE_COLUMNS} FROM restoring.activities ORDER BY start_ms, id"
+            )
+            conn.execute("DELETE FROM archives WHERE month = ?", (month,))
+    finally:
+        with db.connection() as conn:
+            conn.execute("DETACH DATABASE restoring")
+    _remove_archive_files(entry)
+    return entry['activity_count']
+
+def vacuum():
+    """Rebuilds the live database file so the space freed by archiving is returned to the file system."""
+    db.close_connections()
+    with db.connection() as conn:
+        conn.execute("VACUUM")
+
+def _write_archive(path, start_ms, end_ms, previous):
+    """Writes the month's rows (the previous archive's and the live table's) to a new file. Returns (total, copied live, max live id)."""
+    archive = sqlite3.connect(path)
+    try:
+        archive.execute("PRAGMA journal_mode = OFF") # A failed build is thrown away, never recovered
+        archive.execute("PRAGMA synchronous = OFF")
+        archive.executescript(ARCHIVE_SCHEMA)
+        insert = f"INSERT OR IGNORE INTO activities ({db.ACTIVITY_TABLE_COLUMNS}) VALUES ({', '.join('?' * 9)})"
+        if previous:
+            archive.execute("ATTACH DATABASE ? AS previous", (Path(db.archive_file(previous)).resolve().as_uri() + "?mode=ro&immutable=1",))
+            archive.execute(f"INSERT INTO activities SELECT {db.ACTIVITY_TABLE_COLUMNS} FROM previous.activities")
+            archive.commit()
+            archive.execute("DETACH DATABASE previous")
+
+        copied, max_id = 0, 0
+        with db.connection() as conn:
+            cursor = conn.execute(
+                f"SELECT {db.ACTIVITY_TABLE_COLUMNS} FROM activities WHERE start_ms >= ? AND start_ms < ? ORDER BY start_ms, id",
+                (start_ms, end_ms)
+            )
+            while True:
+                rows = cursor.fetchmany(COPY_BATCH)
+                if not rows:
+                    break
+                archive.executemany(insert, [tuple(row) for row in rows])
+                copied += len(rows)
+                max_id = max(max_id, max(row['id'] for row in rows))
+        archive.commit()
+        total = archive.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+        archive.execute("PRAGMA journal_mode = DELETE")
+        archive.execute("VACUUM") # Rows in start order, no free pages
+    finally:
+        archive.close()
+    return total, copied, max_id
+
+def _remove_archive_files(entry):
+    path = os.path.join(db.archive_dir(), entry['path'])
+    _remove(path)
+    _remove(os.path.join(db.archive_dir(), ".cache", os.path.basename(path).removesuffix(".gz")))
+
+def _remove(path):
+    try:
+        os.chmod(path, stat.S_IWUSR | stat.S_IRUSR) # Read-only files can't be deleted on Windows
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed months of activities into read-only files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List archived months")
+    archive = commands.add_parser("archive", help="Archive closed months")
+    archive.add_argument("months", nargs="*", help="YYYY-MM months (default: every closed month before --before)")
+    archive.add_argument("--before", help="YYYY-MM; archive every month before this one (default: the current month)")
+    archive.add_argument("--compress", action="store_true", help="gzip the archive files")
+    archive.add_argument("--vacuum", action="store_true", help="VACUUM the live database afterwards")
+    restore = commands.add_parser("restore", help="Move an archived month back into the live database")
+    restore.add_argument("month", help="YYYY-MM")
+    args = parser.parse_args()
+
+    db.create_tables()
+    try:
+        if args.command == "list":
+            for entry in list_archives():
+                print(f"{entry['month']}  {entry['activity_count']:>9} activities  {entry['bytes'] / 1e6:8.1f} MB  "
+                      f"{'gzip' if entry['compressed'] else ''}  {entry['path']}")
+        elif args.command == "archive":
+            for month in args.months or closed_months(args.before):
+                entry = archive_month(month, args.compress)
+                if entry:
+                    print(f"Archived {month}: {entry['activity_count']} activities, {entry['bytes'] / 1e6:.1f} MB.")
+            if args.vacuum:
+                vacuum()
+        elif args.command == "restore":
+            print(f"Restored {restore_month(args.month)} activities from {args.month}.")
+    except ValueError as e:
+        parser.exit(1, f"error: {e}\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Console input shared by the tracker's menu and its prompt threads.
+
+The engine asks its questions on threads of their own, and a thread blocked
+in the built-in input() can't be interrupted. After Ctrl+C such a prompt
+would keep reading stdin alongside the menu and swallow its keystrokes.
+Here a single daemon thread owns stdin and hands each line to whoever is
+waiting in ConsoleInput.input(). Prompt handlers are wrapped with
+session(); once cancel() is called, their input() calls raise
+PromptCancelled instead of taking lines meant for the menu.
+"""
+import collections
+import sys
+import threading
+
+
+class PromptCancelled(Exception):
+    """The prompt's session was cancelled while it waited for input."""
+
+
+class ConsoleInput:
+    """Line input from stdin through one reader thread, with cancellable prompt sessions."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        self._lines = collections.deque()
+        self._changed = threading.Condition()
+        self._eof = False
+        self._reader = None
+        self._session = 0
+        self._local = threading.local()
+
+    def input(self, prompt=""):
+        """Like the built-in input(). Raises PromptCancelled in a cancelled session and EOFError at the end of stdin."""
+        session = getattr(self._local, "session", None)
+        print(prompt, end="", flush=True)
+        with self._changed:
+            if self._reader is None:
+                self._reader = threading.Thread(target=self._read, name="console-input", daemon=True)
+                self._reader.start()
+            while True:
+                if session is not None and session != self._session:
+                    raise PromptCancelled()
+                if self._lines:
+                    return self._lines.popleft()
+                if self._eof:
+                    raise EOFError()
+                self._changed.wait(0.5) # With a timeout, so Ctrl+C still gets through on Windows
+
+    def session(self, fn):
+        """Wraps fn so that the input() calls it makes end with PromptCancelled after the next cancel()."""
+        with self._changed:
+            session = self._session
+
+        def run(*args):
+            self._local.session = session
+            try:
+                return fn(*args)
+            finally:
+                del self._local.session
+        return run
+
+    def cancel(self):
+        """Ends every session started so far; their waiting prompts raise PromptCancelled."""
+        with self._changed:
+            self._session += 1
+            self._changed.notify_all()
+
+    def _read(self):
+        while True:
+            line = self.stream.readline()
+            with self._changed:
+                if not line:
+                    self._eof = True
+                else:
+                    self._lines.append(line.rstrip("\r\n"))
+                self._changed.notify_all()
+            if not line:
+                return
@@ -1,27 +1,203 @@
 import sqlite3
-from contextlib import closing
+from contextlib import contextmanager
+import gzip
+import itertools
+import logging
 import os
-from datetime import datetime
+import secrets
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+try:
+    from . import metrics
+except ImportError:  # Run as a script from src/
+    import metrics
+
+logger = logging.getLogger(__name__)
 
 # Define the path for the database in the project root
 DB_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "timetracker.db")
 
-def get_db_connection():
-    """Establishes a connection to the database."""
-    conn = sqlite3.connect(DB_FILE)
+# Applied to every connection when it is opened
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("mmap_size", 268435456),  # 256 MB
+    ("cache_size", -16000),    # 16 MB (negative values are in KiB)
+    ("busy_timeout", 5000),    # ms to wait for a lock held by the other process
+)
+
+# devices row of activities recorded by this machine's own tracker; uploads from other machines get their own
+LOCAL_DEVICE = 0
+LOCAL_DEVICE_NAME = "local"
+
+QUERY_SECONDS = metrics.histogram("timetracker_db_query_seconds", "Time spent in named database operations.", ("query",))
+COMMIT_SECONDS = metrics.histogram("timetracker_db_commit_seconds", "Time spent committing transactions.")
+ROLLBACKS = metrics.counter("timetracker_db_rollbacks_total", "Transactions rolled back after an error.")
+ACTIVITIES_WRITTEN = metrics.counter("timetracker_activities_written_total", "Activity rows inserted.")
+
+# --- Connection Management ---
+# Each thread keeps one open connection and reuses it for every helper call,
+# so the tracker loop and the web server don't pay connect/teardown per query.
+_local = threading.local()
+_registry_lock = threading.Lock()
+_open_connections = []
+_generation = 0  # bumped by close_connections() to invalidate every thread's connection
+
+def _connect(readonly=False):
+    """Opens a new connection to DB_FILE and applies PRAGMAS."""
+    if readonly:
+        # mode=ro opens the file read-only; query_only also rejects writes made through this handle
+        conn = sqlite3.connect(Path(DB_FILE).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    else:
+        # Opened by URI so archives can be attached with URI parameters (see attach_archive)
+        conn = sqlite3.connect(Path(DB_FILE).resolve().as_uri(), uri=True, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        if readonly and name == "journal_mode":
+            continue # WAL is a property of the file; a read-only handle can't (and needn't) set it
+        conn.execute(f"PRAGMA {name} = {value}")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
     return conn
 
+def use_readonly_connections():
+    """
+    Makes this thread's pooled connection read-only from now on. Meant for
+    reader threads, such as the web server's read pool.
+    """
+    _local.readonly = True
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _discard(conn)
+        _local.conn = None
+
+def get_db_connection():
+    """Returns this thread's pooled connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    key = (DB_FILE, _generation)
+    if conn is not None and _local.key == key:
+        return conn
+    if conn is not None:
+        # DB_FILE was repointed or the pool was closed; drop the stale connection
+        _discard(conn)
+    conn = _connect(readonly=getattr(_local, "readonly", False))
+    _local.conn = conn
+    _local.key = key
+    _local.depth = 0
+    with _registry_lock:
+        _open_connections.append(conn)
+    return conn
+
+def _discard(conn):
+    """Closes a pooled connection and forgets it."""
+    with _registry_lock:
+        if conn in _open_connections:
+            _open_connections.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.ProgrammingError:
+        pass
+
+@contextmanager
+def connection():
+    """
+    Context manager yielding this thread's pooled connection.
+
+    The outermost block commits on success and rolls back on error, so helpers
+    can be nested inside a caller's block and share its transaction.
+    """
+    conn = get_db_connection()
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+            ROLLBACKS.inc()
+            invalidate_name_cache() # It may hold write-through entries that were just rolled back
+        raise
+    else:
+        _local.depth -= 1
+        if _local.depth == 0 and conn.in_transaction:
+            with COMMIT_SECONDS.time():
+                conn.commit()
+
+@contextmanager
+def snapshot():
+    """
+    Like connection(), but every read in the block sees the same committed state.
+
+    Opens a read transaction if none is active. Under WAL it pins one
+    snapshot, so a write that commits on another connection partway through
+    a multi-query read can't be half seen.
+    """
+    with connection() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        yield conn
+
+@contextmanager
+def dedicated_connection(readonly=False):
+    """
+    Context manager yielding a private, unpooled connection that is closed on exit.
+
+    For long reads such as streamed API responses. Their rows are fetched by
+    whichever worker thread produces the next chunk, and they shouldn't hold
+    a pooled connection (or its transaction) for the whole response.
+    """
+    conn = _connect(readonly)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def release_thread_connection():
+    """Closes this thread's pooled connection. Short-lived threads call it before they exit."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _discard(conn)
+        _local.conn = None
+
+def close_connections():
+    """Closes every pooled connection, e.g. before the database file is removed."""
+    global _generation
+    with _registry_lock:
+        conns = list(_open_connections)
+        _open_connections.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+    _local.conn = None
+
 def create_tables(overwrite=False):
     """Creates the database tables. If overwrite is True, existing tables are dropped."""
-    with closing(get_db_connection()) as conn:
+    with connection() as conn:
         cursor = conn.cursor()
 
         if overwrite:
+            cursor.execute("DROP VIEW IF EXISTS activity_view")
+            cursor.execute("DROP VIEW IF EXISTS task_view")
             cursor.execute("DROP TABLE IF EXISTS activities")
             cursor.execute("DROP TABLE IF EXISTS tasks")
             cursor.execute("DROP TABLE IF EXISTS rules")
             cursor.execute("DROP TABLE IF EXISTS projects")
+            cursor.execute("DROP TABLE IF EXISTS journal_checkpoint")
+            cursor.execute("DROP TABLE IF EXISTS daily_rollups")
+            cursor.execute("DROP TABLE IF EXISTS strings")
+            cursor.execute("DROP TABLE IF EXISTS meta")
+            cursor.execute("DROP TABLE IF EXISTS devices")
+            cursor.execute("DROP TABLE IF EXISTS outbox")
+            cursor.execute("DROP TABLE IF EXISTS archives")
+            cursor.execute("DROP TABLE IF EXISTS strings_fts")
+            cursor.execute("PRAGMA user_version = 0")
 
         # Projects table
         cursor.execute("""
@@ -56,6 +232,14 @@ def create_tables(overwrite=False):
         )
         """)
 
+        # Highest activity journal sequence number committed (see journal.py)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS journal_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+        """)
+
         # Rules table (new)
         cursor.execute("""
         CREATE TABLE IF NOT EXISTS rules (
@@ -68,31 +252,449 @@ def create_tables(overwrite=False):
         )
         """)
 
+        migrate(conn)
+
+# --- Schema Migrations ---
+# Each step upgrades the schema by one version. PRAGMA user_version records the
+# last step applied, so existing timetracker.db files are upgraded in place.
+
+def _add_time_indexes(cursor):
+    """v1: indexes for the date-range filters used by the dashboard."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_start_time ON activities (start_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_task_start ON activities (task_id, start_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_project_end ON tasks (project_id, end_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_rules_pattern ON rules (pattern)")
+
+def _add_daily_rollups(cursor):
+    """v2: daily_rollups table (rebuilt in the v3 layout by _compact_timestamps)."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS daily_rollups (
+        day TEXT NOT NULL,
+        project_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        first_start TEXT NOT NULL,
+        seconds REAL NOT NULL,
+        PRIMARY KEY (day, project_id, task_id)
+    ) WITHOUT ROWID
+    """)
+    # Open activities are not rolled up; summaries read them from raw rows through this index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_activities_open ON activities (start_time) WHERE end_time IS NULL")
+
+def _compact_timestamps(cursor):
+    """v3: INTEGER epoch-ms timestamps with a UTC offset, and interned app names/window titles."""
+    conn = cursor.connection
+    conn.create_function("iso_to_ms", 1, lambda iso: to_epoch_ms(datetime.fromisoformat(iso)) if iso else None, deterministic=True)
+    conn.create_function("iso_tz_offset", 1, lambda iso: utc_offset_minutes(datetime.fromisoformat(iso)), deterministic=True)
+
+    # App names and window titles are stored once and referenced by id
+    cursor.execute("""
+    CREATE TABLE strings (
+        id INTEGER PRIMARY KEY,
+        value TEXT NOT NULL UNIQUE
+    )
+    """)
+    cursor.execute("""
+    INSERT OR IGNORE INTO strings (value)
+    SELECT app_name FROM activities UNION SELECT window_title FROM activities WHERE window_title IS NOT NULL
+    """)
+
+    cursor.execute("""
+    CREATE TABLE tasks_compact (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER,
+        tz_offset INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (project_id) REFERENCES projects (id)
+    )
+    """)
+    cursor.execute("""
+    INSERT INTO tasks_compact (id, project_id, name, start_ms, end_ms, tz_offset)
+    SELECT id, project_id, name, iso_to_ms(start_time), iso_to_ms(end_time), iso_tz_offset(start_time) FROM tasks
+    """)
+    cursor.execute("DROP TABLE tasks")
+    cursor.execute("ALTER TABLE tasks_compact RENAME TO tasks")
+    cursor.execute("CREATE INDEX idx_tasks_project_end ON tasks (project_id, end_ms)")
+
+    cursor.execute("""
+    CREATE TABLE activities_compact (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id INTEGER NOT NULL,
+        app_id INTEGER NOT NULL,
+        title_id INTEGER,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER,
+        tz_offset INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (task_id) REFERENCES tasks (id),
+        FOREIGN KEY (app_id) REFERENCES strings (id),
+        FOREIGN KEY (title_id) REFERENCES strings (id)
+    )
+    """)
+    cursor.execute("""
+    INSERT INTO activities_compact (id, task_id, app_id, title_id, start_ms, end_ms, tz_offset)
+    SELECT a.id, a.task_id, app.id, title.id, iso_to_ms(a.start_time), iso_to_ms(a.end_time), iso_tz_offset(a.start_time)
+    FROM activities a
+    JOIN strings app ON app.value = a.app_name
+    LEFT JOIN strings title ON title.value = a.window_title
+    """)
+    cursor.execute("DROP TABLE activities")
+    cursor.execute("ALTER TABLE activities_compact RENAME TO activities")
+    cursor.execute("CREATE INDEX idx_activities_start ON activities (start_ms)")
+    cursor.execute("CREATE INDEX idx_activities_task_start ON activities (task_id, start_ms)")
+    cursor.execute("CREATE INDEX idx_activities_open ON activities (start_ms) WHERE end_ms IS NULL")
+
+    cursor.execute("DROP TABLE daily_rollups")
+    cursor.execute("""
+    CREATE TABLE daily_rollups (
+        day TEXT NOT NULL,
+        project_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        first_start_ms INTEGER NOT NULL,
+        seconds REAL NOT NULL,
+        PRIMARY KEY (day, project_id, task_id)
+    ) WITHOUT ROWID
+    """)
+    # Filled by _add_devices (v6), which replaces it with the per-device layout
+
+    # Read-side views that present times as local ISO strings, as the API always has
+    cursor.execute(f"""
+    CREATE VIEW task_view AS
+    SELECT id, project_id, name,
+           {iso_sql('start_ms')} AS start_time, {iso_sql('end_ms')} AS end_time,
+           start_ms, end_ms, tz_offset
+    FROM tasks
+    """)
+    cursor.execute(f"""
+    CREATE VIEW activity_view AS
+    SELECT a.id, a.task_id, app.value AS app_name, title.value AS window_title,
+           {iso_sql('a.start_ms', 'a.tz_offset')} AS start_time, {iso_sql('a.end_ms', 'a.tz_offset')} AS end_time,
+           a.start_ms, a.end_ms, a.tz_offset
+    FROM activities a
+    JOIN strings app ON app.id = a.app_id
+    LEFT JOIN strings title ON title.id = a.title_id
+    """)
+
+def _add_meta_versions(cursor):
+    """v4: meta counters bumped by triggers so other processes can detect changes."""
+    cursor.execute("""
+    CREATE TABLE meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("INSERT INTO meta (key, value) VALUES ('entities_version', 0)")
+    for table in ("projects", "tasks"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+            CREATE TRIGGER {table}_{event.lower()}_version AFTER {event} ON {table}
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'entities_version';
+            END
+            """)
+
+def _add_data_version(cursor):
+    """v5: meta.data_version, bumped by triggers on every activity write (cache validators key on it)."""
+    cursor.execute("INSERT INTO meta (key, value) VALUES ('data_version', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+        CREATE TRIGGER activities_{event.lower()}_version AFTER {event} ON activities
+        BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+        END
+        """)
+
+def _add_devices(cursor):
+    """v6: devices, device_id and client_id on activities, per-device rollups and the upload outbox."""
+    cursor.execute("""
+    CREATE TABLE devices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        user_name TEXT,
+        last_sequence INTEGER NOT NULL DEFAULT 0,
+        last_seen_ms INTEGER
+    )
+    """)
+    cursor.execute("CREATE INDEX idx_devices_user ON devices (user_name)")
+    cursor.execute("INSERT INTO devices (id, name) VALUES (?, ?)", (LOCAL_DEVICE, LOCAL_DEVICE_NAME))
+
+    # Adding columns with constant defaults doesn't rewrite the table
+    cursor.execute(f"ALTER TABLE activities ADD COLUMN device_id INTEGER NOT NULL DEFAULT {LOCAL_DEVICE}")
+    cursor.execute("ALTER TABLE activities ADD COLUMN client_id TEXT")
+    cursor.execute("CREATE UNIQUE INDEX idx_activities_client ON activities (device_id, client_id) WHERE client_id IS NOT NULL")
+    cursor.execute("CREATE INDEX idx_activities_device_start ON activities (device_id, start_ms)")
+
+    cursor.execute("DROP TABLE daily_rollups")
+    cursor.execute("""
+    CREATE TABLE daily_rollups (
+        day TEXT NOT NULL,
+        device_id INTEGER NOT NULL,
+        project_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        first_start_ms INTEGER NOT NULL,
+        seconds REAL NOT NULL,
+        PRIMARY KEY (day, device_id, project_id, task_id)
+    ) WITHOUT ROWID
+    """)
+    _rebuild_rollups(cursor.connection)
+
+    cursor.execute("DROP VIEW activity_view")
+    cursor.execute(f"""
+    CREATE VIEW activity_view AS
+    SELECT a.id, a.task_id, app.value AS app_name, title.value AS window_title,
+           {iso_sql('a.start_ms', 'a.tz_offset')} AS start_time, {iso_sql('a.end_ms', 'a.tz_offset')} AS end_time,
+           a.start_ms, a.end_ms, a.tz_offset, a.device_id
+    FROM activities a
+    JOIN strings app ON app.id = a.app_id
+    LEFT JOIN strings title ON title.id = a.title_id
+    """)
+
+    # Encoded upload batches waiting to be sent to a sync server (see outbox.py)
+    cursor.execute("""
+    CREATE TABLE outbox (
+        sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+        body BLOB NOT NULL,
+        activity_count INTEGER NOT NULL,
+        created_ms INTEGER NOT NULL
+    )
+    """)
+
+def _add_archives(cursor):
+    """v7: registry of closed months moved out to read-only archive files (see archive.py)."""
+    cursor.execute("""
+    CREATE TABLE archives (
+        month TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL,
+        activity_count INTEGER NOT NULL,
+        bytes INTEGER NOT NULL,
+        compressed INTEGER NOT NULL DEFAULT 0,
+        created_ms INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+def _add_search_index(cursor):
+    """v8: trigram full-text index over strings (app names and window titles), and indexes from a string to its activities."""
+    # External content: the index stores trigrams only and reads values back from strings
+    cursor.execute("CREATE VIRTUAL TABLE strings_fts USING fts5(value, content='strings', content_rowid='id', tokenize='trigram')")
+    cursor.execute("INSERT INTO strings_fts (strings_fts) VALUES ('rebuild')")
+    cursor.execute("""
+    CREATE TRIGGER strings_insert_fts AFTER INSERT ON strings
+    BEGIN
+        INSERT INTO strings_fts (rowid, value) VALUES (new.id, new.value);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER strings_delete_fts AFTER DELETE ON strings
+    BEGIN
+        INSERT INTO strings_fts (strings_fts, rowid, value) VALUES ('delete', old.id, old.value);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER strings_update_fts AFTER UPDATE OF value ON strings
+    BEGIN
+        INSERT INTO strings_fts (strings_fts, rowid, value) VALUES ('delete', old.id, old.value);
+        INSERT INTO strings_fts (rowid, value) VALUES (new.id, new.value);
+    END
+    """)
+    cursor.execute("CREATE INDEX idx_activities_title_start ON activities (title_id, start_ms)")
+    cursor.execute("CREATE INDEX idx_activities_app_start ON activities (app_id, start_ms)")
+
+MIGRATIONS = [
+    _add_time_indexes,
+    _add_daily_rollups,
+    _compact_timestamps,
+    _add_meta_versions,
+    _add_data_version,
+    _add_devices,
+    _add_archives,
+    _add_search_index,
+]
+
+def migrate(conn):
+    """Applies every migration newer than the database's user_version, one transaction each."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            step(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+        except Exception:
+            conn.rollback()
+            raise
         conn.commit()
+        logger.info("Database migrated to schema version %d.", number)
+    if version < len(MIGRATIONS):
+        conn.execute("VACUUM") # Reclaim the space freed by rewritten tables
 
 def reset_database():
     """Removes the database file and recreates tables."""
-    print("Re-initializing database with new schema...")
+    logger.info("Re-initializing database with new schema...")
+    close_connections()
     try:
         os.remove(DB_FILE)
-        print("Removed old database file.")
+        logger.info("Removed old database file.")
     except OSError:
         pass # File didn't exist
+    for suffix in ("-wal", "-shm"):
+        try:
+            os.remove(DB_FILE + suffix)
+        except OSError:
+            pass
     create_tables(overwrite=True)
-    print("Database and tables created successfully.")
+    logger.info("Database and tables created successfully.")
+
+# --- Timestamps ---
+# Times are stored as INTEGER milliseconds since the Unix epoch (*_ms columns),
+# with tz_offset holding the local UTC offset in minutes when they were recorded.
+# task_view and activity_view turn them back into local ISO strings for readers.
+
+_EPOCH = datetime(1970, 1, 1)
+
+def to_epoch_ms(dt):
+    """Converts a datetime (naive values are local time) to epoch milliseconds."""
+    return round(dt.timestamp() * 1000)
+
+def utc_offset_minutes(dt):
+    """Returns the local UTC offset in minutes at the given datetime."""
+    return int(dt.astimezone().utcoffset().total_seconds() // 60)
+
+def from_epoch_ms(ms, tz_offset):
+    """Converts stored epoch milliseconds back to a naive local datetime."""
+    return _EPOCH + timedelta(milliseconds=ms + tz_offset * 60000)
+
+def iso_sql(ms_column, tz_column="tz_offset"):
+    """SQL expression rendering an epoch-ms column as a local ISO string (NULL stays NULL)."""
+    return f"strftime('%Y-%m-%dT%H:%M:%f', ({ms_column} + {tz_column} * 60000) / 1000.0, 'unixepoch')"
+
+def day_bounds(start_date, end_date):
+    """
+    Returns half-open epoch-ms (start, end) bounds covering start_date through end_date inclusive,
+    for use as `start_ms >= ? AND start_ms < ?` against the start_ms indexes.
+    """
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    return to_epoch_ms(start), to_epoch_ms(end)
+
+# --- Name Cache ---
+# An in-process copy of the projects and tasks tables, so name lookups in the
+# prompt flow and the API handlers don't hit SQLite. Writes made through this
+# module update it directly. Writes from other processes (the tracker, when
+# read by the web server) bump meta.entities_version via triggers; the cache
+# checks that counter at most every NAME_CACHE_CHECK_INTERVAL seconds and
+# reloads when it has moved.
+
+NAME_CACHE_CHECK_INTERVAL = 1.0 # seconds
+TASK_COLUMNS = "id, project_id, name, start_time, end_time"
+
+_name_cache_lock = threading.RLock()
+_name_cache = {"key": None, "version": None, "checked": 0.0, "projects": {}, "project_ids": {}, "tasks": {}}
+_name_cache_stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+def _load_name_cache(conn):
+    """Fills the cache from the projects and tasks tables. Caller holds _name_cache_lock."""
+    with QUERY_SECONDS.time("name_cache_load"):
+        projects = {row['id']: dict(row) for row in conn.execute("SELECT id, name FROM projects")}
+        tasks = {row['id']: dict(row) for row in conn.execute(f"SELECT {TASK_COLUMNS} FROM task_view")}
+    _name_cache["projects"] = projects
+    _name_cache["project_ids"] = {project['name']: project_id for project_id, project in projects.items()}
+    _name_cache["tasks"] = tasks
+    _name_cache_stats["reloads"] += 1
+
+def _fresh_name_cache():
+    """Returns the cache, reloading it first if it belongs to another database or is out of date."""
+    key = (DB_FILE, _generation)
+    now = time.monotonic()
+    with _name_cache_lock:
+        if _name_cache["key"] == key and now - _name_cache["checked"] < NAME_CACHE_CHECK_INTERVAL:
+            return _name_cache
+        with connection() as conn:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'entities_version'").fetchone()['value']
+            if _name_cache["key"] != key or _name_cache["version"] != version:
+                _load_name_cache(conn)
+                _name_cache["key"] = key
+                _name_cache["version"] = version
+        _name_cache["checked"] = now
+        return _name_cache
+
+def data_version():
+    """
+    Returns (data_version, entities_version) as stored in meta.
+
+    The pair changes whenever an activity, project or task is written by any
+    process, so anything derived from those tables is still valid while it
+    is unchanged.
+    """
+    with connection() as conn, QUERY_SECONDS.time("data_version"):
+        versions = dict(conn.execute("SELECT key, value FROM meta WHERE key IN ('data_version', 'entities_version')").fetchall())
+    return versions['data_version'], versions['entities_version']
+
+def invalidate_name_cache():
+    """Forces the next cache access to reload both tables."""
+    with _name_cache_lock:
+        _name_cache["key"] = None
+
+def name_cache_stats():
+    """Returns hit/miss/reload counters and the number of cached projects and tasks."""
+    with _name_cache_lock:
+        return dict(_name_cache_stats, projects=len(_name_cache["projects"]), tasks=len(_name_cache["tasks"]))
+
+def get_project(project_id):
+    """Returns the cached project dict for an ID, or None."""
+    with _name_cache_lock:
+        cache = _fresh_name_cache()
+        project = cache["projects"].get(project_id)
+        if project is not None:
+            _name_cache_stats["hits"] += 1
+            return project
+        _name_cache_stats["misses"] += 1
+        with connection() as conn:
+            row = conn.execute("SELECT id, name FROM projects WHERE id = ?", (project_id,)).fetchone()
+        if row:
+            project = cache["projects"][project_id] = dict(row)
+            cache["project_ids"][project['name']] = project_id
+        return project
+
+def get_task(task_id):
+    """Returns the cached task dict (id, project_id, name, start_time, end_time) for an ID, or None."""
+    with _name_cache_lock:
+        cache = _fresh_name_cache()
+        task = cache["tasks"].get(task_id)
+        if task is not None:
+            _name_cache_stats["hits"] += 1
+            return task
+        _name_cache_stats["misses"] += 1
+        with connection() as conn:
+            row = conn.execute(f"SELECT {TASK_COLUMNS} FROM task_view WHERE id = ?", (task_id,)).fetchone()
+        if row:
+            task = cache["tasks"][task_id] = dict(row)
+        return task
 
 # --- Helper Functions ---
 
+_rules_version = 0
+
 def get_projects():
-    """Retrieves all projects."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM projects ORDER BY name")
-        return cursor.fetchall()
+    """Retrieves all projects, ordered by name."""
+    with _name_cache_lock:
+        projects = list(_fresh_name_cache()["projects"].values())
+    return sorted(projects, key=lambda project: project['name'])
+
+def get_tasks():
+    """Retrieves all tasks, most recently started first."""
+    with _name_cache_lock:
+        tasks = list(_fresh_name_cache()["tasks"].values())
+    return sorted(tasks, key=lambda task: task['start_time'], reverse=True)
 
 def get_or_create_project(name):
     """Gets a project by name, creating it if it doesn't exist."""
-    with closing(get_db_connection()) as conn:
+    with _name_cache_lock:
+        project_id = _fresh_name_cache()["project_ids"].get(name)
+    if project_id is not None:
+        return project_id
+    with connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT id FROM projects WHERE name = ?", (name,))
         project = cursor.fetchone()
@@ -100,82 +702,456 @@ def get_or_create_project(name):
             return project['id']
         else:
             cursor.execute("INSERT INTO projects (name) VALUES (?)", (name,))
-            conn.commit()
-            return cursor.lastrowid
+            project_id = cursor.lastrowid
+    with _name_cache_lock:
+        _name_cache["projects"][project_id] = {'id': project_id, 'name': name}
+        _name_cache["project_ids"][name] = project_id
+    return project_id
 
 def get_active_tasks_for_project(project_id):
     """Gets all tasks for a project that have not ended."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM tasks WHERE project_id = ? AND end_time IS NULL ORDER BY start_time DESC", (project_id,))
-        return cursor.fetchall()
+    return [task for task in get_tasks() if task['project_id'] == project_id and task['end_time'] is None]
 
 def create_task(project_id, name):
     """Creates a new task and returns its ID."""
-    now_iso = datetime.now().isoformat()
-    with closing(get_db_connection()) as conn:
+    now = datetime.now()
+    with connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO tasks (project_id, name, start_time) VALUES (?, ?, ?)",
-            (project_id, name, now_iso)
+            "INSERT INTO tasks (project_id, name, start_ms, tz_offset) VALUES (?, ?, ?, ?)",
+            (project_id, name, to_epoch_ms(now), utc_offset_minutes(now))
         )
-        conn.commit()
-        return cursor.lastrowid
+        task_id = cursor.lastrowid
+        task = dict(conn.execute(f"SELECT {TASK_COLUMNS} FROM task_view WHERE id = ?", (task_id,)).fetchone())
+    with _name_cache_lock:
+        _name_cache["tasks"][task_id] = task
+    return task_id
+
+def get_or_create_task(project_id, name):
+    """Returns the most recently started task with this name in the project, creating it if there is none."""
+    for task in get_tasks():
+        if task['project_id'] == project_id and task['name'] == name:
+            return task['id']
+    return create_task(project_id, name)
 
 def end_task(task_id):
     """Sets the end time for a specific task."""
-    now_iso = datetime.now().isoformat()
-    with closing(get_db_connection()) as conn:
+    with connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE tasks SET end_time = ? WHERE id = ?", (now_iso, task_id))
-        conn.commit()
+        cursor.execute("UPDATE tasks SET end_ms = ? WHERE id = ?", (to_epoch_ms(datetime.now()), task_id))
+    with _name_cache_lock:
+        _name_cache["tasks"].pop(task_id, None) # Re-read with its end_time on next access
 
 def add_activity(task_id, app_name, window_title, start_time, end_time):
     """Adds a raw activity record linked to a task."""
-    print(f"Activity logged: App='{app_name}', Window='{window_title}' for Task ID {task_id}")
-    if not app_name or not app_name.strip():
-        return
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO activities (task_id, app_name, window_title, start_time, end_time) VALUES (?, ?, ?, ?, ?)",
-            (task_id, app_name, window_title, start_time.isoformat(), end_time.isoformat())
+    logger.debug("Activity logged: App=%r, Window=%r for Task ID %s", app_name, window_title, task_id)
+    add_activities([(task_id, app_name, window_title, start_time, end_time)])
+
+def add_activities(activities, checkpoint=None):
+    """
+    Inserts many activity records in a single transaction.
+
+    Each item is a (task_id, app_name, window_title, start_time, end_time) tuple.
+    daily_rollups is updated in the same transaction.
+    If checkpoint is given it is stored as the journal sequence committed with this batch.
+    """
+    activities = [activity for activity in activities if activity[1] and activity[1].strip()]
+    with connection() as conn, QUERY_SECONDS.time("add_activities"):
+        string_ids = _intern_strings(conn, [a[1] for a in activities] + [a[2] for a in activities])
+        rows = [
+            (task_id, string_ids[app_name], string_ids.get(window_title), to_epoch_ms(start_time),
+             to_epoch_ms(end_time), utc_offset_minutes(start_time))
+            for task_id, app_name, window_title, start_time, end_time in activities
+        ]
+        conn.executemany(
+            "INSERT INTO activities (task_id, app_id, title_id, start_ms, end_ms, tz_offset) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
         )
-        conn.commit()
+        # Roll up the stored (millisecond) values so rebuild_rollups() reproduces them exactly
+        _add_to_rollups(conn, [
+            (task_id, from_epoch_ms(start_ms, tz_offset), from_epoch_ms(end_ms, tz_offset), LOCAL_DEVICE)
+            for task_id, _, _, start_ms, end_ms, tz_offset in rows
+        ])
+        if checkpoint is not None:
+            conn.execute(
+                "INSERT INTO journal_checkpoint (id, seq) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET seq = excluded.seq",
+                (checkpoint,)
+            )
+    ACTIVITIES_WRITTEN.inc(amount=len(rows))
+
+def _intern_strings(conn, values):
+    """Returns {value: id} for the given strings, adding missing ones to the strings table."""
+    string_ids = {}
+    for value in set(values):
+        if value is None:
+            continue
+        conn.execute("INSERT OR IGNORE INTO strings (value) VALUES (?)", (value,))
+        string_ids[value] = conn.execute("SELECT id FROM strings WHERE value = ?", (value,)).fetchone()['id']
+    return string_ids
+
+def get_journal_checkpoint():
+    """Returns the last journal sequence number committed by add_activities."""
+    with connection() as conn:
+        row = conn.execute("SELECT seq FROM journal_checkpoint WHERE id = 1").fetchone()
+        return row['seq'] if row else 0
+
+# --- Devices ---
+# Activities uploaded by other machines (POST /api/ingest) carry the id of the
+# devices row they came from, and the client_id their tracker gave them.
+# devices.last_sequence is the highest upload batch accepted from the device.
+
+def install_id():
+    """
+    A random 32-bit number that identifies this database file, stored in meta
+    the first time it is asked for. A reset database gets a new one.
+    """
+    with connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('install_id', ?)", (secrets.randbits(32),))
+        return conn.execute("SELECT value FROM meta WHERE key = 'install_id'").fetchone()['value']
+
+def get_or_create_device(name, user_name=None):
+    """Returns the id of the device with this name, registering it first if needed. A given user_name replaces the stored one."""
+    with connection() as conn:
+        row = conn.execute("SELECT id, user_name FROM devices WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return conn.execute("INSERT INTO devices (name, user_name) VALUES (?, ?)", (name, user_name)).lastrowid
+        if user_name is not None and user_name != row['user_name']:
+            conn.execute("UPDATE devices SET user_name = ? WHERE id = ?", (user_name, row['id']))
+        return row['id']
+
+def get_devices():
+    """Retrieves all devices with their user and the last upload accepted from them."""
+    with connection() as conn:
+        return [dict(row) for row in conn.execute(
+            f"SELECT id, name, user_name, last_sequence, {iso_sql('last_seen_ms', '0')} AS last_seen FROM devices ORDER BY id"
+        )]
+
+def device_filter(column, device=None, user=None):
+    """
+    SQL condition restricting a device_id column to a device name and/or a user,
+    with its parameters, for use with the device_id indexes. Both None means no restriction.
+    """
+    conditions, params = [], {}
+    if device is not None:
+        conditions.append("name = :device")
+        params["device"] = device
+    if user is not None:
+        conditions.append("user_name = :user")
+        params["user"] = user
+    if not conditions:
+        return "1", params
+    return f"{column} IN (SELECT id FROM devices WHERE {' AND '.join(conditions)})", params
+
+def ingest_activities(device_id, sequence, activities):
+    """
+    Inserts a batch uploaded by a device in a single transaction, exactly once.
+
+    Each item is a (client_id, task_id, app_name, window_title, start_ms, end_ms, tz_offset) tuple.
+    A batch whose sequence is not above the device's last accepted one is a
+    retry of a batch already stored and is skipped whole, returning None.
+    Otherwise activities whose client_id the device already uploaded are
+    skipped, and (inserted, duplicates) is returned.
+    """
+    with connection() as conn, QUERY_SECONDS.time("ingest_activities"):
+        # Claims the sequence number first, which also takes the write lock, so concurrent retries can't both pass
+        claimed = conn.execute(
+            "UPDATE devices SET last_sequence = ?, last_seen_ms = ? WHERE id = ? AND last_sequence < ?",
+            (sequence, to_epoch_ms(datetime.now()), device_id, sequence)
+        ).rowcount
+        if not claimed:
+            return None
+        string_ids = _intern_strings(conn, [a[2] for a in activities] + [a[3] for a in activities])
+        inserted = []
+        for client_id, task_id, app_name, window_title, start_ms, end_ms, tz_offset in activities:
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO activities (device_id, client_id, task_id, app_id, title_id, start_ms, end_ms, tz_offset)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (device_id, client_id, task_id, string_ids[app_name], string_ids.get(window_title), start_ms, end_ms, tz_offset)
+            )
+            if cursor.rowcount:
+                inserted.append((task_id, from_epoch_ms(start_ms, tz_offset), from_epoch_ms(end_ms, tz_offset), device_id))
+        _add_to_rollups(conn, inserted)
+    ACTIVITIES_WRITTEN.inc(amount=len(inserted))
+    return len(inserted), len(activities) - len(inserted)
+
+def reassign_activities(changes):
+    """
+    Moves activities to other tasks in a single transaction, adjusting
+    daily_rollups for each one instead of rebuilding them.
+
+    Each change is an (activity_id, from_task_id, to_task_id) tuple. An
+    activity that is no longer on from_task_id, because it changed after it
+    was read, or that isn't in the activities table (it is archived) is left
+    alone. Returns the number of activities moved.
+    """
+    with connection() as conn, QUERY_SECONDS.time("reassign_activities"):
+        moved, removed, added = 0, [], []
+        for activity_id, from_task_id, to_task_id in changes:
+            row = conn.execute(
+                "UPDATE activities SET task_id = ? WHERE id = ? AND task_id = ? RETURNING start_ms, end_ms, tz_offset, device_id",
+                (to_task_id, activity_id, from_task_id)
+            ).fetchone()
+            if row is None:
+                continue
+            moved += 1
+            if row['end_ms'] is None:
+                continue # Open activities aren't in the rollups yet
+            start_time, end_time = from_epoch_ms(row['start_ms'], row['tz_offset']), from_epoch_ms(row['end_ms'], row['tz_offset'])
+            removed.append((from_task_id, start_time, end_time, row['device_id']))
+            added.append((to_task_id, start_time, end_time, row['device_id']))
+        _remove_from_rollups(conn, removed)
+        _add_to_rollups(conn, added)
+    return moved
+
+# --- Archived Months ---
+# Closed months can be moved out of the activities table into read-only,
+# VACUUMed files, one per month (see archive.py), listed in the archives
+# table. daily_rollups keeps covering them, so summaries never open an
+# archive. Raw reads go through activity_windows(), which splits a time range
+# into consecutive windows: outside archived months a window reads the
+# activities table exactly as before, so recent data costs what it always
+# did, and an archived month's window attaches that month's file and reads it
+# together with rows written to the activities table after it was archived.
+
+ACTIVITY_TABLE_COLUMNS = "id, task_id, app_id, title_id, start_ms, end_ms, tz_offset, device_id, client_id"
+ATTACH_LIMIT = 10 # SQLite's default SQLITE_MAX_ATTACHED
+
+def archive_dir():
+    """Where archive files are kept: archive/ next to DB_FILE."""
+    return os.path.join(os.path.dirname(os.path.abspath(DB_FILE)), "archive")
+
+def archived_months(conn, start_ms=None, end_ms=None):
+    """archives rows for months overlapping [start_ms, end_ms), oldest first. None bounds are open."""
+    return conn.execute(
+        """
+        SELECT month, path, start_ms, end_ms, activity_count, bytes, compressed, created_ms FROM archives
+        WHERE (:end IS NULL OR start_ms < :end) AND (:start IS NULL OR end_ms > :start)
+        ORDER BY start_ms
+        """,
+        {"start": start_ms, "end": end_ms}
+    ).fetchall()
+
+def activity_windows(conn, start_ms=None, end_ms=None, descending=False):
+    """
+    Yields (source, window_start, window_end) for consecutive windows covering
+    [start_ms, end_ms), oldest first or, if descending, newest first.
+
+    source is a table expression holding every activity that starts in the
+    window, for use as `FROM {source} a WHERE {window_condition('a.start_ms', ...)}`.
+    Reading the windows in order therefore returns rows in start order.
+    Archives are attached to conn as their windows are reached.
+    """
+    windows, position = [], start_ms
+    for month in archived_months(conn, start_ms, end_ms):
+        if position is None or position < month['start_ms']:
+            windows.append((None, position, month['start_ms']))
+        window_end = month['end_ms'] if end_ms is None else min(end_ms, month['end_ms'])
+        windows.append((month, month['start_ms'] if position is None else max(position, month['start_ms']), window_end))
+        position = window_end
+    if not windows or end_ms is None or position < end_ms:
+        windows.append((None, position, end_ms))
+
+    for month, window_start, window_end in (reversed(windows) if descending else windows):
+        if month is None:
+            yield "activities", window_start, window_end
+        else:
+            name = attach_archive(conn, month)
+            source = f"(SELECT {ACTIVITY_TABLE_COLUMNS} FROM main.activities UNION ALL SELECT {ACTIVITY_TABLE_COLUMNS} FROM {name}.activities)"
+            yield source, window_start, window_end
+
+def window_condition(column, window_start, window_end):
+    """SQL condition keeping column (epoch ms) inside a window from activity_windows()."""
+    conditions = []
+    if window_start is not None:
+        conditions.append(f"{column} >= {int(window_start)}")
+    if window_end is not None:
+        conditions.append(f"{column} < {int(window_end)}")
+    return " AND ".join(conditions) or "1"
+
+def attach_archive(conn, month):
+    """Attaches an archived month's file to conn, read-only, unless it already is. Returns its schema name."""
+    # Named after the file, not just the month, so a month archived again is never read from its old file
+    name = f"archive_{month['month'].replace('-', '_')}_{month['created_ms']}"
+    attached = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] not in ("main", "temp")]
+    if name in attached:
+        return name
+    if len(attached) >= ATTACH_LIMIT:
+        if conn.in_transaction:
+            raise ValueError(f"A single read can span at most {ATTACH_LIMIT} archived months.")
+        for other in attached:
+            if other.startswith("archive_"):
+                conn.execute(f"DETACH DATABASE {other}")
+    # immutable: the file never changes once written, so SQLite can skip locking it
+    conn.execute(f"ATTACH DATABASE ? AS {name}", (Path(archive_file(month)).resolve().as_uri() + "?mode=ro&immutable=1",))
+    return name
+
+def archive_file(month):
+    """Path of an archived month's SQLite file, decompressing a compressed archive into archive/.cache first."""
+    path = os.path.join(archive_dir(), month['path'])
+    if not month['compressed']:
+        return path
+    cached = os.path.join(archive_dir(), ".cache", os.path.basename(path).removesuffix(".gz"))
+    if not os.path.exists(cached):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        building = f"{cached}.{threading.get_ident()}.tmp"
+        with gzip.open(path, "rb") as source, open(building, "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.replace(building, cached)
+    return cached
+
+def _archived_activities(conn, columns):
+    """Yields batches of rows from every archived month, reading each file on its own connection."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'archives'").fetchone():
+        return # Before the v7 migration
+    for month in archived_months(conn):
+        archive = sqlite3.connect(Path(archive_file(month)).resolve().as_uri() + "?mode=ro&immutable=1", uri=True)
+        archive.row_factory = sqlite3.Row
+        try:
+            cursor = archive.execute(f"SELECT {columns} FROM activities WHERE end_ms IS NOT NULL")
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            archive.close()
+
+# --- Daily Rollups ---
+# daily_rollups holds the seconds spent per (day, device, project, task), maintained
+# alongside every activity insert, so summaries sum at most one row per day
+# and task instead of scanning raw activities.
+
+ROLLUP_EPSILON = 0.0005 # seconds; a row with less left after subtracting held nothing but rounding error
+
+def _split_by_day(start_time, end_time):
+    """Yields (day, first_start_ms, seconds) for each calendar day an activity spans."""
+    while start_time < end_time:
+        midnight = datetime.combine(start_time.date() + timedelta(days=1), datetime.min.time())
+        chunk_end = min(end_time, midnight)
+        yield start_time.date().isoformat(), to_epoch_ms(start_time), (chunk_end - start_time).total_seconds()
+        start_time = chunk_end
+
+def _rollup_totals(conn, activities):
+    """Sums (task_id, start_time, end_time, device_id) activities into {(day, device_id, project_id, task_id): (first_start_ms, seconds)}."""
+    project_ids = {}
+    totals = {}
+    for task_id, start_time, end_time, device_id in activities:
+        if task_id not in project_ids:
+            row = conn.execute("SELECT project_id FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            project_ids[task_id] = row['project_id'] if row else None
+        if project_ids[task_id] is None:
+            continue
+        for day, first_start, seconds in _split_by_day(start_time, end_time):
+            key = (day, device_id, project_ids[task_id], task_id)
+            previous = totals.get(key)
+            if previous:
+                totals[key] = (min(previous[0], first_start), previous[1] + seconds)
+            else:
+                totals[key] = (first_start, seconds)
+    return totals
+
+def _add_to_rollups(conn, activities):
+    """Adds (task_id, start_time, end_time, device_id) activities to daily_rollups using conn's transaction."""
+    totals = _rollup_totals(conn, activities)
+    conn.executemany(
+        """
+        INSERT INTO daily_rollups (day, device_id, project_id, task_id, first_start_ms, seconds) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(day, device_id, project_id, task_id) DO UPDATE SET
+            seconds = seconds + excluded.seconds,
+            first_start_ms = MIN(first_start_ms, excluded.first_start_ms)
+        """,
+        [key + value for key, value in totals.items()]
+    )
+
+def _remove_from_rollups(conn, activities):
+    """
+    Subtracts (task_id, start_time, end_time, device_id) activities from
+    daily_rollups using conn's transaction, deleting rows that are left
+    empty. first_start_ms is kept, so it can be earlier than the first
+    remaining activity; it only orders summaries.
+    """
+    totals = _rollup_totals(conn, activities)
+    conn.executemany(
+        "UPDATE daily_rollups SET seconds = seconds - ? WHERE day = ? AND device_id = ? AND project_id = ? AND task_id = ?",
+        [(seconds,) + key for key, (_, seconds) in totals.items()]
+    )
+    conn.executemany(
+        "DELETE FROM daily_rollups WHERE day = ? AND device_id = ? AND project_id = ? AND task_id = ? AND seconds < ?",
+        [key + (ROLLUP_EPSILON,) for key in totals]
+    )
+
+def _live_activities(conn, columns, batch_size=10000):
+    """Yields batches of closed activity rows from the activities table."""
+    cursor = conn.execute(f"SELECT {columns} FROM activities WHERE end_ms IS NOT NULL")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def _rebuild_rollups(conn):
+    """Regenerates daily_rollups from every closed activity, archived ones included, using conn's transaction."""
+    conn.execute("DELETE FROM daily_rollups")
+    columns = "task_id, start_ms, end_ms, tz_offset, device_id"
+    for rows in itertools.chain(_live_activities(conn, columns), _archived_activities(conn, columns)):
+        _add_to_rollups(conn, [
+            (row['task_id'], from_epoch_ms(row['start_ms'], row['tz_offset']), from_epoch_ms(row['end_ms'], row['tz_offset']),
+             row['device_id'])
+            for row in rows
+        ])
+
+def rebuild_rollups():
+    """Regenerates daily_rollups from the raw activities, archived months included."""
+    with connection() as conn, QUERY_SECONDS.time("rebuild_rollups"):
+        _rebuild_rollups(conn)
+        return conn.execute("SELECT COUNT(*) FROM daily_rollups").fetchone()[0]
 
 def add_rule(pattern, project_id, task_id=None):
     """Adds a new rule to automatically categorize activities."""
-    with closing(get_db_connection()) as conn:
+    global _rules_version
+    with connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO rules (pattern, project_id, task_id) VALUES (?, ?, ?)",
             (pattern, project_id, task_id)
         )
-        conn.commit()
+        _rules_version += 1
         return cursor.lastrowid
 
+def rules_version():
+    """Returns a counter that changes whenever this process modifies the rules table."""
+    return _rules_version
+
 def get_project_name_by_id(project_id):
     """Retrieves the name of a project by its ID."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM projects WHERE id = ?", (project_id,))
-        result = cursor.fetchone()
-        return result['name'] if result else "Unknown Project"
+    project = get_project(project_id)
+    return project['name'] if project else "Unknown Project"
 
 def get_task_name_by_id(task_id):
     """Retrieves the name of a task by its ID."""
-    with closing(get_db_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM tasks WHERE id = ?", (task_id,))
-        result = cursor.fetchone()
-        return result['name'] if result else "Unknown Task"
+    task = get_task(task_id)
+    return task['name'] if task else "Unknown Task"
 
 def get_rules():
     """Retrieves all defined rules."""
-    with closing(get_db_connection()) as conn:
+    with connection() as conn, QUERY_SECONDS.time("rules"):
         cursor = conn.cursor()
-        cursor.execute("SELECT r.id, r.pattern, r.project_id, p.name as project_name, r.task_id, t.name as task_name FROM rules r JOIN projects p ON r.project_id = p.id LEFT JOIN tasks t ON r.task_id = t.id")
+        cursor.execute("SELECT r.id, r.pattern, r.project_id, p.name as project_name, r.task_id, t.name as task_name FROM rules r JOIN projects p ON r.project_id = p.id LEFT JOIN tasks t ON r.task_id = t.id ORDER BY r.id")
         return cursor.fetchall()
 
 if __name__ == "__main__":
-    reset_database()
+    import argparse
+    parser = argparse.ArgumentParser(description="Time Tracker database maintenance.")
+    parser.add_argument(
+        "command", nargs="?", default="reset", choices=["reset", "rebuild-rollups"],
+        help="'reset' (default) deletes and recreates the database; 'rebuild-rollups' regenerates daily_rollups from raw activities"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "rebuild-rollups":
+        create_tables()
+        print(f"Rebuilt daily rollups: {rebuild_rollups()} rows.")
+    else:
+        reset_database()
@@ -0,0 +1,389 @@
+import asyncio
+import logging
+import threading
+import time
+
+try:
+    from . import database as db
+    from . import metrics
+    from .input_monitor import InputMonitor
+    from .journal import ActivityJournal
+    from .rules import DEFAULT_TASK_NAME, RuleEngine
+    from .window_source import PollingWindowSource
+except ImportError:  # Run as a script from src/ (python src/tracker.py)
+    import database as db
+    import metrics
+    from input_monitor import InputMonitor
+    from journal import ActivityJournal
+    from rules import DEFAULT_TASK_NAME, RuleEngine
+    from window_source import PollingWindowSource
+
+logger = logging.getLogger(__name__)
+
+RULE_MATCH_SECONDS = metrics.histogram("timetracker_rule_match_seconds", "Time to match one window title against the rules.")
+RULE_MATCHES = metrics.counter("timetracker_rule_matches_total", "Window titles matched against the rules, by result.", ("result",))
+# How late the AFK timer wakes up, which is how long the event loop was busy elsewhere
+TICK_JITTER_SECONDS = metrics.histogram("timetracker_tick_jitter_seconds", "Delay of the tracker's timer ticks past their due time.")
+
+class TrackerEngine:
+    """
+    The tracking core, written as tasks on a single asyncio event loop.
+
+    Window sampling, the AFK timer, check-in scheduling, journal flushing and
+    prompt handling run as separate tasks, so a prompt that waits on the user
+    does not stop activity capture. All tracker state is only touched from
+    the loop. Blocking work (window polling, database writes, console prompts)
+    runs in worker threads, and listener threads reach the loop through
+    loop.call_soon_threadsafe().
+
+    Standalone use is asyncio.run(engine.run()). To embed the engine in an
+    application that already has a loop, await engine.start() and
+    engine.stop() around the application's lifetime.
+
+    prompt_handler(reason, project_id, task_id) is a blocking callable that
+    returns the (project_id, task_id) to track next. It runs in its own thread.
+    Without a handler, an open prompt stays open until choose_task() is called.
+
+    snapshot() returns the live state from memory, and subscribe() hands out a
+    queue that receives a new snapshot after every change.
+    """
+
+    def __init__(self, window_source=None, input_monitor=None, journal=None, rule_engine=None,
+                 prompt_handler=None, afk_timeout=60, tick_interval=5, checkin_interval=1800):
+        self.window_source = window_source
+        self.input_monitor = input_monitor or InputMonitor()
+        self.journal = journal or ActivityJournal()
+        self.rule_engine = rule_engine or RuleEngine()
+        self.prompt_handler = prompt_handler
+        self.afk_timeout = afk_timeout
+        self.tick_interval = tick_interval
+        self.checkin_interval = checkin_interval
+
+        self.project_id = None
+        self.task_id = None
+        self.project = None # Dicts of the current project and task, loaded off the loop for snapshot()
+        self.task = None
+        self.current_activity = None
+        self.is_afk = False
+        self.prompt_reason = None # Reason of the prompt that is open right now, if any
+        self.last_checkin = time.monotonic()
+
+        self._loop = None
+        self._tasks = []
+        self._prompts = None
+        self._answer = None
+        self._flush_requested = None
+        self._finished = None
+        self._subscribers = set()
+        self._closed_since_publish = []
+        self._publish_scheduled = False
+
+    # --- Lifecycle ---
+    async def start(self, reason="Welcome!"):
+        """Starts the tracker tasks on the running loop and opens the first prompt."""
+        self._loop = asyncio.get_running_loop()
+        self._prompts = asyncio.Queue()
+        self._flush_requested = asyncio.Event()
+        self._finished = asyncio.Event()
+
+        # Replaying the spill file touches the database; the engine flushes the journal itself
+        await self._loop.run_in_executor(None, self.journal.start, False)
+        if self.window_source is None:
+            self.window_source = PollingWindowSource(max_interval=self.tick_interval)
+        self.input_monitor.on_input = lambda: self._loop.call_soon_threadsafe(self._check_afk)
+
+        self._tasks = [
+            self._loop.create_task(self._sample_windows(), name="tracker-sampler"),
+            self._loop.create_task(self._watch_afk(), name="tracker-afk"),
+            self._loop.create_task(self._schedule_checkins(), name="tracker-checkin"),
+            self._loop.create_task(self._flush_journal(), name="tracker-flusher"),
+            self._loop.create_task(self._handle_prompts(), name="tracker-prompts"),
+        ]
+        if reason:
+            self.request_prompt(reason)
+
+    async def stop(self):
+        """Cancels the tasks, records the running activity and commits the journal."""
+        logger.info("Stopping tracker...")
+        self.window_source.close() # Lets a sampler thread blocked in wait() return early
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.input_monitor.on_input = None
+
+        if not self.is_afk:
+            self._close_activity(self.window_source.now())
+        await self._loop.run_in_executor(None, self.journal.close) # Flushes everything still buffered
+        if self.task_id:
+            await self._loop.run_in_executor(None, db.end_task, self.task_id)
+
+    async def run(self):
+        """Runs until request_stop() is called or the window source runs out."""
+        await self.start()
+        try:
+            await self._finished.wait()
+        finally:
+            await self.stop()
+
+    def request_stop(self):
+        """Asks run() to return. Safe to call from any thread."""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._finished.set)
+
+    # --- Prompts ---
+    def request_prompt(self, reason):
+        """Queues a prompt unless one is already open or queued. Must be called on the loop."""
+        if self.prompt_reason is None and self._prompts.empty():
+            self._prompts.put_nowait(reason)
+
+    def request_prompt_threadsafe(self, reason):
+        """request_prompt() for listener threads, such as the F1 hotkey."""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self.request_prompt, reason)
+
+    async def choose_task(self, project_id, task_id):
+        """Switches to this task and closes the open prompt, if any. Must be called on the loop."""
+        await self.set_task(project_id, task_id)
+        if self._answer is not None and not self._answer.done():
+            self._answer.set_result(None)
+            self.prompt_reason = None # Also cleared by the prompt task once it resumes
+
+    async def set_task(self, project_id, task_id):
+        """
+        Switches the tracked project/task, closing the running activity under the old one.
+        Before the first choice the running activity simply carries over to the new task.
+        """
+        entities = await self._loop.run_in_executor(None, _entities, project_id, task_id)
+        if self.task_id is not None and (project_id, task_id) != (self.project_id, self.task_id):
+            self._close_activity(self.window_source.now())
+            await self._flush() # Commit the old task's activities before it is ended
+            if self.task_id and self.task_id != task_id:
+                await self._loop.run_in_executor(None, db.end_task, self.task_id)
+        self.project_id, self.task_id = project_id, task_id
+        self.project, self.task = entities
+        self.last_checkin = time.monotonic()
+        self._publish()
+
+    # --- Live State ---
+    def snapshot(self):
+        """The current project, task, activity and AFK/prompt state, from memory; never touches the database."""
+        activity = None
+        if self.current_activity:
+            activity = dict(self.current_activity, start_time=self.current_activity['start_time'].isoformat(timespec="milliseconds"))
+        return {
+            "running": True,
+            "project": self.project,
+            "task": self.task,
+            "activity": activity,
+            "is_afk": self.is_afk,
+            "prompt": self.prompt_reason,
+        }
+
+    def subscribe(self, maxsize=100):
+        """Returns a queue that receives a snapshot after every state change. Must be called on the loop."""
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _publish(self):
+        """Schedules one snapshot for subscribers, however many changes happen in this loop iteration."""
+        if self._subscribers and not self._publish_scheduled:
+            self._publish_scheduled = True
+            self._loop.call_soon(self._send_snapshot)
+
+    def _send_snapshot(self):
+        self._publish_scheduled = False
+        state = self.snapshot()
+        state["closed_activities"], self._closed_since_publish = self._closed_since_publish, []
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait() # A slow client loses the oldest update, never blocks the tracker
+            queue.put_nowait(state)
+
+    # --- Tasks ---
+    async def _sample_windows(self):
+        while True:
+            sample = await self._loop.run_in_executor(None, self.window_source.wait, self.tick_interval)
+            if not self.is_afk:
+                await self._observe(sample)
+            if self.window_source.closed:
+                self._finished.set()
+                return
+
+    async def _watch_afk(self):
+        while True:
+            interval = min(self.tick_interval, self.afk_timeout)
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            TICK_JITTER_SECONDS.observe(max(0.0, time.monotonic() - started - interval))
+            self._check_afk()
+
+    async def _schedule_checkins(self):
+        while True:
+            due = self.last_checkin + self.checkin_interval - time.monotonic()
+            if due > 0:
+                await asyncio.sleep(due)
+                continue
+            # Returning from AFK prompts anyway, and an open prompt resets the timer when answered
+            if not self.is_afk and self.prompt_reason is None:
+                self.request_prompt("Time for a check-in!")
+            self.last_checkin = time.monotonic()
+
+    async def _flush_journal(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.journal.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self._flush()
+
+    async def _handle_prompts(self):
+        while True:
+            reason = await self._prompts.get()
+            self.prompt_reason = reason
+            self._publish()
+            try:
+                if self.prompt_handler:
+                    choice = await _run_in_thread(self.prompt_handler, reason, self.project_id, self.task_id)
+                    await self.set_task(*choice)
+                else:
+                    self._answer = self._loop.create_future()
+                    await self._answer # choose_task() applies the answer
+            except Exception as e:
+                logger.warning("Prompt failed: %s", e)
+            finally:
+                self.prompt_reason = None
+                self._answer = None
+                self._publish()
+
+    # --- Internals ---
+    async def _observe(self, sample):
+        app_name, window_title = sample.app_name, sample.window_title
+        now = self.window_source.now()
+        if self.current_activity is not None:
+            # A switch is dated when it was seen, not when the sampler woke up
+            now = max(sample.observed_at, self.current_activity['start_time'])
+
+        # Apply rules for automatic categorization
+        with RULE_MATCH_SECONDS.time():
+            rule = self.rule_engine.match(window_title)
+        RULE_MATCHES.inc("hit" if rule is not None else "miss")
+        target = await self._rule_target(rule) if rule is not None else None
+        if target is not None and target != (self.project_id, self.task_id):
+            task_info = f", Task: {rule['task_name']}" if rule['task_name'] else ""
+            logger.info("✨ Rule matched: '%s' -> Project: %s%s.", rule['pattern'], rule['project_name'], task_info)
+            entities = await self._loop.run_in_executor(None, _entities, *target)
+            self._close_activity(now)
+            self.project_id, self.task_id = target
+            self.project, self.task = entities
+            while not self._prompts.empty(): # No need to prompt if a rule applied
+                self._prompts.get_nowait()
+            self._flush_requested.set()
+
+        if self.current_activity is None:
+            self.current_activity = {'app_name': app_name, 'window_title': window_title, 'start_time': now}
+            self._publish()
+        elif self.current_activity['app_name'] != app_name or self.current_activity['window_title'] != window_title:
+            self._close_activity(now)
+            self.current_activity = {'app_name': app_name, 'window_title': window_title, 'start_time': now}
+            self._publish()
+
+    async def _rule_target(self, rule):
+        """
+        The (project_id, task_id) a matched rule switches to. A rule for a
+        whole project keeps the current task if it belongs to that project,
+        and otherwise switches to the project's DEFAULT_TASK_NAME task.
+        """
+        if rule['task_id'] is not None:
+            return rule['project_id'], rule['task_id']
+        if self.task_id is not None and self.project_id == rule['project_id']:
+            return self.project_id, self.task_id
+        task_id = await self._loop.run_in_executor(None, db.get_or_create_task, rule['project_id'], DEFAULT_TASK_NAME)
+        return rule['project_id'], task_id
+
+    def _check_afk(self):
+        idle = self.input_monitor.idle_seconds()
+        if self.is_afk and idle < self.afk_timeout:
+            logger.info("User is back.")
+            self.is_afk = False
+            self.request_prompt("Welcome back!")
+            self._publish()
+        elif not self.is_afk and idle > self.afk_timeout:
+            logger.info("User is now AFK.")
+            self.is_afk = True
+            self._close_activity(self.window_source.now())
+            self._flush_requested.set()
+            self._publish()
+
+    def _close_activity(self, end_time):
+        if self.current_activity and self.task_id is None:
+            self.current_activity = None # Nothing to attribute it to yet
+        elif self.current_activity:
+            self.journal.record(
+                self.task_id,
+                self.current_activity['app_name'],
+                self.current_activity['window_title'],
+                self.current_activity['start_time'],
+                end_time
+            )
+            if self._subscribers:
+                self._closed_since_publish.append({
+                    "task_id": self.task_id,
+                    "app_name": self.current_activity['app_name'],
+                    "window_title": self.current_activity['window_title'],
+                    "start_time": self.current_activity['start_time'].isoformat(timespec="milliseconds"),
+                    "end_time": end_time.isoformat(timespec="milliseconds"),
+                })
+            self.current_activity = None
+            if self.journal.pending() >= self.journal.batch_size:
+                self._flush_requested.set()
+
+    async def _flush(self):
+        try:
+            await self._loop.run_in_executor(None, self.journal.flush)
+        except Exception as e:
+            logger.warning("Activity journal flush failed, will retry: %s", e)
+
+
+def _entities(project_id, task_id):
+    """The project and task dicts for snapshot(), or None for an unset id."""
+    return (db.get_project(project_id) if project_id else None,
+            db.get_task(task_id) if task_id else None)
+
+async def _run_in_thread(fn, *args):
+    """
+    Runs a blocking call in a daemon thread and awaits its result.
+
+    Unlike the default executor, an abandoned call (a console prompt still
+    waiting on input() when the engine stops) cannot block interpreter exit.
+    The thread closes the pooled connection the call opened before it ends.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result, error):
+        if not future.done():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def target():
+        try:
+            outcome = (fn(*args), None)
+        except Exception as e:
+            outcome = (None, e)
+        finally:
+            db.release_thread_connection()
+        try:
+            loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError:
+            pass # The loop is already closed
+
+    threading.Thread(target=target, name="tracker-prompt", daemon=True).start()
+    return await future
@@ -0,0 +1,179 @@
+"""
+Bulk export of raw activities, joined with project and task names.
+
+Rows are streamed from a database cursor and encoded chunk by chunk, so memory
+stays bounded however many rows are exported. Used by /api/export/activities
+and as a command-line tool:
+
+    python src/export.py --start 2025-01-01 --end 2025-03-31 --format csv --gzip -o q1.csv.gz
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from datetime import date
+
+try:
+    from . import database as db
+    from . import activities
+except ImportError:  # Run as a script from src/
+    import database as db
+    import activities
+
+FORMATS = ("csv", "ndjson", "parquet")
+EXPORT_FIELDS = ("id", "project_name", "task_name", "app_name", "window_title", "start_time", "end_time", "duration_seconds")
+CSV_BATCH_SIZE = 1000 # rows encoded per CSV/NDJSON chunk
+ROW_GROUP_SIZE = 50000 # rows per Parquet row group, the unit held in memory
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+def parquet_available():
+    """Parquet export needs the optional pyarrow package."""
+    try:
+        import pyarrow.parquet # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def filename(format, start_date=None, end_date=None, compress=False):
+    """Suggested download name, e.g. activities_2025-01-01_2025-03-31.csv.gz."""
+    span = "_".join(d.isoformat() for d in (start_date, end_date) if d) or "all"
+    return f"activities_{span}.{format}" + (".gz" if compress and format != "parquet" else "")
+
+def export_activities(conn, format="csv", compress=False, **filters):
+    """
+    Yields the encoded export as bytes chunks.
+
+    filters are passed to activities.build_query (start_date, end_date,
+    project_id, ...). compress gzips CSV and NDJSON output; Parquet is
+    compressed internally instead, with gzip rather than snappy.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format {format!r}. Must be one of {', '.join(FORMATS)}.")
+    if format == "parquet":
+        fields = EXPORT_FIELDS + ("start_ms", "end_ms", "tz_offset")
+        rows = activities.ActivityPage(conn, None, fields, **filters)
+        return _parquet_chunks(rows, compression="gzip" if compress else "snappy")
+    rows = activities.ActivityPage(conn, None, EXPORT_FIELDS, **filters)
+    chunks = _csv_chunks(rows) if format == "csv" else _ndjson_chunks(rows)
+    return _gzip(chunks) if compress else chunks
+
+# --- Encoders ---
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in _batches(rows, CSV_BATCH_SIZE):
+        writer.writerows([row[name] for name in EXPORT_FIELDS] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell(): # Header only, no rows
+        yield buffer.getvalue().encode("utf-8")
+
+def _ndjson_chunks(rows):
+    for batch in _batches(rows, CSV_BATCH_SIZE):
+        yield "".join(json.dumps(row) + "\n" for row in batch).encode("utf-8")
+
+def _gzip(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class _ChunkSink:
+    """Write-only file object that collects what pyarrow writes so the generator can hand it on."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+def _parquet_chunks(rows, compression="snappy"):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Times are local wall-clock timestamps, the same values the ISO strings elsewhere show
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("project_name", pa.string()),
+        ("task_name", pa.string()),
+        ("app_name", pa.string()),
+        ("window_title", pa.string()),
+        ("start_time", pa.timestamp("ms")),
+        ("end_time", pa.timestamp("ms")),
+        ("duration_seconds", pa.float64()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for batch in _batches(rows, ROW_GROUP_SIZE):
+            columns = {name: [row[name] for row in batch] for name in ("id", "project_name", "task_name", "app_name", "window_title", "duration_seconds")}
+            columns["start_time"] = [row["start_ms"] + row["tz_offset"] * 60000 for row in batch]
+            columns["end_time"] = [row["end_ms"] + row["tz_offset"] * 60000 if row["end_ms"] is not None else None for row in batch]
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield from sink.drain()
+    finally:
+        writer.close()
+    yield from sink.drain() # The footer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", type=date.fromisoformat, help="First day (YYYY-MM-DD), by activity start time")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day (YYYY-MM-DD), inclusive")
+    parser.add_argument("--project-id", type=int)
+    parser.add_argument("--task-id", type=int)
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="parquet needs the optional pyarrow package (pip install pyarrow)")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output")
+    parser.add_argument("-o", "--output", help="Output file (default: standard output)")
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not parquet_available():
+        parser.error("Parquet export needs the optional pyarrow package (pip install pyarrow).")
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        with db.dedicated_connection(readonly=True) as conn:
+            for chunk in export_activities(conn, args.format, args.gzip, start_date=args.start, end_date=args.end,
+                                           project_id=args.project_id, task_id=args.task_id):
+                out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+    main()
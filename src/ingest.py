@@ -0,0 +1,116 @@
+"""
+Bulk activity uploads from trackers on other machines (POST /api/ingest).
+
+A batch is NDJSON, normally gzip-compressed, with one closed activity per line:
+
+    {"id": "3f2b...", "project": "Website", "task": "Landing page", "app_name": "Code",
+     "window_title": "index.html - Code", "start_ms": 1714550400000, "end_ms": 1714550460000, "tz_offset": 120}
+
+id is generated by the uploading tracker and must be unique per device.
+Times are epoch milliseconds plus the local UTC offset in minutes, the way
+the database stores them. Projects and tasks are matched by name and created
+if missing. Each upload also names its device, the device's user and a
+sequence number that grows with every batch the device sends (see outbox.py).
+
+A batch is validated in full, then stored in one transaction. A retried
+batch (same or lower sequence) is acknowledged without being stored again,
+and an activity whose id the device already uploaded is skipped.
+"""
+import json
+import zlib
+
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/
+    import database as db
+
+MAX_BODY_BYTES = 64 * 1024 * 1024 # per batch, compressed and decompressed
+MAX_BATCH_SIZE = 20000 # activities per batch
+MAX_NAME_LENGTH = 200 # device and user names
+
+def decode_batch(body, content_encoding=None):
+    """
+    Parses an upload body into (client_id, project, task, app_name, window_title, start_ms, end_ms, tz_offset)
+    tuples. gzip bodies are recognized by Content-Encoding or their magic bytes. Raises ValueError if malformed.
+    """
+    if content_encoding == "gzip" or body[:2] == b"\x1f\x8b":
+        body = _gunzip(body)
+    activities = []
+    for number, line in enumerate(body.split(b"\n"), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            activity = (
+                str(item["id"]), str(item["project"]), str(item["task"]), str(item["app_name"]),
+                None if item.get("window_title") is None else str(item["window_title"]),
+                int(item["start_ms"]), int(item["end_ms"]), int(item.get("tz_offset", 0)),
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Line {number} is not a valid activity: {e!r}")
+        client_id, project, task, app_name, _, start_ms, end_ms, tz_offset = activity
+        if not client_id or not project.strip() or not task.strip() or not app_name.strip():
+            raise ValueError(f"Line {number}: id, project, task and app_name must not be empty.")
+        if end_ms < start_ms:
+            raise ValueError(f"Line {number}: end_ms is before start_ms.")
+        if abs(tz_offset) > 18 * 60:
+            raise ValueError(f"Line {number}: tz_offset must be within +-18 hours.")
+        activities.append(activity)
+        if len(activities) > MAX_BATCH_SIZE:
+            raise ValueError(f"A batch holds at most {MAX_BATCH_SIZE} activities.")
+    return activities
+
+def ingest(device, user, sequence, activities):
+    """
+    Stores decoded activities uploaded by a device. Returns the response body:
+    {'status': 'stored', 'inserted': n, 'duplicates': n} or, for a batch that
+    was already stored, {'status': 'duplicate', 'last_sequence': n}.
+    """
+    if not device or len(device) > MAX_NAME_LENGTH or device == db.LOCAL_DEVICE_NAME:
+        raise ValueError(f"Invalid device name {device!r}.")
+    if user is not None and len(user) > MAX_NAME_LENGTH:
+        raise ValueError("User name is too long.")
+    if sequence < 1:
+        raise ValueError("sequence must be at least 1.")
+
+    # A retry of a stored batch is answered before any project, task or device is written
+    last_sequence = _last_sequence(device)
+    if last_sequence is not None and sequence <= last_sequence:
+        return {"device": device, "sequence": sequence, "status": "duplicate", "last_sequence": last_sequence}
+
+    with db.connection():
+        device_id = db.get_or_create_device(device, user)
+        task_ids = {}
+        for _, project, task, *_ in activities:
+            if (project, task) not in task_ids:
+                task_ids[project, task] = db.get_or_create_task(db.get_or_create_project(project), task)
+        result = db.ingest_activities(device_id, sequence, [
+            (client_id, task_ids[project, task], app_name, window_title, start_ms, end_ms, tz_offset)
+            for client_id, project, task, app_name, window_title, start_ms, end_ms, tz_offset in activities
+        ])
+    if result is None: # A concurrent retry of the same batch got there first
+        return {"device": device, "sequence": sequence, "status": "duplicate", "last_sequence": _last_sequence(device)}
+    inserted, duplicates = result
+    return {"device": device, "sequence": sequence, "status": "stored", "inserted": inserted, "duplicates": duplicates}
+
+def ingest_upload(body, content_encoding, device, user, sequence):
+    """decode_batch() and ingest() in one call, for running off the event loop."""
+    return ingest(device, user, sequence, decode_batch(body, content_encoding))
+
+def _last_sequence(device):
+    with db.connection() as conn:
+        row = conn.execute("SELECT last_sequence FROM devices WHERE name = ?", (device,)).fetchone()
+        return row['last_sequence'] if row else None
+
+def _gunzip(body):
+    """Decompresses a gzip body, refusing anything that expands past MAX_BODY_BYTES."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, MAX_BODY_BYTES + 1)
+    except zlib.error as e:
+        raise ValueError(f"Body is not valid gzip: {e}")
+    if len(data) > MAX_BODY_BYTES:
+        raise ValueError(f"Decompressed batch is larger than {MAX_BODY_BYTES} bytes.")
+    if not decompressor.eof:
+        raise ValueError("Body is truncated gzip.")
+    return data
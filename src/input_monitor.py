@@ -0,0 +1,88 @@
+import time
+
+EVENT_KINDS = ("move", "click", "scroll", "key")
+
+
+class InputMonitor:
+    """
+    Records keyboard and mouse activity for AFK detection.
+
+    The pynput callbacks only bump a counter and, at most once per debounce
+    seconds, store a time.monotonic() timestamp. They never touch tracker
+    state. The tracking loop reads idle_seconds() and decides AFK transitions
+    itself, so there is a single writer for is_afk.
+
+    A float attribute store is atomic under the GIL, and each counter is only
+    written by the listener thread that owns its event kind, so no lock is
+    needed on the hot path.
+    """
+
+    def __init__(self, debounce=1.0, on_key=None, on_input=None):
+        self.debounce = debounce
+        self.on_key = on_key # Called with every pressed key, e.g. for the F1 menu hotkey
+        self.on_input = on_input # Called whenever a timestamp is stored, so at most once per debounce
+        self.last_input = time.monotonic()
+        self.counts = dict.fromkeys(EVENT_KINDS, 0)
+        self.recorded = 0 # Timestamps actually stored after debouncing
+        self._listeners = []
+        self._started = (time.monotonic(), time.process_time())
+        self._window = (self._started, dict(self.counts), 0)
+
+    def start(self):
+        """Starts the pynput mouse and keyboard listeners."""
+        from pynput import mouse, keyboard # Imported lazily so the monitor can be driven without a display
+        self._listeners = [
+            mouse.Listener(
+                on_move=lambda x, y: self._event("move"),
+                on_click=lambda x, y, button, pressed: self._event("click"),
+                on_scroll=lambda x, y, dx, dy: self._event("scroll"),
+            ),
+            keyboard.Listener(on_press=self._key),
+        ]
+        for listener in self._listeners:
+            listener.start()
+
+    def stop(self):
+        for listener in self._listeners:
+            listener.stop()
+        self._listeners = []
+
+    def _event(self, kind):
+        self.counts[kind] += 1
+        now = time.monotonic()
+        if now - self.last_input >= self.debounce:
+            self.last_input = now
+            self.recorded += 1
+            if self.on_input:
+                self.on_input()
+
+    def _key(self, key):
+        self._event("key")
+        if self.on_key:
+            self.on_key(key)
+
+    def idle_seconds(self):
+        """Seconds since the last recorded input, accurate to within debounce."""
+        return time.monotonic() - self.last_input
+
+    def rates(self):
+        """
+        Events per second by kind since the previous call, plus the process CPU
+        share over the same window, to measure what tracking itself costs.
+        """
+        (wall, cpu), counts, recorded = self._window
+        now = (time.monotonic(), time.process_time())
+        self._window = (now, dict(self.counts), self.recorded)
+        return self._rates(now[0] - wall, now[1] - cpu, counts, recorded)
+
+    def stats(self):
+        """Like rates(), but over the whole lifetime of the monitor."""
+        wall, cpu = self._started
+        return self._rates(time.monotonic() - wall, time.process_time() - cpu, dict.fromkeys(EVENT_KINDS, 0), 0)
+
+    def _rates(self, elapsed, cpu, counts, recorded):
+        elapsed = max(elapsed, 1e-9)
+        rates = {kind: (self.counts[kind] - counts[kind]) / elapsed for kind in EVENT_KINDS}
+        rates["recorded"] = (self.recorded - recorded) / elapsed
+        rates["cpu_percent"] = 100.0 * cpu / elapsed
+        return rates
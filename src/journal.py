@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+try:
+    from . import database as db
+    from . import metrics
+except ImportError:  # Run as a script from src/ (python src/tracker.py)
+    import database as db
+    import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.histogram("timetracker_journal_flush_seconds", "Time to commit one journal batch.")
+FLUSH_FAILURES = metrics.counter("timetracker_journal_flush_failures_total", "Journal flushes that failed and will be retried.")
+
+# --- Configuration ---
+BATCH_SIZE = 50  # records buffered before the writer commits early
+FLUSH_INTERVAL = 2.0  # seconds between group commits
+SPILL_FILE = os.path.join(os.path.dirname(db.DB_FILE), "timetracker.journal")
+
+
+class ActivityJournal:
+    """
+    Write-behind buffer for activity records.
+
+    record() only appends to memory (and to the spill file, if enabled); a
+    background thread group-commits the buffer with executemany every
+    FLUSH_INTERVAL seconds or as soon as BATCH_SIZE records are waiting.
+    flush() commits synchronously and is used on AFK, task change and shutdown.
+
+    The spill file is an append-only JSON-lines copy of the buffer. Every record
+    carries a sequence number and each batch commits its highest sequence into
+    the journal_checkpoint table, so replay() after a crash re-inserts exactly
+    the records that never reached the database.
+
+    With an outbox (see outbox.py), each batch is also queued for upload to a
+    sync server in the same transaction.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, spill_path=SPILL_FILE, outbox=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.outbox = outbox
+        self._buffer = []
+        self._seq = 0
+        self._lock = threading.Condition()
+        self._write_lock = threading.Lock()  # serializes batches between writer thread and flush()
+        self._spill = None
+        self._thread = None
+        self._running = False
+
+    # --- Lifecycle ---
+    def start(self, background=True):
+        """
+        Replays any spilled records and starts the background writer.
+
+        With background=False no thread is started and the caller is expected
+        to call flush() itself, e.g. from an asyncio task.
+        """
+        self.replay()
+        if self.spill_path:
+            self._spill = open(self.spill_path, "a", encoding="utf-8")
+        if not background:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="activity-journal", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops the writer thread and commits everything still buffered."""
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+    # --- Recording ---
+    def record(self, task_id, app_name, window_title, start_time, end_time):
+        """Queues an activity for the next group commit."""
+        logger.debug("Activity logged: App=%r, Window=%r for Task ID %s", app_name, window_title, task_id)
+        if not app_name or not app_name.strip():
+            return
+        with self._lock:
+            self._seq += 1
+            entry = (self._seq, (task_id, app_name, window_title, start_time, end_time))
+            self._buffer.append(entry)
+            if self._spill:
+                self._spill.write(_encode(entry) + "\n")
+                self._spill.flush()
+            if len(self._buffer) >= self.batch_size:
+                self._lock.notify()
+
+    def flush(self):
+        """Commits all buffered records before returning."""
+        with self._write_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return
+            try:
+                with FLUSH_SECONDS.time():
+                    self._commit([activity for _, activity in batch], checkpoint=batch[-1][0])
+            except Exception:
+                # Put the batch back in front so the next flush retries it in order
+                with self._lock:
+                    self._buffer[:0] = batch
+                FLUSH_FAILURES.inc()
+                raise
+            with self._lock:
+                self._compact_spill()
+
+    def pending(self):
+        """Returns the number of records not yet committed."""
+        with self._lock:
+            return len(self._buffer)
+
+    # --- Crash Recovery ---
+    def replay(self):
+        """Inserts spilled records newer than the committed checkpoint. Returns how many were replayed."""
+        checkpoint = db.get_journal_checkpoint()
+        self._seq = max(self._seq, checkpoint)
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return 0
+
+        entries = []
+        with open(self.spill_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = _decode(line)
+                except (ValueError, KeyError, IndexError):
+                    continue  # Torn final line from a crash mid-write
+                if entry[0] > checkpoint:
+                    entries.append(entry)
+
+        if entries:
+            self._commit([activity for _, activity in entries], checkpoint=entries[-1][0])
+            self._seq = max(self._seq, entries[-1][0])
+            logger.info("Replayed %d activities from %s.", len(entries), self.spill_path)
+        open(self.spill_path, "w").close()
+        return len(entries)
+
+    # --- Internals ---
+    def _commit(self, activities, checkpoint):
+        with db.connection():
+            db.add_activities(activities, checkpoint=checkpoint)
+            if self.outbox:
+                self.outbox.add(activities)
+        if self.outbox:
+            self.outbox.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._buffer) < self.batch_size:
+                    self._lock.wait(self.flush_interval)
+                if not self._running:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Activity journal flush failed, will retry: %s", e)
+
+    def _compact_spill(self):
+        """Rewrites the spill file so it only holds records that are still buffered. Caller holds _lock."""
+        if not self._spill:
+            return
+        self._spill.seek(0)
+        self._spill.truncate()
+        for entry in self._buffer:
+            self._spill.write(_encode(entry) + "\n")
+        self._spill.flush()
+
+
+def _encode(entry):
+    seq, (task_id, app_name, window_title, start_time, end_time) = entry
+    return json.dumps([seq, task_id, app_name, window_title, start_time.isoformat(), end_time.isoformat()])
+
+def _decode(line):
+    seq, task_id, app_name, window_title, start_time, end_time = json.loads(line)
+    return seq, (task_id, app_name, window_title, datetime.fromisoformat(start_time), datetime.fromisoformat(end_time))
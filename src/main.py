@@ -5,16 +5,121 @@ from pathlib import Path
 # Add the project root to sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, Response
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, HTTPException, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
 from src import database as db
+from src import metrics
+from src import summaries
+from src import activities as activity_queries
+from src import export
+from src import timeline
+from src import ingest
+from src import search
+from src import reports
+from src.read_pool import ReadPool
+from src.engine import TrackerEngine
+from src.input_monitor import InputMonitor
 from pathlib import Path
-from datetime import date, datetime, timedelta
-import csv
-import io
+from datetime import date
+from typing import Optional
+from collections import OrderedDict
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+
+# Set TIMETRACKER_EMBED_TRACKER=1 to run the tracker inside the web server process
+EMBED_TRACKER = os.environ.get("TIMETRACKER_EMBED_TRACKER", "").lower() in ("1", "true", "yes")
+LIVE_KEEPALIVE = 15 # seconds between keep-alive comments on an idle /api/live/stream
+
+tracker_engine = None # The embedded TrackerEngine, if running
+read_pool = ReadPool() # Database reads for async handlers run here, never on the event loop
+report_jobs = reports.ReportJobs() # Long reports run in worker processes
+SUMMARY_CACHE_SIZE = 512 # (summary_type, date range) entries kept in memory
+SUMMARY_MAX_AGE = 60 # seconds browsers may reuse a closed period's summary without revalidating
+# Set TIMETRACKER_INGEST_TOKEN to require "Authorization: Bearer <token>" on /api/ingest
+INGEST_TOKEN = os.environ.get("TIMETRACKER_INGEST_TOKEN")
+
+logger = logging.getLogger(__name__)
+
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "timetracker_http_request_seconds", "Time until the response headers were sent, by route.", ("method", "route", "status")
+)
+
+async def start_embedded_tracker():
+    """Starts a TrackerEngine on the server's event loop; prompts are answered through /api/live/task."""
+    monitor = InputMonitor()
+    afk_timeout = 60
+    try:
+        monitor.start()
+    except Exception as e:
+        logger.warning("Input listeners unavailable (%s); AFK detection is disabled.", e)
+        afk_timeout = float("inf")
+    engine = TrackerEngine(input_monitor=monitor, afk_timeout=afk_timeout)
+    try:
+        await engine.start()
+    except Exception as e:
+        monitor.stop()
+        logger.error("Embedded tracker not started: %s", e)
+        return None
+    return engine
+
+@asynccontextmanager
+async def lifespan(app):
+    global tracker_engine
+    # Bring an existing timetracker.db up to the current schema (indexes etc.)
+    db.create_tables()
+    if EMBED_TRACKER:
+        tracker_engine = await start_embedded_tracker()
+    yield
+    if tracker_engine:
+        engine, tracker_engine = tracker_engine, None
+        await engine.stop()
+        engine.input_monitor.stop()
+    report_jobs.close()
+    read_pool.close()
+    # Release the pooled SQLite connections held by the server threads
+    db.close_connections()
+
+app = FastAPI(title="Time Tracker API", lifespan=lifespan)
+
+class RequestMetrics:
+    """
+    ASGI middleware that records handler latency into HTTP_REQUEST_SECONDS.
+
+    Requests are labelled with the route template (/api/summary/{summary_type}
+    rather than each URL), so the number of series stays bounded. Streaming
+    responses are timed to their first byte of headers, not to the end of the
+    stream.
+    """
 
-app = FastAPI(title="Time Tracker API")
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+
+        async def send_and_observe(message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.observe(
+                    time.perf_counter() - started,
+                    scope["method"], getattr(route, "path", "unmatched"), str(message["status"])
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_and_observe)
+
+app.add_middleware(RequestMetrics)
 
 # Base directory
 BASE_DIR = Path(__file__).resolve().parent
@@ -29,224 +134,504 @@ async def read_root():
     except FileNotFoundError:
         return HTMLResponse(content="<h1>Error: index.html not found</h1>", status_code=404)
 
+def load_data():
+    """Builds the /api/data payload; runs on the read pool."""
+    with db.connection() as conn, db.QUERY_SECONDS.time("recent_activities"):
+        # Limit activities for performance in the initial dashboard
+        activities = list(activity_queries.ActivityPage(conn, 100, descending=True))
+    
+    # Projects and tasks come from the in-process name cache
+    return {
+        "projects": db.get_projects(),
+        "tasks": db.get_tasks(),
+        "activities": activities
+    }
+
 @app.get("/api/data")
 async def get_all_data():
     """Provides all tracking data in a single JSON response."""
-    conn = db.get_db_connection()
-    
-    projects = conn.execute("SELECT * FROM projects ORDER BY name").fetchall()
-    tasks = conn.execute("SELECT * FROM tasks ORDER BY start_time DESC").fetchall()
-    # Limit activities for performance in the initial dashboard
-    activities = conn.execute("SELECT * FROM activities ORDER BY start_time DESC LIMIT 100").fetchall()
-    
-    conn.close()
-    
-    # Convert sqlite3.Row objects to dicts for JSON serialization
+    return await read_pool.run(load_data)
+
+def load_activities_by_date(selected_date):
+    """Builds the /api/activities_by_date payload; runs on the read pool."""
+    with db.connection() as conn, db.QUERY_SECONDS.time("activities_by_date"):
+        # Fetch activities for the selected date; ActivityPage also reads an archived month's file
+        activities = list(activity_queries.ActivityPage(conn, start_date=selected_date, end_date=selected_date))
+
+    projects, tasks = referenced_entities(activities)
     return {
-        "projects": [dict(p) for p in projects],
-        "tasks": [dict(t) for t in tasks],
-        "activities": [dict(a) for a in activities]
+        "activities": activities,
+        "projects": projects,
+        "tasks": tasks
     }
 
+def referenced_entities(activities):
+    """Returns (projects, tasks): only the ones these activities refer to, from the name cache."""
+    tasks = [db.get_task(task_id) for task_id in dict.fromkeys(a['task_id'] for a in activities)]
+    tasks = [task for task in tasks if task]
+    projects = [db.get_project(project_id) for project_id in dict.fromkeys(t['project_id'] for t in tasks)]
+    return [project for project in projects if project], tasks
+
 @app.get("/api/activities_by_date")
 async def get_activities_by_date(selected_date: date = Query(default=date.today())):
     """Provides all activities for a specific date, ordered chronologically."""
-    conn = db.get_db_connection()
-    
-    # Fetch activities for the selected date
-    # SQLite stores dates as TEXT, so we compare string representations
-    date_str = selected_date.isoformat() + "%"
-    activities = conn.execute(
-        "SELECT * FROM activities WHERE start_time LIKE ? ORDER BY start_time ASC", 
-        (date_str,)
-    ).fetchall()
-
-    # Also fetch related projects and tasks for context
-    projects = conn.execute("SELECT * FROM projects").fetchall()
-    tasks = conn.execute("SELECT * FROM tasks").fetchall()
-    
-    conn.close()
+    return await read_pool.run(load_activities_by_date, selected_date)
+
+@app.get("/api/timeline")
+async def get_timeline(
+    start_date: Optional[date] = Query(None, description="First day (default: today)"),
+    end_date: Optional[date] = Query(None, description="Last day, inclusive (default: start_date)"),
+    pixels: Optional[int] = Query(None, ge=1, le=100000, description="Resolution: the range is split into this many buckets"),
+    bucket_seconds: Optional[float] = Query(None, gt=0, description="Resolution as a bucket width; overrides pixels"),
+):
+    """
+    Timeline segments for a day or a longer range, downsampled to a resolution.
 
-    return {
-        "activities": [dict(a) for a in activities],
-        "projects": [dict(p) for p in projects],
-        "tasks": [dict(t) for t in tasks]
-    }
+    Same-task activities are merged and fragments shorter than a bucket are
+    collapsed into one segment per bucket, attributed to its dominant task.
+    """
+    start_date = start_date or date.today() # Resolved per request; a Query default is fixed at import
+    if end_date is not None and end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date.")
+    data = await read_pool.run(timeline.load_timeline, start_date, end_date, pixels, bucket_seconds)
+    data["projects"], data["tasks"] = await read_pool.run(referenced_entities, data["segments"])
+    return data
+
+def _chunked(lines, size=activity_queries.FETCH_SIZE):
+    """Joins streamed lines into larger chunks so each send covers many rows."""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+@app.get("/api/search")
+async def search_activities(
+    q: str = Query(..., description="Words to find in window titles and app names"),
+    start_date: Optional[date] = Query(None, description="First day, by activity start time"),
+    end_date: Optional[date] = Query(None, description="Last day, inclusive"),
+    project_id: Optional[int] = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0, le=10000),
+):
+    """
+    Activities whose window title or app name contains every word of q, best
+    match first. Words need at least three characters. Pass next_offset back
+    as offset to get the next page; it is null on the last page.
+    """
+    try:
+        return await read_pool.run(search.search, q, start_date, end_date, project_id, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/activities")
+def list_activities(
+    start_date: Optional[date] = Query(None, description="First day, by activity start time"),
+    end_date: Optional[date] = Query(None, description="Last day, inclusive"),
+    project_id: Optional[int] = Query(None),
+    task_id: Optional[int] = Query(None),
+    app: Optional[str] = Query(None, description="Exact app name"),
+    after: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    order: str = Query("asc", description="'asc' or 'desc' by start time"),
+    limit: int = Query(1000, ge=1, description="Rows per page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    format: str = Query("json", description="'json' (streamed array) or 'ndjson'")
+):
+    """
+    Streams activities with keyset pagination on (start_time, id).
+
+    JSON responses are {"activities": [...], "next_cursor": ...}; NDJSON
+    responses are one activity per line followed by a {"next_cursor": ...}
+    line. Pass next_cursor back as `after` to get the next page; it is null
+    on the last page.
+    """
+    try:
+        selected = activity_queries.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        cursor = activity_queries.decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Invalid order. Must be 'asc' or 'desc'.")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'json' or 'ndjson'.")
+
+    filters = dict(
+        start_date=start_date, end_date=end_date, project_id=project_id, task_id=task_id,
+        app_name=app, after=cursor, descending=order == "desc",
+    )
+
+    def lines():
+        # Starlette pulls each chunk on a worker thread, so the rows come from a connection of their own
+        with db.dedicated_connection(readonly=True) as conn:
+            page = activity_queries.ActivityPage(conn, limit, selected, **filters)
+            if format == "ndjson":
+                for row in page:
+                    yield json.dumps(row) + "\n"
+                yield json.dumps({"next_cursor": page.next_cursor}) + "\n"
+            else:
+                yield '{"activities": ['
+                separator = ""
+                for row in page:
+                    yield separator + json.dumps(row)
+                    separator = ","
+                yield f'], "next_cursor": {json.dumps(page.next_cursor)}}}'
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(_chunked(lines()), media_type=media_type)
+
+@app.get("/api/export/activities")
+def export_activities(
+    start_date: Optional[date] = Query(None, description="First day, by activity start time"),
+    end_date: Optional[date] = Query(None, description="Last day, inclusive"),
+    project_id: Optional[int] = Query(None),
+    task_id: Optional[int] = Query(None),
+    format: str = Query("csv", description="'csv', 'ndjson' or 'parquet' (needs the optional pyarrow package on the server)"),
+    gzip: bool = Query(False, description="Compress the download")
+):
+    """Streams raw activities with project and task names, for payroll and billing."""
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'csv', 'ndjson' or 'parquet'.")
+    if format == "parquet" and not export.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export needs the optional pyarrow package on the server (pip install pyarrow).")
+
+    def chunks():
+        with db.dedicated_connection(readonly=True) as conn:
+            yield from export.export_activities(
+                conn, format, gzip, start_date=start_date, end_date=end_date, project_id=project_id, task_id=task_id
+            )
+
+    # Parquet is compressed internally, so only CSV and NDJSON are sent as .gz files
+    media_type = "application/gzip" if gzip and format != "parquet" else export.MEDIA_TYPES[format]
+    response = StreamingResponse(chunks(), media_type=media_type)
+    response.headers["Content-Disposition"] = f"attachment; filename={export.filename(format, start_date, end_date, gzip)}"
+    return response
+
+@app.get("/api/live")
+async def get_live():
+    """Current project, task and activity from the embedded tracker's memory."""
+    if tracker_engine is None:
+        return {"running": False}
+    return tracker_engine.snapshot()
+
+@app.get("/api/live/stream")
+async def stream_live(request: Request):
+    """Server-Sent Events stream of the embedded tracker's state, one event per change."""
+    engine = tracker_engine
+    if engine is None:
+        raise HTTPException(status_code=503, detail="The tracker is not running in this process. Set TIMETRACKER_EMBED_TRACKER=1.")
+    queue = engine.subscribe()
+
+    async def events():
+        try:
+            yield f"data: {json.dumps(engine.snapshot())}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    state = await asyncio.wait_for(queue.get(), LIVE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(state)}\n\n"
+        finally:
+            engine.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+class TaskChoice(BaseModel):
+    task_id: int
+
+@app.post("/api/live/task")
+async def choose_live_task(choice: TaskChoice):
+    """Answers the embedded tracker's open prompt, or switches its task right away."""
+    if tracker_engine is None:
+        raise HTTPException(status_code=503, detail="The tracker is not running in this process. Set TIMETRACKER_EMBED_TRACKER=1.")
+    task = await read_pool.run(db.get_task, choice.task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found.")
+    await tracker_engine.choose_task(task['project_id'], task['id'])
+    return tracker_engine.snapshot()
+
+# --- Summary cache ---
+class SummaryCache:
+    """
+    Summaries of closed periods, keyed by (summary_type, start, end, device, user).
+
+    Each entry remembers the db.data_version() it was computed at and is only
+    served while that is unchanged. So a late write (journal replay, an import,
+    a task rename) invalidates it, and nothing else does. Periods that reach
+    today or later also depend on the clock (open activities count up to now),
+    so they are computed on every request. Bodies are kept encoded, together
+    with their ETag, so a hit costs one meta lookup.
+    """
 
-def calculate_duration(start_time_str, end_time_str):
-    """Calculates the duration in seconds between two ISO formatted time strings."""
-    start_time = datetime.fromisoformat(start_time_str)
-    end_time = datetime.fromisoformat(end_time_str) if end_time_str else datetime.now()
-    return (end_time - start_time).total_seconds()
+    def __init__(self, size=SUMMARY_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, summary_type, selected_date, device=None, user=None):
+        """Returns (body, etag, closed) for the period containing selected_date. Runs on the read pool."""
+        start, end = summaries.period_bounds(summary_type, selected_date)
+        closed = end < date.today()
+        key = (summary_type, start, end, device, user)
+        version = db.data_version() # Read before summarizing, so a racing write can only make the entry stale
+        with self._lock:
+            entry = self._entries.get(key)
+            if closed and entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1], entry[2], closed
+            self.stats["misses"] += 1
+
+        # Encoded the way JSONResponse does, so cached and uncached responses are byte-identical
+        body = json.dumps(summaries.summarize(start, end, device=device, user=user), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        if closed:
+            with self._lock:
+                self._entries[key] = (version, body, etag)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return body, etag, closed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+summary_cache = SummaryCache()
+
+def collect_cache_metrics():
+    """Summary and name cache counters, read when /metrics is rendered."""
+    names = db.name_cache_stats()
+    return [
+        ("timetracker_summary_cache_requests_total", "Summary cache lookups, by result.", "counter",
+         [({"result": "hit"}, summary_cache.stats["hits"]), ({"result": "miss"}, summary_cache.stats["misses"])]),
+        ("timetracker_name_cache_requests_total", "Project and task name cache lookups, by result.", "counter",
+         [({"result": "hit"}, names["hits"]), ({"result": "miss"}, names["misses"])]),
+        ("timetracker_name_cache_reloads_total", "Name cache reloads after projects or tasks changed.", "counter",
+         [({}, names["reloads"])]),
+    ]
+
+metrics.register_collector(collect_cache_metrics)
+
+def _etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value names etag (weak comparison, as RFC 9110 asks for)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+async def summary_response(request, summary_type, selected_date, device=None, user=None):
+    """
+    Serves a cached summary with an ETag, or 304 Not Modified if the client already has it.
+
+    Closed periods may be reused by the browser for SUMMARY_MAX_AGE seconds;
+    open ones must be revalidated every time.
+    """
+    body, etag, closed = await read_pool.run(summary_cache.get, summary_type, selected_date, device, user)
+    cache_control = f"private, max-age={SUMMARY_MAX_AGE}" if closed else "private, no-cache"
+    return conditional_response(request, body, etag, cache_control)
+
+def conditional_response(request, body, etag, cache_control):
+    """A JSON response carrying etag, or an empty 304 if the request's If-None-Match names it."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+DEVICE_QUERY = Query(None, description="Only count activities from this device (see /api/devices)")
+USER_QUERY = Query(None, description="Only count activities from this user's devices")
 
 @app.get("/api/summary/daily")
-async def get_daily_summary(selected_date: date = Query(default=date.today())):
+async def get_daily_summary(request: Request, selected_date: date = Query(default=date.today()),
+                            device: Optional[str] = DEVICE_QUERY, user: Optional[str] = USER_QUERY):
     """Provides a daily summary of time spent per project and task."""
-    conn = db.get_db_connection()
-    
-    date_str = selected_date.isoformat() + "%"
-    query = """
-        SELECT
-            p.name AS project_name,
-            t.name AS task_name,
-            a.start_time,
-            a.end_time
-        FROM activities a
-        JOIN tasks t ON a.task_id = t.id
-        JOIN projects p ON t.project_id = p.id
-        WHERE a.start_time LIKE ?
-        ORDER BY a.start_time ASC
-    """
-    activities = conn.execute(query, (date_str,)).fetchall()
-    conn.close()
-
-    summary = {}
-    for activity in activities:
-        duration = calculate_duration(activity['start_time'], activity['end_time'])
-        project_name = activity['project_name']
-        task_name = activity['task_name']
-
-        if project_name not in summary:
-            summary[project_name] = {'total_duration': 0, 'tasks': {}}
-        
-        summary[project_name]['total_duration'] += duration
-
-        if task_name not in summary[project_name]['tasks']:
-            summary[project_name]['tasks'][task_name] = 0
-        summary[project_name]['tasks'][task_name] += duration
-
-    return summary
+    return await summary_response(request, "daily", selected_date, device, user)
 
 @app.get("/api/summary/weekly")
-async def get_weekly_summary(selected_date: date = Query(default=date.today())):
-    """Provides a weekly summary of time spent per project and task."""
-    conn = db.get_db_connection()
-    
-    # Calculate the start and end of the week (Monday to Sunday)
-    start_of_week = selected_date - timedelta(days=selected_date.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
-
-    query = """
-        SELECT
-            p.name AS project_name,
-            t.name AS task_name,
-            a.start_time,
-            a.end_time
-        FROM activities a
-        JOIN tasks t ON a.task_id = t.id
-        JOIN projects p ON t.project_id = p.id
-        WHERE substr(a.start_time, 1, 10) BETWEEN ? AND ?
-        ORDER BY a.start_time ASC
-    """
-    activities = conn.execute(query, (start_of_week.isoformat(), end_of_week.isoformat())).fetchall()
-    conn.close()
-
-    summary = {}
-    for activity in activities:
-        duration = calculate_duration(activity['start_time'], activity['end_time'])
-        project_name = activity['project_name']
-        task_name = activity['task_name']
-
-        if project_name not in summary:
-            summary[project_name] = {'total_duration': 0, 'tasks': {}}
-        
-        summary[project_name]['total_duration'] += duration
-
-        if task_name not in summary[project_name]['tasks']:
-            summary[project_name]['tasks'][task_name] = 0
-        summary[project_name]['tasks'][task_name] += duration
-
-    return summary
+async def get_weekly_summary(request: Request, selected_date: date = Query(default=date.today()),
+                             device: Optional[str] = DEVICE_QUERY, user: Optional[str] = USER_QUERY):
+    """Provides a weekly (Monday to Sunday) summary of time spent per project and task."""
+    return await summary_response(request, "weekly", selected_date, device, user)
 
 @app.get("/api/summary/monthly")
-async def get_monthly_summary(selected_date: date = Query(default=date.today())):
+async def get_monthly_summary(request: Request, selected_date: date = Query(default=date.today()),
+                              device: Optional[str] = DEVICE_QUERY, user: Optional[str] = USER_QUERY):
     """Provides a monthly summary of time spent per project and task."""
-    conn = db.get_db_connection()
-    
-    # Calculate the start and end of the month
-    start_of_month = selected_date.replace(day=1)
-    # Get the last day of the month
-    if selected_date.month == 12:
-        end_of_month = selected_date.replace(year=selected_date.year + 1, month=1, day=1) - timedelta(days=1)
-    else:
-        end_of_month = selected_date.replace(month=selected_date.month + 1, day=1) - timedelta(days=1)
-
-    query = """
-        SELECT
-            p.name AS project_name,
-            t.name AS task_name,
-            a.start_time,
-            a.end_time
-        FROM activities a
-        JOIN tasks t ON a.task_id = t.id
-        JOIN projects p ON t.project_id = p.id
-        WHERE substr(a.start_time, 1, 10) BETWEEN ? AND ?
-        ORDER BY a.start_time ASC
-    """
-    activities = conn.execute(query, (start_of_month.isoformat(), end_of_month.isoformat())).fetchall()
-    conn.close()
-
-    summary = {}
-    for activity in activities:
-        duration = calculate_duration(activity['start_time'], activity['end_time'])
-        project_name = activity['project_name']
-        task_name = activity['task_name']
-
-        if project_name not in summary:
-            summary[project_name] = {'total_duration': 0, 'tasks': {}}
-        
-        summary[project_name]['total_duration'] += duration
-
-        if task_name not in summary[project_name]['tasks']:
-            summary[project_name]['tasks'][task_name] = 0
-        summary[project_name]['tasks'][task_name] += duration
-
-    return summary
-
-async def get_summary_data(summary_type: str, selected_date: date):
-    if summary_type == "daily":
-        return await get_daily_summary(selected_date)
-    elif summary_type == "weekly":
-        return await get_weekly_summary(selected_date)
-    elif summary_type == "monthly":
-        return await get_monthly_summary(selected_date)
-    else:
+    return await summary_response(request, "monthly", selected_date, device, user)
+
+def load_dashboard(selected_date, pixels=None):
+    """
+    Builds the /api/dashboard body as (bytes, etag); runs on the read pool.
+
+    Everything is read inside one snapshot, so the timeline and summaries
+    agree even if the tracker commits meanwhile. The summaries are the
+    encoded bodies from summary_cache, spliced in without being decoded again.
+    """
+    with db.snapshot():
+        day = timeline.load_timeline(selected_date, pixels=pixels)
+        projects, tasks = referenced_entities(day["segments"])
+        summary_bodies = [
+            json.dumps(summary_type).encode("utf-8") + b":" + summary_cache.get(summary_type, selected_date)[0]
+            for summary_type in summaries.SUMMARY_TYPES
+        ]
+    head = {
+        "date": selected_date.isoformat(),
+        "bucket_seconds": day["bucket_seconds"],
+        "timeline": day["segments"],
+        "projects": projects,
+        "tasks": tasks,
+    }
+    body = json.dumps(head, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    body = body[:-1] + b',"summaries":{' + b",".join(summary_bodies) + b"}}"
+    return body, '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+@app.get("/api/dashboard")
+async def get_dashboard(
+    request: Request,
+    selected_date: Optional[date] = Query(None, alias="date", description="Day to show (default: today)"),
+    pixels: Optional[int] = Query(None, ge=1, le=100000, description="Timeline resolution (see /api/timeline)"),
+):
+    """
+    Everything the dashboard shows for one date, in a single response.
+
+    Returns the day's timeline downsampled to `pixels` (as /api/timeline
+    does), the daily, weekly and monthly summaries, and only the projects and
+    tasks the timeline refers to.
+    """
+    selected_date = selected_date or date.today() # Resolved per request; a Query default is fixed at import
+    body, etag = await read_pool.run(load_dashboard, selected_date, pixels)
+    return conditional_response(request, body, etag, "private, no-cache")
+
+async def get_summary_data(summary_type: str, selected_date: date, device=None, user=None):
+    try:
+        body, _, _ = await read_pool.run(summary_cache.get, summary_type, selected_date, device, user)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid summary_type. Must be 'daily', 'weekly', or 'monthly'.")
+    return json.loads(body)
 
 @app.get("/api/reports/summary")
 async def export_summary_report(
     summary_type: str = Query(..., description="Type of summary: 'daily', 'weekly', or 'monthly'"),
     selected_date: date = Query(default=date.today(), description="Date for the summary"),
-    format: str = Query("json", description="Output format: 'json' or 'csv'")
+    format: str = Query("json", description="Output format: 'json' or 'csv'"),
+    device: Optional[str] = DEVICE_QUERY,
+    user: Optional[str] = USER_QUERY,
 ):
     """Exports summary data in JSON or CSV format."""
-    summary_data = await get_summary_data(summary_type, selected_date)
+    summary_data = await get_summary_data(summary_type, selected_date, device, user)
 
     if format == "json":
         return JSONResponse(content=summary_data)
     elif format == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-
-        # Write header
-        writer.writerow([f"Project ({summary_type.capitalize()} Summary)", "Task", "Hours"])
-
-        # Write data
-        for project_name, project_info in summary_data.items():
-            total_project_hours = project_info['total_duration'] / 3600
-            writer.writerow([project_name, "", f"{total_project_hours:.2f}"])
-            for task_name, task_duration in project_info['tasks'].items():
-                task_hours = task_duration / 3600
-                writer.writerow(["", task_name, f"{task_hours:.2f}"])
-        
-        response = Response(content=output.getvalue(), media_type="text/csv")
+        response = Response(content=reports.summary_csv(summary_data, f"{summary_type.capitalize()} Summary"), media_type="text/csv")
         response.headers["Content-Disposition"] = f"attachment; filename={summary_type}_summary_{selected_date.isoformat()}.csv"
         return response
     else:
         raise HTTPException(status_code=400, detail="Invalid format. Must be 'json' or 'csv'.")
 
+class ReportJobRequest(BaseModel):
+    start_date: date
+    end_date: date
+    device: Optional[str] = None
+    user: Optional[str] = None
+
+@app.post("/api/reports/jobs", status_code=202)
+async def start_report_job(report: ReportJobRequest):
+    """
+    Starts a summary report for a long date range (up to ten years) as a background job.
+
+    The range is summarized month by month in worker processes, so it never
+    slows the interactive endpoints down. Poll GET /api/reports/jobs/{id}
+    until status is 'done' or 'failed', then download it from
+    /api/reports/jobs/{id}/result.
+    """
+    try:
+        return report_jobs.start(report.start_date, report.end_date, report.device, report.user)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/reports/jobs/{job_id}")
+async def get_report_job(job_id: str, wait: float = Query(0, ge=0, le=30, description="Seconds to wait for the job to finish before answering")):
+    """A report job's status and progress (chunks_done of chunks), and its result once status is 'done'."""
+    if report_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Report job not found.")
+    if wait:
+        await report_jobs.wait(job_id, wait)
+    return report_jobs.get(job_id)
+
+@app.get("/api/reports/jobs/{job_id}/result")
+async def get_report_job_result(job_id: str, format: str = Query("json", description="Output format: 'json' or 'csv'")):
+    """A finished report job's summary, as JSON or as a CSV download."""
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Report job not found.")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Report job is {job['status']}.")
+    if format == "json":
+        return JSONResponse(content=job["result"])
+    elif format == "csv":
+        response = Response(content=reports.summary_csv(job["result"], f"{job['start_date']} to {job['end_date']}"), media_type="text/csv")
+        response.headers["Content-Disposition"] = f"attachment; filename=summary_{job['start_date']}_{job['end_date']}.csv"
+        return response
+    else:
+        raise HTTPException(status_code=400, detail="Invalid format. Must be 'json' or 'csv'.")
+
+# --- Ingestion ---
+async def read_body(request, limit):
+    """The request body, or 413 as soon as it grows past limit bytes."""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {limit} bytes.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+@app.post("/api/ingest")
+async def ingest_activities(
+    request: Request,
+    device: str = Query(..., description="Name of the uploading machine"),
+    sequence: int = Query(..., ge=1, description="Batch number; each batch from a device has a higher one"),
+    user: Optional[str] = Query(None, description="User the device belongs to"),
+):
+    """
+    Stores a batch of activities uploaded by another machine's tracker.
+
+    The body is NDJSON, gzip-compressed or not (see src/ingest.py for the
+    line format). The batch is stored in one transaction and exactly once:
+    a retried batch is answered with status 'duplicate', and activities whose
+    id the device already uploaded are skipped.
+    """
+    if INGEST_TOKEN and not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {INGEST_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Missing or wrong ingest token.")
+    body = await read_body(request, ingest.MAX_BODY_BYTES)
+    try:
+        # A writable connection is needed, so this runs on a worker thread rather than the read pool
+        return await asyncio.to_thread(ingest.ingest_upload, body, request.headers.get("content-encoding"), device, user, sequence)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/devices")
+async def get_devices():
+    """Lists the devices activities were recorded on, with their user and the last batch received."""
+    return await read_pool.run(db.get_devices)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters and latency histograms in the Prometheus text format."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
+    logging.basicConfig(level=os.environ.get("TIMETRACKER_LOG_LEVEL", "INFO").upper(), format="%(message)s")
     print("Starting web server...")
     print("View the dashboard at http://127.0.0.1:8000")
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+In-process counters and latency histograms, rendered in Prometheus text format.
+
+Modules declare their metrics at import time and record into them on the hot
+path:
+
+    QUERY_SECONDS = metrics.histogram("timetracker_db_query_seconds", "Database query time.", ("query",))
+
+    with QUERY_SECONDS.time("summary"):
+        ...
+
+The web server exposes render() at /metrics; the tracker writes it to a file
+with dump(). Set TIMETRACKER_METRICS=0 (or metrics.ENABLED = False) to turn
+recording off. A disabled time() returns a shared no-op context manager and
+inc()/observe() return at once, so the instrumentation costs a function call.
+"""
+import bisect
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("TIMETRACKER_METRICS", "1").lower() not in ("0", "false", "no")
+
+# Upper bounds in seconds, from sub-millisecond queries to slow requests
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {} # name -> Counter or Histogram, in registration order
+_registry_lock = threading.Lock()
+_collectors = []
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """Observation counts per bucket, plus their sum, per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # labels -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labels):
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self, labels) if ENABLED else _NULL_TIMER
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                yield self.name + "_bucket", dict(base, le=_format_value(bound)), cumulative
+            yield self.name + "_sum", base, series[-1]
+            yield self.name + "_count", base, cumulative
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+# --- Registry ---
+def _register(cls, name, *args):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name!r} is already registered as a {metric.type}.")
+        return metric
+
+def counter(name, help, labelnames=()):
+    """Returns the counter registered under name, creating it on first use."""
+    return _register(Counter, name, help, labelnames)
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    """Returns the histogram registered under name, creating it on first use."""
+    return _register(Histogram, name, help, labelnames, buckets)
+
+def register_collector(collect):
+    """
+    Adds a callable that is asked for extra metrics at render time, for values
+    that already live elsewhere (cache sizes, queue lengths). It returns
+    (name, help, type, [(labels dict, value), ...]) tuples.
+    """
+    if collect not in _collectors:
+        _collectors.append(collect)
+
+def reset():
+    """Zeroes every registered metric."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        metric.reset()
+
+# --- Exposition ---
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(_sample_line(*sample) for sample in metric.samples())
+    for collect in list(_collectors):
+        for name, help, type, samples in collect():
+            lines.append(f"# HELP {name} {_escape_help(help)}")
+            lines.append(f"# TYPE {name} {type}")
+            lines.extend(_sample_line(name, labels, value) for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+def dump(path):
+    """Writes render() to path, replacing the file in one step."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(temporary, path)
+
+def _sample_line(name, labels, value):
+    if labels:
+        pairs = ",".join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+        return f"{name}{{{pairs}}} {_format_value(value)}"
+    return f"{name} {_format_value(value)}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _escape_help(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
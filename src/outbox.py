@@ -0,0 +1,213 @@
+"""
+Offline outbox that uploads this machine's activities to a sync server.
+
+When the tracker is given a sync URL, every batch the activity journal
+commits to the local database is also encoded as an upload (gzip NDJSON, see
+ingest.py) and stored in the outbox table in the same transaction. So an
+activity is queued for upload exactly when it is stored locally, and the
+queue survives restarts and time offline. The outbox's autoincrementing
+sequence column is the batch's per-device sequence number. Because it starts
+again at 1 in a new database, the default device name includes the
+database's install id. A reset database, or a second one on the same
+machine, reports as a new device, so the server never takes its first
+batches for ones it already has.
+
+A background thread sends the batches oldest first and deletes each one once
+the server has acknowledged it, as stored or as a duplicate of a batch it
+already has. While the server can't be reached, uploads are retried with
+exponential backoff and jitter between MIN_BACKOFF and MAX_BACKOFF seconds.
+Only a batch the server finds invalid (400, 413 or 422) is dropped. Other
+errors, including a wrong token or URL, are retried the same way and logged
+as errors.
+"""
+import getpass
+import gzip
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+try:
+    from . import database as db
+    from . import metrics
+except ImportError:  # Run as a script from src/ (python src/tracker.py)
+    import database as db
+    import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MIN_BACKOFF = 1.0 # seconds before the first retry
+MAX_BACKOFF = 300.0 # seconds, longest wait between retries
+IDLE_CHECK = 60.0 # seconds between looks at the outbox when nothing new was queued
+UPLOAD_TIMEOUT = 30 # seconds per request
+REJECTED_STATUSES = (400, 413, 422) # The batch itself is invalid; sending it again can't help
+SETUP_STATUSES = (401, 403, 404) # Wrong TIMETRACKER_SYNC_TOKEN or TIMETRACKER_SYNC_URL; retried until it is fixed
+
+UPLOADS = metrics.counter("timetracker_outbox_uploads_total", "Outbox upload attempts, by result.", ("result",))
+UPLOAD_SECONDS = metrics.histogram("timetracker_outbox_upload_seconds", "Time to upload one outbox batch.")
+
+
+def default_device():
+    """This machine's name: TIMETRACKER_DEVICE, or the host name followed by the database's install id."""
+    return os.environ.get("TIMETRACKER_DEVICE") or f"{socket.gethostname()}-{db.install_id():08x}"
+
+def default_user():
+    """TIMETRACKER_USER, or the login name (None if it can't be determined)."""
+    try:
+        return os.environ.get("TIMETRACKER_USER") or getpass.getuser()
+    except (OSError, KeyError):
+        return None
+
+def encode_batch(activities):
+    """
+    Encodes (task_id, app_name, window_title, start_time, end_time) activities
+    as a gzip-compressed NDJSON upload, giving each a new client id.
+    Returns (body, number of activities encoded).
+    """
+    lines = []
+    for task_id, app_name, window_title, start_time, end_time in activities:
+        task = db.get_task(task_id)
+        project = db.get_project(task['project_id']) if task else None
+        if project is None:
+            continue # Not attributable on another machine
+        lines.append(json.dumps({
+            "id": uuid.uuid4().hex,
+            "project": project['name'],
+            "task": task['name'],
+            "app_name": app_name,
+            "window_title": window_title,
+            "start_ms": db.to_epoch_ms(start_time),
+            "end_ms": db.to_epoch_ms(end_time),
+            "tz_offset": db.utc_offset_minutes(start_time),
+        }, ensure_ascii=False))
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), mtime=0), len(lines)
+
+
+class UploadRejected(Exception):
+    """The server refused a batch for good (one of REJECTED_STATUSES)."""
+
+
+class Outbox:
+    """
+    Durable upload queue for one device.
+
+    add() runs inside the journal's transaction. start() launches the sender
+    thread, notify() wakes it after a commit and close() stops it; batches
+    still queued are sent the next time the tracker runs.
+    """
+
+    def __init__(self, url, device=None, user=None, token=None, min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.url = url.rstrip("/") + "/api/ingest"
+        self.device = device or default_device()
+        self.user = user if user is not None else default_user()
+        self.token = token
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    # --- Lifecycle ---
+    def start(self):
+        """Starts the background sender."""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-sender", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stops the sender, abandoning a retry wait but not an upload in flight."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    # --- Queueing ---
+    def add(self, activities):
+        """Queues activities for upload. Call it in the block that stores them, so both commit together."""
+        body, count = encode_batch(activities)
+        if not count:
+            return
+        with db.connection() as conn:
+            conn.execute(
+                "INSERT INTO outbox (body, activity_count, created_ms) VALUES (?, ?, ?)",
+                (body, count, db.to_epoch_ms(datetime.now()))
+            )
+
+    def notify(self):
+        """Wakes the sender; safe to call from any thread."""
+        self._wake.set()
+
+    def pending(self):
+        """Returns (batches, activities) still waiting to be uploaded."""
+        with db.connection() as conn:
+            row = conn.execute("SELECT COUNT(*), COALESCE(SUM(activity_count), 0) FROM outbox").fetchone()
+            return row[0], row[1]
+
+    # --- Sending ---
+    def send_pending(self):
+        """Uploads queued batches oldest first until the outbox is empty. Returns how many were sent."""
+        sent = 0
+        while not self._stopping.is_set():
+            with db.connection() as conn:
+                row = conn.execute("SELECT sequence, body FROM outbox ORDER BY sequence LIMIT 1").fetchone()
+            if row is None:
+                break
+            try:
+                with UPLOAD_SECONDS.time():
+                    reply = self._upload(row['sequence'], row['body'])
+                UPLOADS.inc(reply.get("status", "stored"))
+            except UploadRejected as e:
+                # Retrying can't help; the activities are still in the local database
+                UPLOADS.inc("rejected")
+                logger.error("Sync server rejected outbox batch %d, dropping it: %s", row['sequence'], e)
+            with db.connection() as conn:
+                conn.execute("DELETE FROM outbox WHERE sequence = ?", (row['sequence'],))
+            sent += 1
+        return sent
+
+    def _upload(self, sequence, body):
+        params = {"device": self.device, "sequence": sequence}
+        if self.user:
+            params["user"] = self.user
+        request = urllib.request.Request(
+            f"{self.url}?{urllib.parse.urlencode(params)}", data=body, method="POST",
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+        )
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=UPLOAD_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code in REJECTED_STATUSES:
+                raise UploadRejected(f"HTTP {e.code}: {e.read()[:500].decode('utf-8', 'replace')}")
+            raise
+
+    def _run(self):
+        backoff = 0.0
+        while not self._stopping.is_set():
+            self._wake.clear()
+            try:
+                self.send_pending()
+            except Exception as e: # Network errors, 5xx answers, a locked database
+                UPLOADS.inc("failed")
+                backoff = min(max(backoff * 2, self.min_backoff), self.max_backoff)
+                delay = random.uniform(backoff / 2, backoff)
+                if isinstance(e, urllib.error.HTTPError) and e.code in SETUP_STATUSES:
+                    logger.error("Sync server at %s refused the upload (HTTP %d), check TIMETRACKER_SYNC_URL and "
+                                 "TIMETRACKER_SYNC_TOKEN; retrying in %.1fs", self.url, e.code, delay)
+                else:
+                    logger.warning("Outbox upload failed, retrying in %.1fs: %s", delay, e)
+                self._stopping.wait(delay) # New commits don't cut the backoff short
+                continue
+            backoff = 0.0
+            self._wake.wait(IDLE_CHECK)
@@ -0,0 +1,46 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/
+    import database as db
+
+READ_POOL_SIZE = 4 # worker threads, each with its own read-only connection
+
+
+class ReadPool:
+    """
+    Runs blocking database reads for the web server off the event loop.
+
+    Work goes to a bounded thread pool whose threads use read-only pooled
+    connections (see db.use_readonly_connections()), so the db helpers and
+    summaries work unchanged inside it. Under WAL the workers read
+    concurrently with each other and with the tracker's writes, and a slow
+    query only occupies one worker instead of stalling every request.
+    """
+
+    def __init__(self, size=READ_POOL_SIZE):
+        self.size = size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    async def run(self, fn, *args):
+        """Awaits fn(*args) on a pool thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+
+    def close(self):
+        """Shuts the workers down; the next run() starts a fresh pool."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.size, thread_name_prefix="db-read", initializer=db.use_readonly_connections
+                )
+            return self._executor
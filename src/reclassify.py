@@ -0,0 +1,189 @@
+"""
+Re-applies the current rules to activities that were already recorded.
+
+The tracker only applies rules as windows change, so a rule added later
+leaves past activities on whatever task was active at the time. This job
+walks a date range in (start_ms, id) order, CHUNK_SIZE activities at a time,
+and matches each window title against the rules with the compiled
+RuleEngine. Each distinct title is matched once, because titles are interned
+strings. Every chunk of changes is committed in its own transaction by
+db.reassign_activities(), which moves the seconds between daily_rollups rows
+instead of rebuilding them. Its UPDATEs bump data_version, which invalidates
+the web server's summary cache.
+
+An activity is moved only if a rule matches its title and assigns a task
+other than the activity's. A rule for a whole project is applied as the
+tracker applies it: an activity already on a task of that project stays,
+and any other moves to the project's DEFAULT_TASK_NAME task, which is
+created if needed (a dry run reports it as new). Activities in archived
+months are read for the dry run but are never changed (restore the month
+with archive.py first).
+
+    python src/reclassify.py --start 2025-01-01 --end 2025-03-31 --dry-run
+    python src/reclassify.py --start 2025-01-01 --end 2025-03-31
+"""
+import argparse
+import sys
+from datetime import date
+
+try:
+    from . import database as db
+    from . import activities
+    from .rules import DEFAULT_TASK_NAME, RuleEngine
+except ImportError:  # Run as a script from src/
+    import database as db
+    import activities
+    from rules import DEFAULT_TASK_NAME, RuleEngine
+
+CHUNK_SIZE = 2000 # activities read, and changes committed, per transaction
+
+# {source} and {window} come from db.activity_windows()
+CHUNK_QUERY = """
+    SELECT a.id, a.task_id, a.title_id, a.start_ms, a.end_ms
+    FROM {source} a
+    WHERE {window} AND a.start_ms >= :after_ms AND (a.start_ms > :after_ms OR a.id > :after_id)
+    ORDER BY a.start_ms, a.id
+    LIMIT :limit
+"""
+
+def reclassify(start_date=None, end_date=None, dry_run=False, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Applies the current rules to the activities that start from start_date
+    through end_date inclusive (None bounds are open).
+
+    progress, if given, is called as progress(checked, total) after every
+    chunk. Returns a report: {'checked', 'changed', 'moved', 'skipped',
+    'moves'}. changed counts the activities the rules would move, moved the
+    ones actually moved (0 in a dry run), and skipped the ones left alone
+    because they are archived or changed while the job ran. moves lists
+    {'from_task_id', 'to_project_id', 'to_task_id', 'activities', 'seconds'}
+    per pair of tasks, largest first. to_task_id is None in a dry run for a
+    DEFAULT_TASK_NAME task that doesn't exist yet.
+    """
+    engine = RuleEngine(db.get_rules())
+    start_ms, end_ms = activities.query_range(start_date=start_date, end_date=end_date)
+    targets = {} # title_id -> (project_id, task_id or None) the rules assign it, or None
+    default_tasks = {} # project_id -> its DEFAULT_TASK_NAME task id (None if not created in a dry run)
+    moves = {} # (from_task_id, to_project_id, to_task_id) -> [activities, seconds]
+    checked = changed = moved = 0
+
+    with db.connection() as conn:
+        total = sum(
+            conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {db.window_condition('start_ms', window_start, window_end)}").fetchone()[0]
+            for source, window_start, window_end in db.activity_windows(conn, start_ms, end_ms)
+        )
+
+    for rows in _chunks(start_ms, end_ms, chunk_size):
+        _match_titles(engine, targets, {row['title_id'] for row in rows} - targets.keys())
+        changes = []
+        for row in rows:
+            target = targets.get(row['title_id'])
+            if target is None:
+                continue
+            to_project_id, to_task_id = target
+            if to_task_id is None: # A rule for a whole project, applied as TrackerEngine applies it
+                task = db.get_task(row['task_id'])
+                if task is not None and task['project_id'] == to_project_id:
+                    continue
+                if to_project_id not in default_tasks:
+                    default_tasks[to_project_id] = _default_task(to_project_id, create=not dry_run)
+                to_task_id = default_tasks[to_project_id]
+            if to_task_id == row['task_id']:
+                continue
+            changes.append((row['id'], row['task_id'], to_task_id)) # to_task_id is None only in a dry run
+            entry = moves.setdefault((row['task_id'], to_project_id, to_task_id), [0, 0.0])
+            entry[0] += 1
+            if row['end_ms'] is not None:
+                entry[1] += (row['end_ms'] - row['start_ms']) / 1000
+        if changes and not dry_run:
+            moved += db.reassign_activities(changes)
+        checked += len(rows)
+        changed += len(changes)
+        if progress:
+            progress(checked, total)
+
+    return {
+        "checked": checked,
+        "changed": changed,
+        "moved": moved,
+        "skipped": 0 if dry_run else changed - moved,
+        "moves": [
+            {"from_task_id": from_task_id, "to_project_id": to_project_id, "to_task_id": to_task_id,
+             "activities": count, "seconds": round(seconds, 3)}
+            for (from_task_id, to_project_id, to_task_id), (count, seconds) in sorted(moves.items(), key=lambda item: -item[1][1])
+        ],
+    }
+
+def _chunks(start_ms, end_ms, chunk_size):
+    """Yields lists of activity rows in (start_ms, id) order, each read by a query of its own."""
+    after = (-1, -1)
+    while True:
+        with db.connection() as conn, db.QUERY_SECONDS.time("reclassify_chunk"):
+            rows = []
+            for source, window_start, window_end in db.activity_windows(conn, start_ms, end_ms):
+                window = db.window_condition("a.start_ms", window_start, window_end)
+                rows += conn.execute(
+                    CHUNK_QUERY.format(source=source, window=window),
+                    {"after_ms": after[0], "after_id": after[1], "limit": chunk_size - len(rows)}
+                ).fetchall()
+                if len(rows) == chunk_size:
+                    break
+        if not rows:
+            return
+        yield rows
+        after = (rows[-1]['start_ms'], rows[-1]['id'])
+
+def _match_titles(engine, targets, title_ids):
+    """Records in targets the (project_id, task_id) of the rule matching each of these titles (None if none does)."""
+    title_ids = [title_id for title_id in title_ids if title_id is not None]
+    if not title_ids:
+        return
+    with db.connection() as conn:
+        titles = conn.execute(f"SELECT id, value FROM strings WHERE id IN ({','.join('?' * len(title_ids))})", title_ids).fetchall()
+    for title_id, title in titles:
+        rule = engine.match(title)
+        targets[title_id] = (rule['project_id'], rule['task_id']) if rule is not None else None
+
+def _default_task(project_id, create):
+    """The project's DEFAULT_TASK_NAME task, as the tracker picks it. Without create, None if there is none yet."""
+    if create:
+        return db.get_or_create_task(project_id, DEFAULT_TASK_NAME)
+    for task in db.get_tasks():
+        if task['project_id'] == project_id and task['name'] == DEFAULT_TASK_NAME:
+            return task['id']
+    return None
+
+def _task_label(task_id, project_id=None):
+    if task_id is None:
+        return f"{db.get_project_name_by_id(project_id)} / {DEFAULT_TASK_NAME} (new)"
+    task = db.get_task(task_id)
+    if task is None:
+        return f"task {task_id}"
+    return f"{db.get_project_name_by_id(task['project_id'])} / {task['name']}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-apply the current rules to recorded activities.")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day, YYYY-MM-DD (default: the first activity)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day, inclusive (default: the last activity)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Activities per transaction")
+    args = parser.parse_args()
+
+    def show_progress(checked, total):
+        print(f"\r{checked}/{total} activities checked", end="", file=sys.stderr, flush=True)
+
+    db.create_tables()
+    report = reclassify(args.start, args.end, args.dry_run, args.chunk_size, show_progress)
+    print(file=sys.stderr)
+    for move in report['moves']:
+        print(f"{_task_label(move['from_task_id'])}  ->  {_task_label(move['to_task_id'], move['to_project_id'])}: "
+              f"{move['activities']} activities, {move['seconds'] / 3600:.2f} h")
+    if args.dry_run:
+        print(f"Dry run: {report['changed']} of {report['checked']} activities would be moved.")
+    else:
+        print(f"Moved {report['moved']} of {report['checked']} activities.")
+        if report['skipped']:
+            print(f"{report['skipped']} activities were left alone: they are archived or changed while the job ran.")
+
+if __name__ == "__main__":
+    main()
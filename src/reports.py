@@ -0,0 +1,198 @@
+"""
+Summary reports over long date ranges, computed in a process pool as background jobs.
+
+A report is split into calendar months, the same partitions archive.py
+uses. Each month is summarized by summaries.summarize() in a worker process
+with its own read-only connection, so a yearly report uses several cores
+and never holds the GIL or a connection the web server needs. The monthly
+parts are merged per project and task in month order, which keeps projects
+and tasks in the order they first appear, as in a single summarize() call.
+
+The web server runs reports as jobs (POST /api/reports/jobs) that clients
+poll. Jobs are kept in memory; the MAX_FINISHED_JOBS most recent finished
+ones can still be fetched.
+"""
+import asyncio
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+
+try:
+    from . import database as db
+    from . import metrics
+    from . import summaries
+except ImportError:  # Run as a script from src/
+    import database as db
+    import metrics
+    import summaries
+
+logger = logging.getLogger(__name__)
+
+REPORT_WORKERS = min(4, os.cpu_count() or 1) # worker processes
+MAX_FINISHED_JOBS = 100 # finished jobs kept for polling
+MAX_REPORT_DAYS = 366 * 10
+
+REPORT_JOBS = metrics.counter("timetracker_report_jobs_total", "Report jobs finished, by result.", ("result",))
+REPORT_JOB_SECONDS = metrics.histogram("timetracker_report_job_seconds", "Time from starting a report job to its result.")
+
+
+def month_chunks(start_date, end_date):
+    """Splits start_date..end_date (inclusive) into (first, last) day pairs, one per calendar month."""
+    chunks = []
+    first = start_date
+    while first <= end_date:
+        next_month = date(first.year + 1, 1, 1) if first.month == 12 else date(first.year, first.month + 1, 1)
+        last = min(end_date, next_month - timedelta(days=1))
+        chunks.append((first, last))
+        first = next_month
+    return chunks
+
+def merge(parts):
+    """Merges summarize() results, in period order, into one summary of the same shape."""
+    summary = {}
+    for part in parts:
+        for project_name, project_info in part.items():
+            project = summary.setdefault(project_name, {'total_duration': 0, 'tasks': {}})
+            project['total_duration'] = round(project['total_duration'] + project_info['total_duration'], 3)
+            for task_name, duration in project_info['tasks'].items():
+                project['tasks'][task_name] = round(project['tasks'].get(task_name, 0) + duration, 3)
+    return summary
+
+def summary_csv(summary, title):
+    """A summary as CSV: one row per project with its hours, followed by one row per task."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([f"Project ({title})", "Task", "Hours"])
+    for project_name, project_info in summary.items():
+        writer.writerow([project_name, "", f"{project_info['total_duration'] / 3600:.2f}"])
+        for task_name, task_duration in project_info['tasks'].items():
+            writer.writerow(["", task_name, f"{task_duration / 3600:.2f}"])
+    return output.getvalue()
+
+def _init_worker(db_file):
+    """Runs once in each worker process: the same database, read-only."""
+    db.DB_FILE = db_file
+    db.use_readonly_connections()
+
+def _summarize_chunk(start_date, end_date, now, device, user):
+    return summaries.summarize(start_date, end_date, now=now, device=device, user=user)
+
+
+class ReportJobs:
+    """
+    Runs report jobs on a pool of worker processes and keeps their state for polling.
+
+    start() validates a request and returns the new job's state at once; the
+    job itself runs as a task on the event loop, which only waits on the
+    workers. get() returns a job's state, with the result once it is done.
+    """
+
+    def __init__(self, workers=REPORT_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._jobs = {} # id -> job dict, oldest first
+        self._tasks = {}
+
+    def start(self, start_date, end_date, device=None, user=None):
+        """Queues a summary report for start_date..end_date inclusive. Raises ValueError for an invalid range."""
+        if end_date < start_date:
+            raise ValueError("end_date must not be before start_date.")
+        if (end_date - start_date).days >= MAX_REPORT_DAYS:
+            raise ValueError(f"A report covers at most {MAX_REPORT_DAYS} days.")
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "start_date": start_date.isoformat(),
+            "end_date": end_date.isoformat(),
+            "device": device,
+            "user": user,
+            "chunks": len(month_chunks(start_date, end_date)),
+            "chunks_done": 0,
+            "created": datetime.now().isoformat(timespec="milliseconds"),
+            "finished": None,
+            "error": None,
+            "result": None,
+        }
+        self._jobs[job["id"]] = job
+        self._tasks[job["id"]] = asyncio.get_running_loop().create_task(self._run(job, start_date, end_date))
+        self._forget_finished()
+        return self._state(job)
+
+    def get(self, job_id):
+        """The job's state including its result (None until it is done), or None if there is no such job."""
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def wait(self, job_id, timeout):
+        """Waits up to timeout seconds for the job to finish."""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.wait({task}, timeout=timeout)
+
+    def close(self):
+        """Cancels running jobs and shuts the worker processes down."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def _run(self, job, start_date, end_date):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        now = datetime.now() # One moment for every part, so an open activity is clipped alike
+        job["status"] = "running"
+        futures = []
+
+        def chunk_done(future):
+            if not future.cancelled() and future.exception() is None:
+                job["chunks_done"] += 1
+
+        try:
+            for first, last in month_chunks(start_date, end_date):
+                future = loop.run_in_executor(self._get_executor(), _summarize_chunk, first, last, now, job["device"], job["user"])
+                future.add_done_callback(chunk_done)
+                futures.append(future)
+            job["result"] = merge(await asyncio.gather(*futures))
+            job["status"] = "done"
+        except asyncio.CancelledError:
+            job["status"], job["error"] = "failed", "Cancelled."
+            raise
+        except Exception as e:
+            logger.exception("Report job %s failed", job["id"])
+            job["status"], job["error"] = "failed", str(e) or type(e).__name__
+            if isinstance(e, BrokenProcessPool):
+                self._executor = None # A worker died; the next job starts a fresh pool
+        finally:
+            for future in futures:
+                future.cancel() # Parts of a failed job that haven't started yet
+            job["finished"] = datetime.now().isoformat(timespec="milliseconds")
+            self._tasks.pop(job["id"], None)
+            REPORT_JOBS.inc(job["status"])
+            REPORT_JOB_SECONDS.observe(time.perf_counter() - started)
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn, not fork: the server process has threads and open SQLite connections
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker, initargs=(os.path.abspath(db.DB_FILE),)
+            )
+        return self._executor
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _state(job):
+        return {key: value for key, value in job.items() if key != "result"}
@@ -0,0 +1,94 @@
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/ (python src/tracker.py)
+    import database as db
+
+_NO_MATCH = float("inf")
+DEFAULT_TASK_NAME = "General" # Task that a rule for a whole project assigns, unless the time is already on a task of that project
+
+
+class RuleEngine:
+    """
+    Matches window titles against every rule in a single pass.
+
+    All rule patterns are compiled into one Aho-Corasick automaton, together
+    with the project/task names from get_rules(), so a match costs one scan of
+    the title and no database access. The automaton is rebuilt from
+    get_rules() only when db.rules_version() reports that the rules table
+    changed since the last compile(), including one given explicit rules.
+    That counter only moves when this process adds a rule. Rules written
+    by another process (a second tracker, a script, direct SQL) reach a
+    running tracker only after it restarts.
+
+    Matching is case-insensitive substring matching, and when several patterns
+    occur in a title the rule that comes first in get_rules() wins, exactly like
+    the linear loop this replaces.
+    """
+
+    def __init__(self, rules=None):
+        self._version = None
+        self._rules = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [_NO_MATCH]
+        if rules is not None:
+            self.compile(rules)
+
+    def refresh(self):
+        """Recompiles the automaton if the rules table changed since the last build."""
+        version = db.rules_version()
+        if version != self._version:
+            self.compile(db.get_rules())
+            self._version = version # As read before get_rules(), so a change made meanwhile triggers another build
+
+    def compile(self, rules):
+        """Builds the automaton from rule rows, in priority order. refresh() keeps them until the rules table changes."""
+        self._version = db.rules_version()
+        self._rules = [dict(rule) for rule in rules]
+        goto, fail, best = [{}], [0], [_NO_MATCH]
+
+        # Trie of lowercased patterns; each node keeps the best (lowest) rule index ending there
+        for index, rule in enumerate(self._rules):
+            node = 0
+            for char in rule['pattern'].lower():
+                nxt = goto[node].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][char] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    best.append(_NO_MATCH)
+                node = nxt
+            best[node] = min(best[node], index)
+
+        # Breadth-first failure links; a node also inherits the matches of its failure node
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                best[child] = min(best[child], best[fail[child]])
+
+        self._goto, self._fail, self._best = goto, fail, best
+
+    def match(self, window_title):
+        """Returns the highest-priority rule whose pattern occurs in window_title, or None."""
+        self.refresh()
+        goto, fail, best = self._goto, self._fail, self._best
+        found = best[0]  # Empty patterns match every title
+        state = 0
+        for char in window_title.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if best[state] < found:
+                found = best[state]
+                if found == 0:
+                    break
+        return self._rules[found] if found != _NO_MATCH else None
+
+    def __len__(self):
+        return len(self._rules)
@@ -0,0 +1,174 @@
+"""
+Full-text search over window titles and app names.
+
+Both are stored once each in the strings table, and strings_fts indexes them
+with FTS5's trigram tokenizer (schema v8), kept in sync by triggers. The
+index finds any case-insensitive substring of three or more characters,
+which is also how rules match window titles. A search looks up the matching
+strings first, ranked by bm25, and then the activities that use them through
+the (title_id, start_ms) and (app_id, start_ms) indexes, so its cost follows
+the size of the page rather than the size of the activities table.
+"""
+import heapq
+
+try:
+    from . import database as db
+    from . import activities
+except ImportError:  # Run as a script from src/
+    import database as db
+    import activities
+
+MIN_TERM_LENGTH = 3 # the trigram index can't look up anything shorter
+RESULT_FIELDS = ("id", "task_id", "project_id", "project_name", "task_name", "app_name", "window_title", "start_time", "end_time")
+# Below this many activities in the date range, scanning the range beats looking up every matched string
+RANGE_SCAN_LIMIT = 20000
+
+MATCH_QUERY = "SELECT rowid, bm25(strings_fts) AS score FROM strings_fts WHERE strings_fts MATCH ? ORDER BY score, rowid"
+
+# {source} and {window} come from db.activity_windows(); {column} is title_id or app_id
+ACTIVITY_QUERY = """
+    SELECT {columns}, a.start_ms AS _start_ms
+    FROM {source} a
+    JOIN tasks t ON t.id = a.task_id
+    JOIN projects p ON p.id = t.project_id
+    JOIN strings app ON app.id = a.app_id
+    LEFT JOIN strings title ON title.id = a.title_id
+    WHERE a.{column} = :string_id AND {window} {filters}
+    ORDER BY a.start_ms DESC, a.id DESC
+"""
+
+# The same for every activity in a short date range that uses any matched string
+RANGE_QUERY = """
+    SELECT {columns}, a.start_ms AS _start_ms, a.title_id AS _title_id, a.app_id AS _app_id
+    FROM {source} a
+    JOIN tasks t ON t.id = a.task_id
+    JOIN projects p ON p.id = t.project_id
+    JOIN strings app ON app.id = a.app_id
+    LEFT JOIN strings title ON title.id = a.title_id
+    WHERE {window} {filters}
+        AND (a.title_id IN (SELECT rowid FROM strings_fts WHERE strings_fts MATCH :query)
+             OR a.app_id IN (SELECT rowid FROM strings_fts WHERE strings_fts MATCH :query))
+"""
+
+def match_expression(text):
+    """
+    Turns search text into an FTS5 query in which every word of at least
+    MIN_TERM_LENGTH characters must occur. Raises ValueError if there is none.
+    """
+    terms = [term for term in text.split() if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        raise ValueError(f"Search for at least one word of {MIN_TERM_LENGTH} or more characters.")
+    return " ".join(_phrase(term) for term in terms)
+
+def search(text, start_date=None, end_date=None, project_id=None, limit=50, offset=0):
+    """
+    Activities whose window title or app name contains every word of text, best match first.
+
+    Returns {'results': [...], 'next_offset': ...}. Each result has the
+    RESULT_FIELDS plus score (bm25 of its best-matching string, higher is
+    better). Activities sharing a string are newest first. next_offset is
+    None on the last page.
+    """
+    columns = ", ".join(f"{activities.FIELDS[name]} AS {name}" for name in RESULT_FIELDS)
+    params = {}
+    filters = ""
+    if project_id is not None:
+        filters = "AND t.project_id = :project_id"
+        params["project_id"] = project_id
+    start_ms, end_ms = activities.query_range(start_date=start_date, end_date=end_date)
+
+    results, seen = [], set()
+    with db.connection() as conn, db.QUERY_SECONDS.time("search"):
+        params["query"] = match_expression(text)
+        scores = dict(conn.execute(MATCH_QUERY, (params["query"],)).fetchall())
+        if start_ms is not None and end_ms is not None and _range_size(conn, start_ms, end_ms) < RANGE_SCAN_LIMIT:
+            hits = _hits_in_range(conn, scores, start_ms, end_ms, columns, filters, params)
+        else:
+            hits = _hits(conn, scores, start_ms, end_ms, columns, filters, params)
+        try:
+            for score, row in hits:
+                # An activity whose title and app both match was already returned under the better string
+                if row["id"] in seen:
+                    continue
+                seen.add(row["id"])
+                if len(seen) > offset:
+                    results.append(dict({name: row[name] for name in RESULT_FIELDS}, score=round(-score, 4)))
+                if len(results) > limit:
+                    break
+        finally:
+            hits.close()
+    return {"results": results[:limit], "next_offset": offset + limit if len(results) > limit else None}
+
+def _hits(conn, scores, start_ms, end_ms, columns, filters, params):
+    """
+    Yields (score, row) for the activities using each matched string, best
+    string first. Within a string, rows come newest first straight from the
+    (title_id, start_ms) and (app_id, start_ms) indexes, so a page only reads
+    the rows it returns.
+    """
+    for string_id, score in scores.items():
+        for source, window_start, window_end in db.activity_windows(conn, start_ms, end_ms, descending=True):
+            window = db.window_condition("a.start_ms", window_start, window_end)
+            cursors = [
+                conn.execute(
+                    ACTIVITY_QUERY.format(columns=columns, source=source, column=column, window=window, filters=filters),
+                    dict(params, string_id=string_id)
+                )
+                for column in ("title_id", "app_id")
+            ]
+            try:
+                for row in heapq.merge(*cursors, key=lambda row: (-row["_start_ms"], -row["id"])):
+                    yield score, row
+            finally:
+                for cursor in cursors:
+                    cursor.close()
+
+def _hits_in_range(conn, scores, start_ms, end_ms, columns, filters, params):
+    """Yields the same as _hits() for a short date range, from one pass over the range."""
+    hits = []
+    for source, window_start, window_end in db.activity_windows(conn, start_ms, end_ms):
+        window = db.window_condition("a.start_ms", window_start, window_end)
+        for row in conn.execute(RANGE_QUERY.format(columns=columns, source=source, window=window, filters=filters), params):
+            score = min(scores.get(row["_title_id"], 0), scores.get(row["_app_id"], 0))
+            # The best string first, as _hits() orders them
+            string_id = row["_title_id"] if score == scores.get(row["_title_id"]) else row["_app_id"]
+            hits.append((score, string_id, -row["_start_ms"], -row["id"], row))
+    hits.sort(key=lambda hit: hit[:4])
+    for score, *_, row in hits:
+        yield score, row
+
+def _range_size(conn, start_ms, end_ms):
+    """Activities in [start_ms, end_ms), counted up to RANGE_SCAN_LIMIT."""
+    size = 0
+    for source, window_start, window_end in db.activity_windows(conn, start_ms, end_ms):
+        window = db.window_condition("start_ms", window_start, window_end)
+        size += conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {source} WHERE {window} LIMIT {RANGE_SCAN_LIMIT})").fetchone()[0]
+    return size
+
+def title_matches(pattern, examples=5):
+    """
+    Previews a rule pattern: returns (count, titles), where count is the
+    number of recorded activities whose window title contains pattern (as
+    RuleEngine matches it, ignoring case) and titles are up to `examples` of
+    those titles, most used first. Archived months are included.
+    """
+    if len(pattern) >= MIN_TERM_LENGTH:
+        matched, params = "SELECT rowid FROM strings_fts WHERE strings_fts MATCH :pattern", {"pattern": _phrase(pattern)}
+    else:
+        # Too short for the index; the strings table holds each title once, so scanning it is still cheap
+        matched, params = "SELECT id FROM strings WHERE instr(lower(value), :pattern) > 0", {"pattern": pattern.lower()}
+
+    counts = {}
+    with db.connection() as conn, db.QUERY_SECONDS.time("title_matches"):
+        for source, window_start, window_end in db.activity_windows(conn):
+            window = db.window_condition("start_ms", window_start, window_end)
+            cursor = conn.execute(f"SELECT title_id, COUNT(*) FROM {source} WHERE title_id IN ({matched}) AND {window} GROUP BY title_id", params)
+            for title_id, count in cursor:
+                counts[title_id] = counts.get(title_id, 0) + count
+        top = sorted(counts, key=counts.get, reverse=True)[:examples]
+        names = dict(conn.execute(f"SELECT id, value FROM strings WHERE id IN ({','.join('?' * len(top))})", top).fetchall()) if top else {}
+    return sum(counts.values()), [names[title_id] for title_id in top]
+
+def _phrase(text):
+    """text as an FTS5 string, which the trigram tokenizer matches as a substring."""
+    return '"' + text.replace('"', '""') + '"'
@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/
+    import database as db
+
+SUMMARY_TYPES = ("daily", "weekly", "monthly")
+
+# Closed activities come from daily_rollups (at most one row per day, device and task);
+# open activities (no end_ms yet) are read raw and clipped to the range and :now.
+# {rollup_devices} and {activity_devices} restrict both to the requested devices.
+# Python only nests the grouped rows.
+SUMMARY_QUERY = """
+    SELECT project_name, task_name, SUM(duration) AS duration, MIN(first_seen) AS first_seen
+    FROM (
+        SELECT
+            p.name AS project_name,
+            t.name AS task_name,
+            r.seconds AS duration,
+            r.first_start_ms AS first_seen
+        FROM daily_rollups r
+        JOIN tasks t ON r.task_id = t.id
+        JOIN projects p ON r.project_id = p.id
+        WHERE r.day >= :start_day AND r.day <= :end_day AND {rollup_devices}
+
+        UNION ALL
+
+        SELECT
+            p.name AS project_name,
+            t.name AS task_name,
+            (MIN(:now, :end) - MAX(a.start_ms, :start)) / 1000.0 AS duration,
+            MAX(a.start_ms, :start) AS first_seen
+        FROM activities a
+        JOIN tasks t ON a.task_id = t.id
+        JOIN projects p ON t.project_id = p.id
+        WHERE a.end_ms IS NULL AND a.start_ms < MIN(:now, :end) AND :now > :start AND {activity_devices}
+    )
+    GROUP BY project_name, task_name
+    ORDER BY first_seen ASC
+"""
+
+def period_bounds(summary_type, selected_date):
+    """Returns the first and last day covered by a daily, weekly or monthly summary."""
+    if summary_type == "daily":
+        return selected_date, selected_date
+    elif summary_type == "weekly":
+        # Monday to Sunday
+        start_of_week = selected_date - timedelta(days=selected_date.weekday())
+        return start_of_week, start_of_week + timedelta(days=6)
+    elif summary_type == "monthly":
+        start_of_month = selected_date.replace(day=1)
+        if selected_date.month == 12:
+            next_month = start_of_month.replace(year=selected_date.year + 1, month=1)
+        else:
+            next_month = start_of_month.replace(month=selected_date.month + 1)
+        return start_of_month, next_month - timedelta(days=1)
+    raise ValueError(f"Invalid summary_type {summary_type!r}. Must be one of {', '.join(SUMMARY_TYPES)}.")
+
+def summarize(start_date, end_date, now=None, device=None, user=None):
+    """
+    Returns time spent per project and task between start_date and end_date inclusive.
+
+    Activities that cross midnight count towards each day they span. device
+    (a device name) and user restrict the summary to activities uploaded from
+    those devices; by default every device counts.
+
+    The result maps project name to {'total_duration': seconds, 'tasks': {task name: seconds}},
+    with projects and tasks in the order they first appear.
+    """
+    start, end = db.day_bounds(start_date, end_date)
+    params = {
+        "start": start,
+        "end": end,
+        "start_day": start_date.isoformat(),
+        "end_day": end_date.isoformat(),
+        "now": db.to_epoch_ms(now or datetime.now()),
+    }
+    rollup_devices, device_params = db.device_filter("r.device_id", device, user)
+    # Unary + keeps SQLite on the small idx_activities_open rather than every activity of the device
+    activity_devices, _ = db.device_filter("+a.device_id", device, user)
+    query = SUMMARY_QUERY.format(rollup_devices=rollup_devices, activity_devices=activity_devices)
+    with db.connection() as conn, db.QUERY_SECONDS.time("summary"):
+        rows = conn.execute(query, dict(params, **device_params)).fetchall()
+
+    summary = {}
+    for row in rows:
+        duration = round(row['duration'], 3)
+        project = summary.setdefault(row['project_name'], {'total_duration': 0, 'tasks': {}})
+        project['total_duration'] += duration
+        project['tasks'][row['task_name']] = duration
+    return summary
+
+def summarize_period(summary_type, selected_date, device=None, user=None):
+    """Summary for the daily, weekly or monthly period containing selected_date."""
+    return summarize(*period_bounds(summary_type, selected_date), device=device, user=user)
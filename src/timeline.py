@@ -0,0 +1,173 @@
+"""
+Downsampled timelines: activity segments reduced to what a chart can draw.
+
+A busy day holds thousands of window switches lasting a few seconds each.
+At a given resolution (one bucket = the time one pixel covers) they are
+reduced in a single pass over the rows, in start order:
+
+1. Consecutive activities on the same task with a gap shorter than a bucket
+   are merged into one run.
+2. Runs at least one bucket long become segments as they are.
+3. Shorter runs are collected into fixed buckets. Each bucket becomes one
+   segment attributed to the task that has the most time in it.
+4. Adjacent segments that ended up with the same task are merged again.
+
+Each segment reports the time actually tracked in it (duration_seconds),
+so summing segments never overcounts idle gaps that were bridged.
+"""
+from collections import Counter
+from datetime import datetime
+
+try:
+    from . import database as db
+except ImportError:  # Run as a script from src/
+    import database as db
+
+DEFAULT_PIXELS = 1440 # one bucket per minute over a single day
+MIN_BUCKET_SECONDS = 1
+FETCH_SIZE = 1000 # rows pulled from the cursor at a time
+
+# {source} and {window} come from db.activity_windows(), for ranges that reach into archived months
+TIMELINE_QUERY = """
+    SELECT task_id, app_id, start_ms, MIN(COALESCE(end_ms, :now), :range_end) AS end_ms, tz_offset
+    FROM {source}
+    WHERE start_ms >= :range_start AND start_ms < :range_end AND {window}
+    ORDER BY start_ms, id
+"""
+
+def bucket_ms(start_date, end_date, pixels=None, bucket_seconds=None):
+    """Bucket width in ms: bucket_seconds if given, otherwise the range split into `pixels` buckets."""
+    if bucket_seconds is None:
+        start, end = db.day_bounds(start_date, end_date)
+        bucket_seconds = (end - start) / 1000 / (pixels or DEFAULT_PIXELS)
+    return max(int(bucket_seconds * 1000), MIN_BUCKET_SECONDS * 1000)
+
+class _Run:
+    """Consecutive time on one task (or, for a bucket, several tasks) being accumulated."""
+
+    __slots__ = ("start", "end", "tz_offset", "tasks", "apps", "count")
+
+    def __init__(self, start, end, tz_offset):
+        self.start = start
+        self.end = end
+        self.tz_offset = tz_offset
+        self.tasks = Counter() # task_id -> tracked ms
+        self.apps = Counter() # app_id -> tracked ms
+        self.count = 0
+
+    def add(self, task_id, app_id, start, end):
+        self.end = max(self.end, end)
+        self.tasks[task_id] += end - start
+        self.apps[app_id] += end - start
+        self.count += 1
+
+    def absorb(self, other):
+        self.end = max(self.end, other.end)
+        self.tasks.update(other.tasks)
+        self.apps.update(other.apps)
+        self.count += other.count
+
+    def task_id(self):
+        return self.tasks.most_common(1)[0][0]
+
+def _runs(rows, gap_ms):
+    """Merges consecutive same-task rows separated by less than gap_ms into runs."""
+    run, run_task = None, None
+    for task_id, app_id, start, end, tz_offset in rows:
+        if end <= start:
+            continue
+        if run is not None and task_id == run_task and start - run.end < gap_ms:
+            run.add(task_id, app_id, start, end)
+            continue
+        if run is not None:
+            yield run
+        run, run_task = _Run(start, end, tz_offset), task_id
+        run.add(task_id, app_id, start, end)
+    if run is not None:
+        yield run
+
+def downsample(rows, range_start, bucket):
+    """
+    Reduces (task_id, app_id, start_ms, end_ms, tz_offset) rows, in start
+    order, to a list of _Run segments no shorter than `bucket` ms except at
+    the edges of the data.
+    """
+    segments = []
+    open_bucket, open_index = None, None
+    for run in _runs(rows, bucket):
+        if run.end - run.start >= bucket:
+            segments.append(run)
+            continue
+        index = (run.start - range_start) // bucket
+        if index != open_index:
+            if open_bucket is not None:
+                segments.append(open_bucket)
+            open_bucket, open_index = _Run(run.start, run.end, run.tz_offset), index
+        open_bucket.absorb(run)
+    if open_bucket is not None:
+        segments.append(open_bucket)
+
+    # A long run and the bucket before it were appended out of order
+    segments.sort(key=lambda segment: segment.start)
+    merged = []
+    for segment in segments:
+        previous = merged[-1] if merged else None
+        if previous and previous.task_id() == segment.task_id() and segment.start - previous.end < bucket:
+            previous.absorb(segment)
+        else:
+            merged.append(segment)
+    return merged
+
+def _iso(ms, tz_offset):
+    return db.from_epoch_ms(ms, tz_offset).isoformat(timespec="milliseconds")
+
+def load_timeline(start_date, end_date=None, pixels=None, bucket_seconds=None, now=None):
+    """
+    Returns the downsampled timeline from start_date through end_date inclusive.
+
+    The result is {'bucket_seconds': ..., 'activity_count': ..., 'segments': [...]}.
+    Each segment carries the same task_id, app_name, start_time and end_time
+    keys as a raw activity, so the page can draw either. It also carries
+    duration_seconds (tracked time), activity_count and, if other tasks were
+    folded into it, mixed = True. app_name is the app used most in the segment.
+    """
+    end_date = end_date or start_date
+    bucket = bucket_ms(start_date, end_date, pixels, bucket_seconds)
+    range_start, range_end = db.day_bounds(start_date, end_date)
+    params = {"range_start": range_start, "range_end": range_end, "now": db.to_epoch_ms(now or datetime.now())}
+
+    with db.connection() as conn, db.QUERY_SECONDS.time("timeline"):
+        segments = downsample(_rows(conn, range_start, range_end, params), range_start, bucket)
+        app_ids = {segment.apps.most_common(1)[0][0] for segment in segments}
+        placeholders = ",".join("?" * len(app_ids))
+        app_names = dict(conn.execute(f"SELECT id, value FROM strings WHERE id IN ({placeholders})", list(app_ids)).fetchall()) if app_ids else {}
+
+    return {
+        "bucket_seconds": bucket / 1000,
+        "activity_count": sum(segment.count for segment in segments),
+        "segments": [
+            {
+                "task_id": segment.task_id(),
+                "app_name": app_names.get(segment.apps.most_common(1)[0][0]),
+                "start_time": _iso(segment.start, segment.tz_offset),
+                "end_time": _iso(segment.end, segment.tz_offset),
+                "duration_seconds": round(sum(segment.tasks.values()) / 1000, 3),
+                "activity_count": segment.count,
+                "mixed": len(segment.tasks) > 1,
+            }
+            for segment in segments
+        ],
+    }
+
+def _rows(conn, range_start, range_end, params):
+    """Timeline rows in start order, window by window."""
+    for source, window_start, window_end in db.activity_windows(conn, range_start, range_end):
+        cursor = conn.execute(TIMELINE_QUERY.format(source=source, window=db.window_condition("start_ms", window_start, window_end)), params)
+        try:
+            while True:
+                rows = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                yield from (tuple(row) for row in rows)
+        finally:
+            cursor.close()
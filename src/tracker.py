@@ -1,31 +1,40 @@
-import time
-import pygetwindow as gw
-from pynput import mouse, keyboard
-from datetime import datetime
-import threading
+import asyncio
+import logging
 import os
+import signal
 import database as db
+import metrics
+from console import ConsoleInput
+from engine import TrackerEngine
+from journal import ActivityJournal
+from outbox import Outbox
+from rules import RuleEngine
+from search import title_matches
+from window_source import PollingWindowSource
+from input_monitor import InputMonitor
 
 # --- Configuration ---
 TEST_MODE = False # Temporary flag for automated testing
 AFK_TIMEOUT = 60  # seconds
-TICK_INTERVAL = 5  # seconds
+TICK_INTERVAL = 5  # seconds, longest wait between window samples and AFK checks
+WINDOW_POLL_MIN_INTERVAL = 0.5 # seconds, polling interval right after a window switch
 CHECKIN_INTERVAL = 1800 # seconds (30 minutes)
+INPUT_DEBOUNCE = 1.0 # seconds, input events closer together than this store one timestamp
+SYNC_URL = os.environ.get("TIMETRACKER_SYNC_URL") # e.g. http://server:8000; activities are also uploaded there when set
+SYNC_TOKEN = os.environ.get("TIMETRACKER_SYNC_TOKEN") # Sent as a bearer token if the server requires one
+METRICS_FILE = os.path.join(os.path.dirname(db.DB_FILE), "timetracker.metrics") # Written on SIGUSR1 and when tracking stops
 
 # --- Global State ---
-last_input_time = time.time()
-last_checkin_time = time.time()
-is_afk = False
-prompt_needed = threading.Event()
-tracking_active = threading.Event() # Use an Event for cleaner signaling
-menu_prompt_requested = threading.Event() # New: Event to signal menu prompt
-
-current_project_id = None
-current_task_id = None
-current_activity = None
+console = ConsoleInput() # Owns stdin, so a prompt abandoned by Ctrl+C can't read the menu's input
+engine = None # The running TrackerEngine, created by start_tracking()
+rule_engine = RuleEngine() # Compiled rules, rebuilt only when add_rule() changes them
+input_monitor = None # Debounced keyboard/mouse activity, created by start_listeners()
+window_source = None # Where active windows come from; each start_tracking() polls pygetwindow unless one is set
 test_project_call_count = 0 # For TEST_MODE
 test_task_call_count = 0 # For TEST_MODE
 
+logger = logging.getLogger("tracker")
+
 # --- User Interaction ---
 def prompt_for_project():
     """Lists projects and asks the user to select or create one."""
@@ -45,14 +54,14 @@ def prompt_for_project():
         
         if not projects:
             print("No projects found. Please type a new project name:")
-            choice = input("> ")
+            choice = console.input("> ")
             return db.get_or_create_project(choice)
         else:
             for i, project in enumerate(projects):
                 print(f"{i + 1}. {project['name']}")
             
             print("\nEnter project number to select, or type a new project name:")
-            choice = input("> ")
+            choice = console.input("> ")
             
             try:
                 choice_num = int(choice)
@@ -86,7 +95,7 @@ def prompt_for_task(project_id):
                 print(f"{i + 1}. {task['name']}")
         
         print("\nEnter task number to select, or type a new task name:")
-        choice = input("> ")
+        choice = console.input("> ")
 
         try:
             choice_num = int(choice)
@@ -97,9 +106,12 @@ def prompt_for_task(project_id):
         except ValueError:
             return db.create_task(project_id, choice)
 
-def handle_user_prompt(reason):
-    """Guides the user through selecting their current work."""
-    global current_project_id, current_task_id, current_activity
+def handle_user_prompt(reason, current_project_id, current_task_id):
+    """
+    Guides the user through selecting their current work and returns the
+    chosen (project_id, task_id). Runs in its own thread while the engine
+    keeps tracking; the engine applies the switch.
+    """
     print(f"\n🔔 {reason} Let's log your work.")
 
     new_project_id = current_project_id
@@ -113,7 +125,7 @@ def handle_user_prompt(reason):
             print("1. Continue with current project/task")
             print("2. Change Project")
             print("3. Change Task")
-            choice = input("> ")
+            choice = console.input("> ")
 
             if choice == '1':
                 break
@@ -131,25 +143,10 @@ def handle_user_prompt(reason):
             new_task_id = prompt_for_task(new_project_id)
             break
 
-    # Log current activity and end previous task if project or task has changed
-    if (new_task_id != current_task_id or new_project_id != current_project_id):
-        if current_activity:
-            db.add_activity(
-                current_task_id,
-                current_activity['app_name'],
-                current_activity['window_title'],
-                current_activity['start_time'],
-                datetime.now()
-            )
-            current_activity = None # Reset activity
-        if current_task_id and current_task_id != new_task_id:
-            db.end_task(current_task_id)
-
-    current_project_id = new_project_id
-    current_task_id = new_task_id
-    project_name = db.get_project_name_by_id(current_project_id)
-    task_name = db.get_task_name_by_id(current_task_id)
+    project_name = db.get_project_name_by_id(new_project_id)
+    task_name = db.get_task_name_by_id(new_task_id)
     print(f"✅ Great! Now tracking for Project: {project_name}, Task: {task_name}.")
+    return new_project_id, new_task_id
 
 # --- Rule Management ---
 def manage_rules():
@@ -159,7 +156,7 @@ def manage_rules():
         print("1. View existing rules")
         print("2. Add a new rule")
         print("3. Back to main menu")
-        choice = input("> ")
+        choice = console.input("> ")
 
         if choice == '1':
             rules = db.get_rules()
@@ -170,13 +167,21 @@ def manage_rules():
                     task_info = f", Task: {rule['task_name']}" if rule['task_name'] else ""
                     print(f"ID: {rule['id']}, Pattern: '{rule['pattern']}', Project: {rule['project_name']}{task_info}")
         elif choice == '2':
-            pattern = input("Enter pattern (e.g., 'VS Code'): ")
-            
+            pattern = console.input("Enter pattern (e.g., 'VS Code'): ")
+
+            # Preview the pattern against the recorded history before saving it
+            count, titles = title_matches(pattern)
+            print(f"This pattern matches {count} recorded activities.")
+            for title in titles:
+                print(f"  {title}")
+            if console.input("Create a rule with this pattern? (y/n): ").strip().lower() != 'y':
+                continue
+
             print("Select a project for this rule:")
             projects = db.get_projects()
             for i, project in enumerate(projects):
                 print(f"{i + 1}. {project['name']}")
-            project_choice = input("> ")
+            project_choice = console.input("> ")
             try:
                 project_id = projects[int(project_choice) - 1]['id']
             except (ValueError, IndexError):
@@ -184,7 +189,7 @@ def manage_rules():
                 continue
 
             task_id = None
-            task_choice = input("Assign to a specific task? (Enter task number or leave blank for project only): ")
+            task_choice = console.input("Assign to a specific task? (Enter task number or leave blank for project only): ")
             if task_choice:
                 tasks = db.get_active_tasks_for_project(project_id)
                 for i, task in enumerate(tasks):
@@ -202,150 +207,70 @@ def manage_rules():
             print("Invalid choice.")
 
 # --- Input Monitoring ---
-def on_input_event():
-    """Callback for any mouse/keyboard activity."""
-    global last_input_time, is_afk
-    last_input_time = time.time()
-    if is_afk:
-        print("\nUser is back.")
-        is_afk = False
-        prompt_needed.set() # Signal that a prompt is needed
-
 def on_press_key(key):
-    """Callback for keyboard press events."""
-    on_input_event() # Call the general input event to reset AFK timer
-    try:
-        if key == keyboard.Key.f1:
-            print("\nF1 pressed. Requesting menu prompt...")
-            menu_prompt_requested.set()
-    except AttributeError:
-        # Handle special keys or other non-char keys if necessary
-        pass
+    """Callback for keyboard press events; the monitor has already recorded the input."""
+    if getattr(key, "name", None) == "f1": # Special keys are pynput Key members
+        logger.info("F1 pressed. Requesting menu prompt...")
+        if engine:
+            engine.request_prompt_threadsafe("Menu requested!")
 
 def start_listeners():
-    global mouse_listener, keyboard_listener
-    mouse_listener = mouse.Listener(on_move=lambda x,y: on_input_event(), on_click=lambda x,y,b,p: on_input_event(), on_scroll=lambda x,y,dx,dy: on_input_event())
-    keyboard_listener = keyboard.Listener(on_press=on_press_key)
-    mouse_listener.start()
-    keyboard_listener.start()
-    print("Input listeners started.")
+    global input_monitor
+    if input_monitor:
+        input_monitor.stop() # Don't stack listeners when tracking is restarted from the menu
+    input_monitor = InputMonitor(debounce=INPUT_DEBOUNCE, on_key=on_press_key)
+    input_monitor.start()
+    logger.info("Input listeners started.")
 
 
 # --- Main Tracking Logic ---
 def start_tracking():
-    """The main loop to track window activity and handle prompts."""
-    global is_afk, current_activity, last_checkin_time, current_project_id, current_task_id
-
-    tracking_active.set() # Set the event to start tracking
-
-    # Initial prompt on startup
-    handle_user_prompt("Welcome!")
-    last_checkin_time = time.time()
-
-    while tracking_active.is_set():
-        time.sleep(TICK_INTERVAL)
-
-        if prompt_needed.is_set():
-            handle_user_prompt("Welcome back!")
-            last_checkin_time = time.time()
-            prompt_needed.clear()
-
-        if menu_prompt_requested.is_set():
-            handle_user_prompt("Menu requested!")
-            last_checkin_time = time.time()
-            menu_prompt_requested.clear()
-
-        # AFK Check
-        if not is_afk and (time.time() - last_input_time) > AFK_TIMEOUT:
-            print("\nUser is now AFK.")
-            is_afk = True
-            if current_activity:
-                db.add_activity(
-                    current_task_id,
-                    current_activity['app_name'],
-                    current_activity['window_title'],
-                    current_activity['start_time'],
-                    datetime.now()
-                )
-                current_activity = None
-        
-        if is_afk:
-            continue
-
-        # Periodic Check-in
-        if (time.time() - last_checkin_time) > CHECKIN_INTERVAL:
-            handle_user_prompt("Time for a check-in!")
-            last_checkin_time = time.time()
-
-        # Get active window
-        try:
-            active_window = gw.getActiveWindow()
-            if active_window:
-                app_name = active_window.title()
-                window_title = active_window.title()
-            else:
-                app_name, window_title = "No Active Window", ""
-        except Exception:
-            app_name, window_title = "No Active Window", ""
-
-        # Apply rules for automatic categorization
-        rules = db.get_rules()
-        rule_applied = False
-        for rule in rules:
-            if rule['pattern'].lower() in window_title.lower():
-                if current_project_id != rule['project_id'] or current_task_id != rule['task_id']:
-                    task_info = f", Task: {rule['task_name']}" if rule['task_name'] else ""
-                    print(f"\n✨ Rule matched: '{rule['pattern']}' -> Project: {rule['project_name']}{task_info}.")
-                    current_project_id = rule['project_id']
-                    current_task_id = rule['task_id']
-                    prompt_needed.clear() # No need to prompt if rule applied
-                rule_applied = True
-                break
-        
-        if rule_applied and current_activity:
-            # If a rule was applied and the task changed, end the previous activity
-            if current_activity['app_name'] != app_name or current_activity['window_title'] != window_title:
-                db.add_activity(
-                    current_task_id,
-                    current_activity['app_name'],
-                    current_activity['window_title'],
-                    current_activity['start_time'],
-                    datetime.now()
-                )
-                current_activity = None
-
-        now = datetime.now()
-
-        if current_activity is None:
-            current_activity = {'app_name': app_name, 'window_title': window_title, 'start_time': now}
-        elif current_activity['app_name'] != app_name or current_activity['window_title'] != window_title:
-            db.add_activity(
-                current_task_id,
-                current_activity['app_name'],
-                current_activity['window_title'],
-                current_activity['start_time'],
-                now
-            )
-            current_activity = {'app_name': app_name, 'window_title': window_title, 'start_time': now}
-
-    # Graceful shutdown logic
-    print("\nStopping tracker...")
-    if current_task_id:
-        db.end_task(current_task_id)
-    if current_activity and not is_afk:
-        db.add_activity(
-            current_task_id,
-            current_activity['app_name'],
-            current_activity['window_title'],
-            current_activity['start_time'],
-            datetime.now()
+    """Runs the tracker engine until Ctrl+C, stop_tracking() or the window source runs out."""
+    global engine
+    source = window_source or PollingWindowSource(min_interval=WINDOW_POLL_MIN_INTERVAL, max_interval=TICK_INTERVAL)
+    monitor = input_monitor or InputMonitor(debounce=INPUT_DEBOUNCE) # Not started: headless runs only see AFK timeouts
+    outbox = Outbox(SYNC_URL, token=SYNC_TOKEN) if SYNC_URL else None
+    if outbox:
+        outbox.start()
+    engine = TrackerEngine(
+        window_source=source,
+        input_monitor=monitor,
+        journal=ActivityJournal(outbox=outbox),
+        rule_engine=rule_engine,
+        prompt_handler=console.session(handle_user_prompt),
+        afk_timeout=AFK_TIMEOUT,
+        tick_interval=TICK_INTERVAL,
+        checkin_interval=CHECKIN_INTERVAL,
+    )
+    try:
+        asyncio.run(engine.run())
+    finally:
+        engine = None
+        console.cancel() # A prompt still open gives up instead of reading the menu's input
+        if outbox:
+            outbox.close()
+            batches, activities = outbox.pending()
+            if batches:
+                logger.info("%d activities in %d batches are waiting to be synced.", activities, batches)
+        rates = monitor.stats()
+        logger.info(
+            "Input events/s: %.1f moves, %.2f clicks, %.2f scrolls, %.2f keys, %.2f recorded. Process CPU: %.1f%%",
+            rates['move'], rates['click'], rates['scroll'], rates['key'], rates['recorded'], rates['cpu_percent']
         )
-    print("Tracker stopped.")
+        dump_metrics()
+        logger.info("Tracker stopped.")
+
+def dump_metrics(*_):
+    """Writes the process's metrics to METRICS_FILE. Also the SIGUSR1 handler."""
+    try:
+        metrics.dump(METRICS_FILE)
+    except OSError as e:
+        logger.warning("Could not write metrics to %s: %s", METRICS_FILE, e)
 
 def stop_tracking():
-    """Signals the tracking loop to stop gracefully."""
-    global tracking_active
-    tracking_active.clear()
+    """Signals the tracker engine to stop gracefully. Safe to call from any thread."""
+    if engine:
+        engine.request_stop()
 
 def main_menu():
     """Presents the main menu to the user."""
@@ -357,7 +282,7 @@ def main_menu():
         print("1. Start Tracking")
         print("2. Manage Rules")
         print("3. Exit")
-        choice = input("> ")
+        choice = console.input("> ")
 
         if choice == '1':
             print("Starting tracking... (Press Ctrl+C to stop tracking and return to menu)")
@@ -367,18 +292,22 @@ def main_menu():
                 start_tracking() # Run in main thread, blocks main_menu
             except KeyboardInterrupt:
                 print("\nTracking interrupted by user. Returning to main menu.")
-            # After start_tracking returns (e.g., due to Ctrl+C),
-            # ensure tracking_active is cleared and any pending activities are logged.
-            stop_tracking() # Ensure graceful shutdown
+            # start_tracking() has already stopped the engine and logged pending activities,
+            # including after Ctrl+C; this only guards against an engine left running.
+            stop_tracking()
         elif choice == '2':
             manage_rules()
         elif choice == '3':
             print("Exiting Time Tracker. Goodbye!")
+            db.close_connections()
             break
         else:
             print("Invalid choice. Please try again.")
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("TIMETRACKER_LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    if hasattr(signal, "SIGUSR1"): # Not on Windows
+        signal.signal(signal.SIGUSR1, dump_metrics)
     db.create_tables()
     main_menu()
\ No newline at end of file
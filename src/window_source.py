@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+try:
+    from . import metrics
+except ImportError:  # Run as a script from src/ (python src/tracker.py)
+    import metrics
+
+SAMPLE_SECONDS = metrics.histogram("timetracker_window_sample_seconds", "Time to read the focused window once.")
+
+# One observation of the focused window. observed_at is when the switch was
+# seen, so activity boundaries don't inherit the tracker loop's wake-up delay.
+WindowSample = namedtuple("WindowSample", ["app_name", "window_title", "observed_at"])
+
+NO_WINDOW = ("No Active Window", "")
+
+def get_active_window():
+    """Returns (app_name, window_title) for the focused window using pygetwindow."""
+    import pygetwindow as gw # Imported lazily so headless sources work where it is unavailable
+    try:
+        active_window = gw.getActiveWindow()
+        if active_window:
+            return active_window.title(), active_window.title()
+    except Exception:
+        pass
+    return NO_WINDOW
+
+
+class WindowSource:
+    """
+    Base class for where the tracker loop gets the active window from.
+
+    wait(timeout) blocks until the focused window changes or timeout seconds
+    pass, and returns the latest WindowSample either way, so the loop can keep
+    doing its AFK and check-in bookkeeping on a fixed cadence.
+    """
+
+    def __init__(self):
+        self.latest = WindowSample(*NO_WINDOW, datetime.now())
+        self.closed = False # True once the source can produce no more samples
+
+    def wait(self, timeout):
+        raise NotImplementedError
+
+    def now(self):
+        """The source's clock, used to date activities that don't start at a switch."""
+        return datetime.now()
+
+    def close(self):
+        self.closed = True
+
+
+class PollingWindowSource(WindowSource):
+    """
+    Polls a getter with an adaptive interval.
+
+    After a change the interval drops to min_interval so quick switches are
+    caught; while the window stays the same it grows by backoff up to
+    max_interval, so a stable desktop costs few wake-ups.
+    """
+
+    def __init__(self, getter=get_active_window, min_interval=0.5, max_interval=5.0, backoff=1.5):
+        super().__init__()
+        self.getter = getter
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.polls = 0
+        self._poll()
+
+    def _poll(self):
+        self.polls += 1
+        with SAMPLE_SECONDS.time():
+            app_name, window_title = self.getter()
+        if (app_name, window_title) != (self.latest.app_name, self.latest.window_title):
+            self.latest = WindowSample(app_name, window_title, datetime.now())
+            return True
+        return False
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.interval, remaining))
+            if self._poll():
+                self.interval = self.min_interval
+                break
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.latest
+
+
+class EventWindowSource(WindowSource):
+    """
+    Base for platforms that push focus-change notifications.
+
+    A subclass registers its platform hook in start() and calls notify() from
+    whatever thread the hook runs on; wait() wakes as soon as that happens.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._changed = threading.Condition()
+        self._pending = False
+
+    def start(self):
+        """Registers the platform hook. Subclasses override this."""
+
+    def notify(self, app_name, window_title, observed_at=None):
+        """Records a focus change; safe to call from any thread."""
+        with self._changed:
+            self.latest = WindowSample(app_name, window_title, observed_at or datetime.now())
+            self._pending = True
+            self._changed.notify_all()
+
+    def wait(self, timeout):
+        with self._changed:
+            if not self._pending and not self.closed:
+                self._changed.wait(timeout)
+            self._pending = False
+            return self.latest
+
+    def close(self):
+        with self._changed:
+            super().close()
+            self._changed.notify_all()
+
+
+class ReplayWindowSource(WindowSource):
+    """
+    Plays back a scripted sequence of windows, for headless tests and benchmarks.
+
+    events is a list of (offset_seconds, app_name, window_title). Samples are
+    stamped at start time + offset, so recorded durations follow the script
+    regardless of speed. speed=1 replays in real time, speed=10 ten times
+    faster, and speed=0 returns the next event on every wait() without sleeping.
+    The source closes after the last event.
+    """
+
+    def __init__(self, events, speed=1.0, start=None):
+        super().__init__()
+        self.events = sorted(events)
+        self.speed = speed
+        self.start = start or datetime.now()
+        self._position = 0
+        self._started = time.monotonic()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Loads events from a JSON-lines file of {"t": seconds, "app": ..., "title": ...} objects."""
+        events = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    event = json.loads(line)
+                    title = event.get("title", "")
+                    events.append((event["t"], event.get("app", title), title))
+        return cls(events, **kwargs)
+
+    def now(self):
+        return self.latest.observed_at if self._position else self.start
+
+    def wait(self, timeout):
+        if self._position >= len(self.events):
+            self.close()
+            return self.latest
+        offset, app_name, window_title = self.events[self._position]
+        if self.speed:
+            due = self._started + offset / self.speed
+            delay = due - time.monotonic()
+            if delay > timeout:
+                time.sleep(timeout)
+                return self.latest
+            if delay > 0:
+                time.sleep(delay)
+        self._position += 1
+        self.latest = WindowSample(app_name, window_title, self.start + timedelta(seconds=offset))
+        return self.latest